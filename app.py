@@ -2,7 +2,12 @@ import streamlit as st
 import os
 import json
 import pandas as pd
-import tempfile
+import time
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from io import BytesIO
 import json
 import pandas as pd
@@ -12,6 +17,10 @@ try:
     from extractor import extract_chunks_from_termsheet
     from parser import parse_with_llm_gemini, parse_with_llm
     from config import CHUNK_SIZE, OVERLAP, PROMPTS_FILE, TOP_K, GEMINI_MODEL, GROQ_MODEL
+    from config import APP_WORKERS, APP_MEMO_MAX
+    from results import ResultTable
+    from sinks import make_sink
+    from metrics import STAGES, document, get_metrics, summarize
 except ImportError as e:
     st.error(f"Error importing modules: {e}. Make sure extractor.py, parser.py, and config.py are in the same directory.")
     st.stop()
@@ -47,8 +56,130 @@ with st.sidebar:
     overlap = st.number_input("Overlap", value=OVERLAP)
     top_k = st.number_input("Top K Context", value=TOP_K)
     
+    output_format = st.selectbox("Download Format", ["Excel", "Parquet", "CSV", "JSONL"])
+
     st.info(f"Using Prompts from: `{PROMPTS_FILE}`")
 
+# (file extension, MIME type) of each download format
+DOWNLOAD_FORMATS = {
+    "Excel": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+    "CSV": ("csv", "text/csv"),
+    "JSONL": ("jsonl", "application/jsonl"),
+}
+
+# --- Processing ---
+
+@st.cache_resource
+def result_memo() -> dict:
+    """Process-wide memo of extraction/parse results, keyed by file-content hash; survives reruns."""
+    return {"lock": threading.Lock(), "entries": OrderedDict()}
+
+
+def _memoised(memo, key, compute):
+    with memo["lock"]:
+        if key in memo["entries"]:
+            memo["entries"].move_to_end(key)
+            return memo["entries"][key], True
+    value = compute()
+    with memo["lock"]:
+        memo["entries"][key] = value
+        while len(memo["entries"]) > APP_MEMO_MAX:
+            memo["entries"].popitem(last=False)
+    return value, False
+
+
+def process_upload(pos, name, data, settings, memo, status, doc_id):
+    """
+    Extract and parse one uploaded PDF straight from memory (runs in a worker
+    thread, so no Streamlit calls here; progress goes through status[pos]).
+    Timings and token usage are recorded under doc_id (see metrics.py).
+    """
+    with document(doc_id):
+        return _process_upload(pos, name, data, settings, memo, status)
+
+
+def _process_upload(pos, name, data, settings, memo, status):
+    provider, model, chunk_size, overlap, top_k = settings
+    content_hash = hashlib.sha256(data).hexdigest()
+
+    # 1. Extract Chunks (from bytes; no temporary file needed)
+    status[pos] = "🔄 Extracting"
+    # The name is part of the key: chunks carry it as their folder
+    chunks, _ = _memoised(memo, ("chunks", content_hash, chunk_size, overlap, name), lambda: extract_chunks_from_termsheet(
+        data,
+        chunk_size=chunk_size,
+        overlap=overlap,
+        folder_name=name
+    ))
+
+    # 2. Parse with LLM
+    status[pos] = f"🔄 Parsing with {provider}"
+    def parse():
+        if provider == "Gemini":
+            # Ensure parser.py uses the key from os.environ
+            return parse_with_llm_gemini(chunks, PROMPTS_FILE, gemini_model=model, top_k=top_k)
+        return parse_with_llm(chunks, PROMPTS_FILE, groq_model=model, top_k=top_k)
+    parsed_data, cached = _memoised(memo, ("parsed", content_hash) + settings, parse)
+
+    # 3. Flatten results for the DataFrame
+    rows = []
+    for item in parsed_data:
+        # The result is inside item['result']
+        row_data = item.get("result", {})
+
+        # If the result is just a wrapper, try to extract the inner dict
+        if isinstance(row_data, str):
+            # Fallback if parsing failed deeply
+            row_data = {"raw_output": row_data}
+
+        # Add metadata (on a copy, so memoised results stay untouched)
+        row_data = dict(row_data)
+        row_data["Source File"] = name
+        rows.append(row_data)
+
+    status[pos] = "✅ Done (cached)" if cached else "✅ Done"
+    return rows
+
+
+def show_run_summary(files, doc_ids, elapsed):
+    """Summary panel: stage timings, LLM calls, tokens and retries of this run."""
+    metrics = get_metrics()
+    if metrics is None:
+        return
+    # Popped so the process-wide collector does not grow across reruns
+    per_file = [(name, metrics.pop_document(doc_id)) for (name, _), doc_id in zip(files, doc_ids)]
+    totals = summarize([s for _, s in per_file if s])
+    llm = totals["llm_total"]
+
+    st.subheader("Run Summary")
+    cols = st.columns(5)
+    cols[0].metric("Wall Time", f"{elapsed:.1f} s")
+    cols[1].metric("LLM Calls", llm["calls"], help=f"{llm['cache_hits']} answered from the LLM cache")
+    cols[2].metric("Prompt Tokens", f"{llm['prompt_tokens']:,}")
+    cols[3].metric("Completion Tokens", f"{llm['completion_tokens']:,}")
+    cols[4].metric("Retries", llm["retries"])
+
+    spans = totals["spans"]
+    if spans:
+        st.dataframe(pd.DataFrame([{"Stage": s, "Seconds": round(spans[s]["seconds"], 3), "Count": spans[s]["count"]}
+                                   for s in STAGES if s in spans]), hide_index=True)
+    if totals["rules"]:
+        st.caption(f"Fields filled by rules before the LLM call ({totals['llm_skipped']} LLM calls skipped)")
+        st.dataframe(pd.DataFrame([{"Field": f, "Hits": r["hits"], "Checked": r["checked"],
+                                    "Hit Rate": totals["rule_hit_rate"].get(f, 0.0)}
+                                   for f, r in totals["rules"].items()]), hide_index=True)
+    with st.expander("Per File"):
+        rows = []
+        for name, stats in per_file:
+            summary = summarize([stats] if stats else [])
+            row = {"File": name}
+            row.update({s: round(summary["spans"][s]["seconds"], 3) for s in STAGES if s in summary["spans"]})
+            row.update({k: summary["llm_total"][k] for k in ("prompt_tokens", "completion_tokens", "retries")})
+            rows.append(row)
+        st.dataframe(pd.DataFrame(rows), hide_index=True)
+
+
 # --- Main Interface ---
 
 uploaded_files = st.file_uploader("Upload Term Sheet PDFs", type=["pdf"], accept_multiple_files=True)
@@ -59,132 +190,72 @@ if st.button("Start Extraction", type="primary", disabled=not uploaded_files):
         st.warning("Please enter an API Key in the sidebar to proceed.")
         st.stop()
 
-    all_results = []
+    settings = (model_provider, model_name, int(chunk_size), int(overlap), int(top_k))
+    memo = result_memo()
+    files = [(f.name, f.getvalue()) for f in uploaded_files]
+    status = ["⏳ Queued"] * len(files)
+
     progress_bar = st.progress(0)
     status_text = st.empty()
+    file_rows = [st.empty() for _ in files]
+    results_table = ResultTable(first_columns=["Source File"])
+    run_id = uuid.uuid4().hex
+    doc_ids = [f"{run_id}:{pos}" for pos in range(len(files))]
+    started = time.perf_counter()
 
-    for idx, uploaded_file in enumerate(uploaded_files):
-        status_text.text(f"Processing: {uploaded_file.name}...")
-        
-        # 1. Save uploaded file to a temporary file 
-        # (Necessary because extractor.py expects a file path for pdfplumber)
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-            tmp_file.write(uploaded_file.getvalue())
-            tmp_file_path = tmp_file.name
-
-        try:
-            # 2. Extract Chunks
-            chunks = extract_chunks_from_termsheet(
-                tmp_file_path,
-                chunk_size=chunk_size,
-                overlap=overlap,
-                folder_name=uploaded_file.name
-            )
-
-            # 3. Parse with LLM
-            if model_provider == "Gemini":
-                # Ensure parser.py uses the key from os.environ
-                parsed_data = parse_with_llm_gemini(chunks, PROMPTS_FILE, gemini_model=model_name, top_k=top_k)
-            else:
-                parsed_data = parse_with_llm(chunks, PROMPTS_FILE, groq_model=model_name, top_k=top_k)
-
-            # 4. Flatten results for the DataFrame
-            for item in parsed_data:
-                # The result is inside item['result']
-                row_data = item.get("result", {})
-                
-                # If the result is just a wrapper, try to extract the inner dict
-                if isinstance(row_data, str):
-                    # Fallback if parsing failed deeply
-                    row_data = {"raw_output": row_data}
-                
-                # Add metadata
-                row_data["Source File"] = uploaded_file.name
-                all_results.append(row_data)
-
-        except Exception as e:
-            st.error(f"Error processing {uploaded_file.name}: {str(e)}")
-        
-        finally:
-            # Cleanup temp file
-            if os.path.exists(tmp_file_path):
-                os.remove(tmp_file_path)
-
-        # Update Progress
-        progress_bar.progress((idx + 1) / len(uploaded_files))
+    with ThreadPoolExecutor(max_workers=max(1, min(APP_WORKERS, len(files)))) as pool:
+        futures = [pool.submit(process_upload, pos, name, data, settings, memo, status, doc_ids[pos])
+                   for pos, (name, data) in enumerate(files)]
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=0.25, return_when=FIRST_COMPLETED)
+            for future in done:
+                pos = futures.index(future)
+                if future.exception() is not None:
+                    status[pos] = "❌ Error"
+                    st.error(f"Error processing {files[pos][0]}: {str(future.exception())}")
+                    continue
+                # Rows go straight into typed columns, kept in upload order
+                for row in future.result():
+                    results_table.add(row, sort_key=pos)
+            # Widgets are only touched from the script thread
+            for pos, row in enumerate(file_rows):
+                row.text(f"{status[pos]}  {files[pos][0]}")
+            finished = len(futures) - len(pending)
+            progress_bar.progress(finished / len(futures))
+            status_text.text(f"Processed {finished} of {len(futures)} files...")
 
     status_text.text("Processing Complete!")
+    show_run_summary(files, doc_ids, time.perf_counter() - started)
     
     # --- Results Display ---
-    if all_results:
+    if len(results_table):
         st.subheader("Extracted Data")
         
-        # Convert to DataFrame
-        df = pd.DataFrame(all_results)
-        
-        # Reorder columns to put "Source File" first if possible
-        cols = ["Source File"] + [c for c in df.columns if c != "Source File"]
-        df = df[cols]
-        # --- Normalize DataFrame to avoid pyarrow ArrowInvalid (mixed list vs scalar) ---
-
-
-        def normalize_cell_for_arrow(x):
-            # convert list/tuple -> comma-joined string (if possible) otherwise JSON
-            if isinstance(x, (list, tuple)):
-                # if elements are simple scalars, join them; else use json.dumps
-                simple = all(not isinstance(i, (list, tuple, dict)) for i in x)
-                if simple:
-                    try:
-                        return ", ".join("" if i is None else str(i) for i in x)
-                    except Exception:
-                        return json.dumps(x, ensure_ascii=False)
-                else:
-                    return json.dumps(x, ensure_ascii=False)
-            # convert dict -> json string
-            if isinstance(x, dict):
-                return json.dumps(x, ensure_ascii=False)
-            # convert NaN/None -> empty string
-            if pd.isna(x):
-                return ""
-            # leave simple scalars as-is, otherwise stringify
-            if isinstance(x, (str, int, float, bool)):
-                return x
-            return str(x)
-
-        # Detect columns that contain list/tuple/dict values
-        problem_cols = [c for c in df.columns if df[c].apply(lambda v: isinstance(v, (list, tuple, dict))).any()]
-
-        if problem_cols:
-            # optional debug: show names and some sample values for inspection
-            st.warning(f"Normalizing columns for Arrow compatibility: {problem_cols}")
-            for c in problem_cols:
-                try:
-                    st.write(f"Samples from `{c}`:", df[c].dropna().head(5).tolist())
-                except Exception:
-                    pass
-
-            # Apply normalization to only the problem columns for performance
-            for c in problem_cols:
-                df[c] = df[c].apply(normalize_cell_for_arrow)
-
-        # Additional safety: convert any remaining object-typed column to strings if PyArrow might still complain
-        for c in df.select_dtypes(include=['object']).columns:
-            # if column still contains non-string types, coerce to string but preserve empty string for NaN
-            if not df[c].map(lambda v: isinstance(v, str)).all():
-                df[c] = df[c].apply(lambda v: "" if pd.isna(v) else str(v))
-
-        st.dataframe(df)
-
-        # --- Excel Download ---
+        # Columns were typed and normalized as rows were added (see results.py)
+        if results_table.normalized_columns:
+            st.warning(f"Normalized columns for Arrow compatibility: {results_table.normalized_columns}")
+        table = results_table.to_arrow()
+        df = table.to_pandas()
+
+        st.dataframe(table)
+
+        # --- Download ---
         buffer = BytesIO()
-        with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
-            df.to_excel(writer, index=False, sheet_name='EXPORT')
-            
+        if output_format == "Excel":
+            with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
+                df.to_excel(writer, index=False, sheet_name='EXPORT')
+        else:
+            # Same sinks as main.py, writing into the in-memory buffer
+            with make_sink(output_format.lower(), buffer, columns=table.column_names) as sink:
+                sink.write_many(table.to_pylist())
+
+        extension, mime = DOWNLOAD_FORMATS[output_format]
         st.download_button(
-            label="📥 Download Excel Report",
+            label=f"📥 Download {output_format} Report",
             data=buffer.getvalue(),
-            file_name="TermSheet_Output.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            file_name=f"TermSheet_Output.{extension}",
+            mime=mime
         )
     else:
         st.warning("No data extracted. Please check the PDF content or Prompts.")
\ No newline at end of file
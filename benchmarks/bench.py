@@ -0,0 +1,264 @@
+"""
+bench.py
+- Benchmark suite for the Term Sheet pipeline, on synthetic PDFs
+  (synthetic.py) and a fake Groq/Gemini (fake_llm.py); no network or API
+  keys needed
+  - extract: extract_text_from_pdf pages/s per backend (page cache off)
+  - chunk: chunk_text throughput (MB/s, chunks/s)
+  - retrieval: build_tfidf_index and retrieve_top_k latency vs chunk count
+  - writer: rows/s per output sink (see sinks.py)
+  - e2e: main.py end to end, documents/min and peak RSS (run in a child
+    process with its own working directory, so caches start cold)
+- Results are saved as JSON (benchmarks/results/bench-<time>.json by
+  default) together with the git commit and machine details, so runs can be
+  compared over time.
+
+    python benchmarks/bench.py                 # full suite
+    python benchmarks/bench.py --quick         # smaller sizes
+    python benchmarks/bench.py --only e2e --latency 0.5 --docs 50
+"""
+
+import io
+import os
+import sys
+import json
+import contextlib
+import time
+import shutil
+import platform
+import argparse
+import statistics
+import subprocess
+import tempfile
+from typing import Callable, Dict, List
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, HERE)
+
+import synthetic  # noqa: E402
+import fake_llm  # noqa: E402
+
+BENCHMARKS = ("extract", "chunk", "retrieval", "writer", "e2e")
+WRITER_EXTENSIONS = {"excel": "xlsx", "jsonl": "jsonl", "csv": "csv", "parquet": "parquet"}
+
+
+def timed(fn: Callable, repeat: int) -> Dict:
+    """Run fn `repeat` times; seconds as best / median."""
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - start)
+    return {"best_s": min(runs), "median_s": statistics.median(runs), "runs": len(runs)}
+
+
+def peak_rss_mb(include_children: bool = True) -> float:
+    """Peak resident set size in MB (worker processes included), or None where unsupported."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is KiB on Linux, bytes on macOS; children is the largest child, not a sum
+    scale = 1.0 if sys.platform == "darwin" else 1024.0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if include_children:
+        rss += resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(rss * scale / (1024 * 1024), 1)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+# ---------------- Benchmarks ---------------- #
+
+def bench_extract(workdir: str, pages: int, repeat: int) -> Dict:
+    from extractor import BACKENDS, extract_text_from_pdf
+
+    path = synthetic.make_termsheet_pdf(os.path.join(workdir, "extract.pdf"), pages=pages, seed=1)
+    out = {"pages": pages}
+    for backend in BACKENDS:
+        t = timed(lambda: extract_text_from_pdf(path, use_cache=False, backend=backend, workers=1), repeat)
+        t["pages_per_s"] = round(pages / t["best_s"], 1)
+        out[backend] = t
+    return out
+
+
+def bench_chunk(n_chars: int, repeat: int) -> Dict:
+    from extractor import chunk_text
+    from config import CHUNK_SIZE, OVERLAP
+
+    text = synthetic.synthetic_text(n_chars)
+    n_chunks = len(chunk_text(text, chunk_size=CHUNK_SIZE, overlap=OVERLAP))
+    t = timed(lambda: chunk_text(text, chunk_size=CHUNK_SIZE, overlap=OVERLAP), repeat)
+    t.update({"chars": len(text), "chunk_size": CHUNK_SIZE, "overlap": OVERLAP, "chunks": n_chunks,
+              "mb_per_s": round(len(text) / t["best_s"] / 1e6, 1),
+              "chunks_per_s": round(n_chunks / t["best_s"], 1)})
+    return t
+
+
+def bench_retrieval(chunk_counts: List[int], repeat: int) -> Dict:
+    from parser import build_tfidf_index, retrieve_top_k, load_prompts
+    from config import PROMPTS_FILE, TOP_K
+
+    prompt = load_prompts(os.path.join(ROOT, PROMPTS_FILE))[0]
+    query = prompt["instruction"] + " " + " ".join(prompt["json_schema"])
+    # ~1 KB chunks, each from a different synthetic document page
+    chunks_all = [{"chunk": "\n".join(synthetic.page_lines(i // 5, i % 5 + 1))[:1000]}
+                  for i in range(max(chunk_counts))]
+
+    out = {"top_k": TOP_K, "by_chunks": []}
+    for n in chunk_counts:
+        chunks = chunks_all[:n]
+        index = build_tfidf_index(chunks)
+        build = timed(lambda: build_tfidf_index(chunks), repeat)
+        retrieve = timed(lambda: retrieve_top_k(query, index, k=TOP_K), max(repeat, 5))
+        out["by_chunks"].append({"chunks": n, "build_ms": round(build["best_s"] * 1000, 2),
+                                 "retrieve_ms": round(retrieve["best_s"] * 1000, 3)})
+    return out
+
+
+def bench_writer(workdir: str, rows: int, repeat: int) -> Dict:
+    from sinks import SINKS, make_sink
+
+    data = [dict(synthetic.termsheet_fields(i), Source=f"termsheet_{i:04d}.pdf") for i in range(rows)]
+    out = {"rows": rows}
+    for kind in sorted(SINKS):
+        target = os.path.join(workdir, "writer." + WRITER_EXTENSIONS[kind])
+
+        def write():
+            if os.path.isdir(target):
+                shutil.rmtree(target)
+            elif os.path.exists(target):
+                os.remove(target)
+            with contextlib.redirect_stdout(io.StringIO()), make_sink(kind, target) as sink:
+                for i in range(0, rows, 10):
+                    sink.write_many(data[i:i + 10], key=str(i))
+        t = timed(write, repeat)
+        t["rows_per_s"] = round(rows / t["best_s"], 1)
+        out[kind] = t
+    return out
+
+
+def _e2e_child(provider: str, latency: float, workers: int, llm_workers: int) -> Dict:
+    """Runs inside the child process, with cwd = workdir."""
+    fake_llm.install(latency=latency)
+    import main
+
+    n_docs = len(main.find_all_pdfs(main.MAIN_FOLDER))
+    argv = ["--provider", provider, "--sink", "jsonl", "--workers", str(workers)]
+    if llm_workers:
+        argv += ["--llm-workers", str(llm_workers)]
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        main.main(argv)
+    elapsed = time.perf_counter() - start
+    with open("TermSheet Output.jsonl", encoding="utf-8") as f:
+        rows = sum(1 for _ in f)
+    return {"docs": n_docs, "rows": rows, "seconds": round(elapsed, 3),
+            "docs_per_min": round(n_docs / elapsed * 60, 1), "peak_rss_mb": peak_rss_mb()}
+
+
+def bench_e2e(workdir: str, docs: int, pages: int, provider: str, latency: float,
+              workers: int, llm_workers: int) -> Dict:
+    from config import MAIN_FOLDER
+
+    run_dir = os.path.join(workdir, "e2e")
+    synthetic.make_corpus(os.path.join(run_dir, MAIN_FOLDER), docs, pages=pages)
+    shutil.copytree(os.path.join(ROOT, "Prompts"), os.path.join(run_dir, "Prompts"))
+
+    cmd = [sys.executable, os.path.abspath(__file__), "--e2e-child", run_dir,
+           "--provider", provider, "--latency", str(latency), "--workers", str(workers),
+           "--llm-workers", str(llm_workers)]
+    proc = subprocess.run(cmd, cwd=run_dir, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"e2e run failed:\n{proc.stderr}")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result.update({"pages_per_doc": pages, "provider": provider, "latency_s": latency,
+                   "workers": workers, "llm_workers": llm_workers or None})
+    return result
+
+
+# ---------------- Runner ---------------- #
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark the Term Sheet pipeline on synthetic data.")
+    ap.add_argument("--only", nargs="+", choices=BENCHMARKS, default=list(BENCHMARKS),
+                    help="benchmarks to run (default: all)")
+    ap.add_argument("--quick", action="store_true", help="smaller sizes, for a fast sanity run")
+    ap.add_argument("--repeat", type=int, default=3, help="repetitions per measurement (best is reported)")
+    ap.add_argument("--pages", type=int, default=None, help="pages per PDF (default: 50, quick: 10)")
+    ap.add_argument("--docs", type=int, default=None, help="documents in the e2e run (default: 40, quick: 8)")
+    ap.add_argument("--provider", choices=["gemini", "groq"], default="gemini", help="fake provider for e2e")
+    ap.add_argument("--latency", type=float, default=0.2, help="fake LLM latency per call, seconds")
+    ap.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                    help="extraction processes in the e2e run")
+    ap.add_argument("--llm-workers", type=int, default=0,
+                    help="concurrent LLM calls in the e2e run (default: config.py)")
+    ap.add_argument("--out", default=None, help="results JSON path (default: benchmarks/results/bench-<time>.json)")
+    ap.add_argument("--e2e-child", metavar="DIR", default=None, help=argparse.SUPPRESS)
+    return ap.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.e2e_child:
+        os.chdir(args.e2e_child)
+        print(json.dumps(_e2e_child(args.provider, args.latency, args.workers, args.llm_workers)))
+        return
+
+    pages = args.pages or (10 if args.quick else 50)
+    docs = args.docs or (8 if args.quick else 40)
+    chunk_counts = [100, 1000] if args.quick else [100, 1000, 5000, 20000]
+    chunk_chars = 1_000_000 if args.quick else 20_000_000
+    writer_rows = 500 if args.quick else 5000
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "quick": args.quick,
+            "repeat": args.repeat,
+        },
+        "results": {},
+    }
+
+    workdir = tempfile.mkdtemp(prefix="termsheet-bench-")
+    try:
+        for name in args.only:
+            print(f"Running {name} ...", flush=True)
+            if name == "extract":
+                res = bench_extract(workdir, pages, args.repeat)
+            elif name == "chunk":
+                res = bench_chunk(chunk_chars, args.repeat)
+            elif name == "retrieval":
+                res = bench_retrieval(chunk_counts, args.repeat)
+            elif name == "writer":
+                res = bench_writer(workdir, writer_rows, args.repeat)
+            else:
+                res = bench_e2e(workdir, docs, pages, args.provider, args.latency,
+                                args.workers, args.llm_workers)
+            report["results"][name] = res
+            print(f"✅ {name}: {json.dumps(res)}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    out = args.out or os.path.join(HERE, "results", f"bench-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Results saved to {out}")
+
+
+if __name__ == "__main__":
+    main()
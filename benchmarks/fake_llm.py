@@ -0,0 +1,104 @@
+"""
+fake_llm.py
+- Deterministic local stand-ins for the Groq and Gemini clients, so the
+  pipeline can be benchmarked without network calls or API keys
+  - answers every prompt with its OUTPUT_SCHEMA filled from "Key: value"
+    lines found in the CONTEXT (what the synthetic term sheets contain)
+  - each call sleeps `latency` seconds to model provider response time
+  - streamed calls (Groq stream=True, Gemini generate_content_stream) yield
+    the same answer in small pieces, with usage on the last chunk
+- install(latency): point gateway.py's provider registry at the fakes, lift
+  the provider rate limits and set dummy API keys
+"""
+
+import os
+import re
+import json
+import time
+from types import SimpleNamespace
+from typing import Dict
+
+_SCHEMA_RE = re.compile(r"OUTPUT_SCHEMA / EXAMPLE:\s*(\{.*?\n\})", re.S)
+
+
+def fake_answer(user_content: str) -> str:
+    m = _SCHEMA_RE.search(user_content)
+    try:
+        schema = json.loads(m.group(1)) if m else {}
+    except ValueError:
+        schema = {}
+    context = user_content.split("INSTRUCTION:", 1)[0]
+    result: Dict[str, str] = {}
+    for key in schema:
+        found = re.search(r"^" + re.escape(key) + r":\s*(.+)$", context, re.M)
+        result[key] = found.group(1).strip() if found else ""
+    return json.dumps(result)
+
+
+def _tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def _pieces(text: str, size: int = 16):
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+
+class FakeGroq:
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, model, messages, temperature=0.0, stream=False, **kwargs):
+        time.sleep(self.latency)
+        user = "\n".join(m["content"] for m in messages if m["role"] == "user")
+        content = fake_answer(user)
+        usage = SimpleNamespace(prompt_tokens=_tokens(user), completion_tokens=_tokens(content),
+                                total_tokens=_tokens(user) + _tokens(content))
+        if stream:
+            return self._stream(content, usage)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=usage,
+        )
+
+    @staticmethod
+    def _stream(content, usage):
+        for piece in _pieces(content):
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))], x_groq=None)
+        yield SimpleNamespace(choices=[], x_groq=SimpleNamespace(usage=usage))
+
+
+class FakeGemini:
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.models = SimpleNamespace(generate_content=self._generate, generate_content_stream=self._generate_stream)
+
+    def _generate(self, model, contents, config=None, **kwargs):
+        time.sleep(self.latency)
+        user = "\n".join(contents) if isinstance(contents, list) else str(contents)
+        content = fake_answer(user)
+        return SimpleNamespace(
+            text=content,
+            usage_metadata=SimpleNamespace(prompt_token_count=_tokens(user),
+                                           total_token_count=_tokens(user) + _tokens(content)),
+        )
+
+    def _generate_stream(self, model, contents, config=None, **kwargs):
+        resp = self._generate(model, contents, config=config, **kwargs)
+        pieces = _pieces(resp.text)
+        for i, piece in enumerate(pieces):
+            yield SimpleNamespace(text=piece, usage_metadata=resp.usage_metadata if i == len(pieces) - 1 else None)
+
+
+def install(latency: float = 0.0) -> None:
+    import gateway
+
+    fakes = {"groq": FakeGroq, "gemini": FakeGemini}
+    for name, fake in fakes.items():
+        gateway.PROVIDERS[name] = gateway.PROVIDERS[name]._replace(make_client=lambda api_key, f=fake: f(latency))
+    # No rate limits: the benchmark measures the pipeline, not the provider quota
+    gateway._gateway = gateway.ProviderGateway(limits={})
+    os.environ.setdefault("GROQ_API_KEY", "fake")
+    os.environ.setdefault("GEMINI_API_KEY", "fake")
@@ -0,0 +1,109 @@
+"""
+import_check.py
+- Import-time regression check: fails (exit code 1) when importing the
+  pipeline modules pulls in a provider SDK or a heavy library, or takes
+  longer than the budget
+  - each module is imported in a fresh interpreter, so earlier imports
+    don't hide the cost
+  - a spawned worker process (multiprocessing "spawn", the default on
+    Windows and macOS) is checked the same way after importing pipeline.py
+
+    python benchmarks/import_check.py
+    python benchmarks/import_check.py --budget-ms 300 --json import_times.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+MODULES = ("parser", "main", "pipeline", "extractor", "gateway", "sinks", "writer", "journal", "metrics", "dedup", "watcher")
+
+# Must only be imported on first use
+HEAVY = ("groq", "google.genai", "sklearn", "numpy", "scipy", "pdfplumber", "pypdf",
+         "pyarrow", "pandas", "openpyxl", "tiktoken", "dotenv")
+
+_PROBE = (
+    "import sys, time, json\n"
+    "t = time.perf_counter()\n"
+    "import {module}\n"
+    "dt = time.perf_counter() - t\n"
+    "print(json.dumps({{'seconds': dt, 'modules': sorted(sys.modules)}}))\n"
+)
+
+
+def probe(module: str) -> dict:
+    """Import `module` in a fresh interpreter; returns seconds and loaded heavy modules."""
+    best = None
+    for _ in range(3):
+        proc = subprocess.run([sys.executable, "-c", _PROBE.format(module=module)], cwd=ROOT,
+                              capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise RuntimeError(f"import {module} failed:\n{proc.stderr}")
+        out = json.loads(proc.stdout.strip().splitlines()[-1])
+        if best is None or out["seconds"] < best["seconds"]:
+            best = out
+    heavy = sorted(h for h in HEAVY if h in best["modules"])
+    return {"ms": round(best["seconds"] * 1000, 1), "heavy": heavy}
+
+
+def _worker_probe() -> dict:
+    t = time.perf_counter()
+    import pipeline  # noqa: F401  (what an extraction worker unpickles its job from)
+    dt = time.perf_counter() - t
+    return {"import_ms": round(dt * 1000, 1), "heavy": sorted(h for h in HEAVY if h in sys.modules)}
+
+
+def probe_spawn() -> dict:
+    """Start one spawned worker and run a job that imports pipeline.py."""
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        out = pool.submit(_worker_probe).result()
+    out["spawn_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return out
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Check that pipeline modules import cheaply.")
+    ap.add_argument("--budget-ms", type=float, default=500.0, help="max import time per module (default: 500)")
+    ap.add_argument("--json", default=None, help="also write the measurements to this file")
+    args = ap.parse_args(argv)
+
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+
+    failures = []
+    results = {}
+    for module in MODULES:
+        res = results[module] = probe(module)
+        ok = not res["heavy"] and res["ms"] <= args.budget_ms
+        print(f"{'✅' if ok else '❌'} import {module}: {res['ms']} ms" + (f", loads {res['heavy']}" if res["heavy"] else ""))
+        if not ok:
+            failures.append(module)
+
+    res = results["spawned worker"] = probe_spawn()
+    ok = not res["heavy"] and res["import_ms"] <= args.budget_ms
+    print(f"{'✅' if ok else '❌'} spawned worker: started in {res['spawn_ms']} ms, "
+          f"import pipeline {res['import_ms']} ms" + (f", loads {res['heavy']}" if res["heavy"] else ""))
+    if not ok:
+        failures.append("spawned worker")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"budget_ms": args.budget_ms, "results": results}, f, indent=2)
+
+    if failures:
+        print(f"❌ Import check failed: {', '.join(failures)}")
+        sys.exit(1)
+    print("✅ Import check passed")
+
+
+if __name__ == "__main__":
+    main()
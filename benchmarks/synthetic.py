@@ -0,0 +1,107 @@
+"""
+synthetic.py
+- Deterministic synthetic Term Sheet PDFs for the benchmarks (reportlab)
+  - termsheet_fields(seed): the field values a document carries
+  - page_lines(seed, page): text lines of one page
+  - make_termsheet_pdf(path, pages, seed): write one PDF
+  - make_corpus(folder, n_docs, pages): write n_docs PDFs, returns their paths
+  - synthetic_text(n_chars, seed): plain term-sheet-like text (no PDF)
+The same seed always produces the same document.
+"""
+
+import os
+import random
+from typing import Dict, List
+
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+ISSUERS = ["Foo Bank plc", "Northwind Capital S.A.", "Contoso Finance B.V.", "Fabrikam Holdings AG",
+           "Tailspin Funding Ltd", "Adatum Treasury Corp."]
+CURRENCIES = ["EUR", "USD", "GBP", "CHF", "JPY"]
+RATINGS = [("Aa3", "AA-", "AA-"), ("A2", "A", "A+"), ("Baa1", "BBB+", "BBB"), ("Ba2", "BB", "BB+")]
+FILLER = ("The Notes constitute direct, unconditional and unsubordinated obligations of the Issuer and "
+          "rank pari passu among themselves. Payments of principal and interest shall be made without "
+          "withholding or deduction for or on account of any present or future taxes, duties or charges. "
+          "Terms used herein shall have the meanings given to them in the Base Prospectus.")
+
+
+def _isin(rng: random.Random) -> str:
+    body = "XS" + "".join(rng.choice("0123456789") for _ in range(9))
+    # Luhn check digit over the letter-expanded code, as ISO 6166 defines it
+    digits = "".join(str(int(ch, 36)) for ch in body)
+    total = 0
+    for i, d in enumerate(reversed(digits)):
+        n = int(d) * (2 if i % 2 == 0 else 1)
+        total += n // 10 + n % 10
+    return body + str((10 - total % 10) % 10)
+
+
+def termsheet_fields(seed: int) -> Dict[str, str]:
+    rng = random.Random(seed)
+    moodys, sp, fitch = rng.choice(RATINGS)
+    year = rng.randint(2020, 2026)
+    return {
+        "ISIN": _isin(rng),
+        "Bond Type": rng.choice(["Senior Unsecured", "Senior Preferred", "Subordinated", "Covered"]),
+        "Issuer": rng.choice(ISSUERS),
+        "Bond Size": f"{rng.choice([250, 500, 750, 1000])},000,000",
+        "Currency": rng.choice(CURRENCIES),
+        "Coupon": f"{rng.randint(100, 750) / 100:.3f}% per annum",
+        "Issuance Date": f"{rng.randint(1, 28)} March {year}",
+        "Maturity Date": f"{rng.randint(1, 28)} March {year + rng.choice([3, 5, 7, 10])}",
+        "Exchange Listing": rng.choice(["Luxembourg Stock Exchange", "Euronext Dublin", "London Stock Exchange"]),
+        "Paying Agent": rng.choice(["Citibank, N.A., London Branch", "The Bank of New York Mellon"]),
+        "Moody's": moodys,
+        "S&P": sp,
+        "Fitch": fitch,
+        "Status of Notes": "Senior",
+        "Method of Distribution": rng.choice(["Syndicated", "Non-syndicated"]),
+        "Syndicate": rng.choice(["Barclays, BNP Paribas", "Deutsche Bank, HSBC, ING"]),
+    }
+
+
+def page_lines(seed: int, page: int) -> List[str]:
+    """Page 1 carries the key terms; later pages are boilerplate with a few terms repeated."""
+    fields = termsheet_fields(seed)
+    lines = [f"Indicative Term Sheet {seed} - page {page}"]
+    if page == 1:
+        lines += [f"{k}: {v}" for k, v in fields.items()]
+    else:
+        rng = random.Random(seed * 1000 + page)
+        for key in rng.sample(sorted(fields), 2):
+            lines.append(f"{key}: {fields[key]}")
+    rng = random.Random(seed * 7919 + page)
+    words = FILLER.split()
+    for _ in range(20):
+        start = rng.randrange(len(words) - 12)
+        lines.append(" ".join(words[start:start + 12]))
+    return lines
+
+
+def make_termsheet_pdf(path: str, pages: int = 3, seed: int = 0) -> str:
+    c = canvas.Canvas(path, pagesize=A4, invariant=1)
+    for page in range(1, pages + 1):
+        y = 800
+        for line in page_lines(seed, page):
+            c.drawString(40, y, line)
+            y -= 16
+        c.showPage()
+    c.save()
+    return path
+
+
+def make_corpus(folder: str, n_docs: int, pages: int = 3) -> List[str]:
+    os.makedirs(folder, exist_ok=True)
+    return [make_termsheet_pdf(os.path.join(folder, f"termsheet_{i:04d}.pdf"), pages=pages, seed=i)
+            for i in range(n_docs)]
+
+
+def synthetic_text(n_chars: int, seed: int = 0) -> str:
+    parts, size, page = [], 0, 1
+    while size < n_chars:
+        block = "\n".join(page_lines(seed, page))
+        parts.append(block)
+        size += len(block) + 1
+        page += 1
+    return "\n".join(parts)[:n_chars]
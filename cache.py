@@ -0,0 +1,228 @@
+"""
+cache.py
+- LLMCache: on-disk SQLite cache of LLM responses, keyed by a hash of
+  (provider, model, temperature, system message, user message).
+  LRU eviction once max_entries is exceeded, optional TTL in seconds.
+- PageCache: on-disk SQLite cache of extracted PDF page texts, keyed by a
+  hash of the PDF bytes plus extractor version and settings. Each page is
+  stored as a zlib-compressed blob; LRU eviction by document.
+- get_llm_cache() / get_page_cache(): process-wide instances configured
+  from config.py (None when the cache is disabled).
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import zlib
+import threading
+from typing import Dict, List, Optional
+
+from config import LLM_CACHE_ENABLED, LLM_CACHE_PATH, LLM_CACHE_MAX_ENTRIES, LLM_CACHE_TTL
+from config import PAGE_CACHE_ENABLED, PAGE_CACHE_PATH, PAGE_CACHE_MAX_DOCS
+
+
+def open_sqlite(path: str) -> sqlite3.Connection:
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+# ---------------- LLM response cache ---------------- #
+
+class LLMCache:
+    """Content-addressed store of raw model output text."""
+
+    def __init__(self, path: str, max_entries: int = 10000, ttl_seconds: Optional[float] = None):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self.saved_tokens = 0
+        self._lock = threading.Lock()
+        self._conn = open_sqlite(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            " key TEXT PRIMARY KEY,"
+            " content TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " accessed REAL NOT NULL,"
+            " latency REAL NOT NULL DEFAULT 0,"
+            " tokens INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache(accessed)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(provider: str, model: str, temperature: float, system: str, user: str) -> str:
+        payload = json.dumps([provider, model, float(temperature), system, user], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return cached content or None; counts a hit or a miss."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content, created, latency, tokens FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl_seconds is not None and now - row[1] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE llm_cache SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            self.saved_seconds += row[2]
+            self.saved_tokens += row[3]
+            return row[0]
+
+    def put(self, key: str, content: str, latency: float = 0.0, tokens: int = 0) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, content, created, accessed, latency, tokens)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, content, now, now, latency, tokens)
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        if not self.max_entries:
+            return
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM llm_cache WHERE key IN"
+                " (SELECT key FROM llm_cache ORDER BY accessed ASC LIMIT ?)", (excess,)
+            )
+
+    def stats(self) -> Dict:
+        with self._lock:
+            (entries,) = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": entries,
+            "saved_seconds": round(self.saved_seconds, 3),
+            "saved_tokens": self.saved_tokens,
+        }
+
+
+# ---------------- Page text cache ---------------- #
+
+class PageCache:
+    """Per-page extracted text, stored compressed, one entry per document key."""
+
+    def __init__(self, path: str, max_docs: int = 5000):
+        self.path = path
+        self.max_docs = max_docs
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = open_sqlite(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS page_docs ("
+            " key TEXT PRIMARY KEY,"
+            " n_pages INTEGER NOT NULL,"
+            " accessed REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS page_text ("
+            " key TEXT NOT NULL,"
+            " page INTEGER NOT NULL,"
+            " blob BLOB NOT NULL,"
+            " PRIMARY KEY (key, page))"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(content_hash: str, version: str, settings: Dict) -> str:
+        payload = json.dumps([content_hash, version, settings], sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[List[str]]:
+        """Return the cached page texts (index 0 == page 1) or None."""
+        with self._lock:
+            doc = self._conn.execute("SELECT n_pages FROM page_docs WHERE key = ?", (key,)).fetchone()
+            rows = []
+            if doc is not None:
+                rows = self._conn.execute(
+                    "SELECT blob FROM page_text WHERE key = ? ORDER BY page", (key,)
+                ).fetchall()
+            if doc is None or len(rows) != doc[0]:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE page_docs SET accessed = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+        return [zlib.decompress(r[0]).decode("utf-8") for r in rows]
+
+    def put(self, key: str, pages: List[str]) -> None:
+        blobs = [(key, i, zlib.compress(text.encode("utf-8"))) for i, text in enumerate(pages, start=1)]
+        with self._lock:
+            self._conn.execute("DELETE FROM page_text WHERE key = ?", (key,))
+            self._conn.executemany("INSERT INTO page_text (key, page, blob) VALUES (?, ?, ?)", blobs)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO page_docs (key, n_pages, accessed) VALUES (?, ?, ?)",
+                (key, len(pages), time.time())
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        if not self.max_docs:
+            return
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM page_docs").fetchone()
+        excess = count - self.max_docs
+        if excess > 0:
+            stale = [r[0] for r in self._conn.execute(
+                "SELECT key FROM page_docs ORDER BY accessed ASC LIMIT ?", (excess,)
+            )]
+            self._conn.executemany("DELETE FROM page_text WHERE key = ?", [(k,) for k in stale])
+            self._conn.executemany("DELETE FROM page_docs WHERE key = ?", [(k,) for k in stale])
+
+    def stats(self) -> Dict:
+        with self._lock:
+            (docs,) = self._conn.execute("SELECT COUNT(*) FROM page_docs").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "documents": docs}
+
+
+_llm_cache: Optional[LLMCache] = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> Optional[LLMCache]:
+    """Return the shared LLM cache, or None if caching is disabled."""
+    global _llm_cache
+    if not LLM_CACHE_ENABLED:
+        return None
+    with _llm_cache_lock:
+        if _llm_cache is None:
+            _llm_cache = LLMCache(LLM_CACHE_PATH, max_entries=LLM_CACHE_MAX_ENTRIES, ttl_seconds=LLM_CACHE_TTL)
+        return _llm_cache
+
+
+_page_cache: Optional[PageCache] = None
+_page_cache_lock = threading.Lock()
+
+
+def get_page_cache() -> Optional[PageCache]:
+    """Return the shared page text cache, or None if caching is disabled."""
+    global _page_cache
+    if not PAGE_CACHE_ENABLED:
+        return None
+    with _page_cache_lock:
+        if _page_cache is None:
+            _page_cache = PageCache(PAGE_CACHE_PATH, max_docs=PAGE_CACHE_MAX_DOCS)
+        return _page_cache
@@ -0,0 +1,315 @@
+"""
+chunk_store.py
+- chunk_offsets(text, chunk_size, overlap): (start, end) of each chunk of
+  extractor.chunk_text, without copying the text
+- token_chunk_offsets(text, token_starts, max_tokens, overlap_tokens):
+  chunks of up to max_tokens tokens, cut at line and sentence boundaries
+- ChunkStore: the chunks of one document as offsets into text buffers
+  - add_page(): character chunks of one page (buffer = the page text)
+  - add_document(): token chunks over all pages (buffer = the pages joined
+    by newlines), so chunks flow across page breaks; each page is
+    tokenized once
+  - each text is held once; chunks are parallel arrays of (buffer slot,
+    start, end, first page, last page, chunk index), so overlapping chunk
+    text is not duplicated and there is no per-chunk object
+  - chunk text is sliced out only when a consumer asks for it
+  - store[i] / iteration give ChunkView objects: read-only mappings that
+    behave like the old chunk dicts
+        { "chunk", "source", "page", "chunk_index", "folder", "page_span" }
+    "page" is the page the chunk starts on, "page_span" (first, last) the
+    pages it covers; chunk_index counts chunks starting on that page
+  - store.texts: lazy sequence of chunk texts (for indexing)
+  - store.buffers: the text buffers themselves (each page or document once)
+  - store.page_texts(): {page: text of that page}; a document buffer is
+    split back into its pages
+  - pickles compactly, so it is cheap to return from extraction workers
+- chunk_texts(chunks): texts of a ChunkStore or of a list of chunk dicts
+"""
+
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import Mapping, Sequence
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+CHUNK_KEYS = ("chunk", "source", "page", "chunk_index", "folder", "page_span")
+
+# Preferred cut points: after line breaks and sentence ends
+_BOUNDARY_RE = re.compile(r"\n+|(?<=[.!?])\s+")
+
+
+def chunk_offsets(text: str, chunk_size: int = 2000, overlap: int = 200) -> List[Tuple[int, int]]:
+    """Offsets of text[i:i+chunk_size].strip() for i = 0, step, 2*step, ..."""
+    offsets = []
+    if not text:
+        return offsets
+    step = chunk_size - overlap
+    n = len(text)
+    i = 0
+    while i < n:
+        start, end = i, min(i + chunk_size, n)
+        # Same as str.strip(), on offsets
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        offsets.append((start, end))
+        i += step
+    return offsets
+
+
+def _strip_offsets(text: str, start: int, end: int) -> Tuple[int, int]:
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+
+def token_chunk_offsets(text: str, token_starts: List[int], max_tokens: int,
+                        overlap_tokens: int = 0) -> List[Tuple[int, int]]:
+    """
+    (start, end) of chunks of up to max_tokens tokens.
+    text is split into units at line breaks and sentence ends; units are packed
+    greedily, and a unit longer than max_tokens is cut at token boundaries.
+    Each chunk repeats up to overlap_tokens tokens of whole units from the
+    end of the previous one. token_starts: sorted start offsets of the tokens.
+    """
+    max_tokens = max(1, max_tokens)
+    overlap_tokens = max(0, min(overlap_tokens, max_tokens - 1))
+
+    def n_tokens(a: int, b: int) -> int:
+        return bisect_left(token_starts, b) - bisect_left(token_starts, a)
+
+    # Units as (start, end, tokens)
+    units = []
+    pos = 0
+    cuts = [m.end() for m in _BOUNDARY_RE.finditer(text)] + [len(text)]
+    for cut in cuts:
+        if cut <= pos:
+            continue
+        n = n_tokens(pos, cut)
+        if n <= max_tokens:
+            units.append((pos, cut, n))
+        else:
+            first = bisect_left(token_starts, pos)
+            for t in range(first, first + n, max_tokens):
+                a = pos if t == first else token_starts[t]
+                b = token_starts[t + max_tokens] if t + max_tokens < first + n else cut
+                units.append((a, b, min(max_tokens, first + n - t)))
+        pos = cut
+
+    offsets = []
+    current: List[Tuple[int, int, int]] = []
+    current_tokens = 0
+
+    def emit():
+        start, end = _strip_offsets(text, current[0][0], current[-1][1])
+        if start < end:
+            offsets.append((start, end))
+
+    for unit in units:
+        if current and current_tokens + unit[2] > max_tokens:
+            emit()
+            keep, kept = [], 0
+            for u in reversed(current):
+                if kept + u[2] > overlap_tokens:
+                    break
+                keep.insert(0, u)
+                kept += u[2]
+            while keep and kept + unit[2] > max_tokens:
+                kept -= keep.pop(0)[2]
+            current, current_tokens = keep, kept
+        current.append(unit)
+        current_tokens += unit[2]
+    if current:
+        emit()
+    return offsets
+
+
+class ChunkView(Mapping):
+    """One chunk of a ChunkStore, read like the chunk dict it replaces."""
+
+    __slots__ = ("_store", "_i")
+
+    def __init__(self, store: "ChunkStore", i: int):
+        self._store = store
+        self._i = i
+
+    def __getitem__(self, key: str):
+        store, i = self._store, self._i
+        if key == "chunk":
+            return store.text(i)
+        if key == "page":
+            return store._page_no[i]
+        if key == "page_span":
+            return (store._page_no[i], store._last_page[i])
+        if key == "chunk_index":
+            return store._chunk_index[i]
+        if key == "source":
+            return store.source
+        if key == "folder":
+            return store.folder
+        raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(CHUNK_KEYS)
+
+    def __len__(self) -> int:
+        return len(CHUNK_KEYS)
+
+    def copy(self) -> Dict:
+        return dict(self)
+
+    def __repr__(self) -> str:
+        return f"ChunkView({dict(self)!r})"
+
+
+class _Texts(Sequence):
+    """store.texts: chunk texts, sliced on access."""
+
+    __slots__ = ("_store",)
+
+    def __init__(self, store: "ChunkStore"):
+        self._store = store
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._store.text(j) for j in range(*i.indices(len(self)))]
+        return self._store.text(i)
+
+
+class ChunkStore(Sequence):
+
+    __slots__ = ("source", "folder", "_buffers", "_buffer_pages", "_slot", "_start", "_end", "_page_no",
+                 "_last_page", "_chunk_index")
+
+    def __init__(self, source: str = "termsheet", folder: Optional[str] = None):
+        self.source = source
+        self.folder = folder
+        self._buffers: List[str] = []
+        self._buffer_pages: List[Tuple[int, array]] = []  # per buffer: (first page, page start offsets)
+        self._slot = array("i")
+        self._start = array("q")
+        self._end = array("q")
+        self._page_no = array("i")
+        self._last_page = array("i")
+        self._chunk_index = array("i")
+
+    def _append(self, slot: int, start: int, end: int, page_no: int, last_page: int, chunk_index: int) -> None:
+        self._slot.append(slot)
+        self._start.append(start)
+        self._end.append(end)
+        self._page_no.append(page_no)
+        self._last_page.append(last_page)
+        self._chunk_index.append(chunk_index)
+
+    def add_page(self, page_no: int, page_text: str, chunk_size: int, overlap: int) -> int:
+        """Chunk one page (as extractor.chunk_text does); returns the number of chunks added."""
+        offsets = chunk_offsets(page_text, chunk_size=chunk_size, overlap=overlap)
+        if not offsets:
+            return 0
+        slot = len(self._buffers)
+        self._buffers.append(page_text)
+        self._buffer_pages.append((page_no, array("q", [0])))
+        for c_idx, (start, end) in enumerate(offsets, start=1):
+            self._append(slot, start, end, page_no, page_no, c_idx)
+        return len(offsets)
+
+    def add_document(self, pages: List[str], max_tokens: int, overlap_tokens: int = 0,
+                     first_page: int = 1) -> int:
+        """
+        Token chunks over all pages (pages[0] is first_page); chunks may cross
+        page breaks. Returns the number of chunks added.
+        """
+        from tokens import token_offsets
+
+        page_starts: List[int] = []
+        token_starts: List[int] = []
+        pos = 0
+        for page_text in pages:
+            # Tokenized per page, once; offsets shifted into the joined buffer
+            page_starts.append(pos)
+            token_starts.extend(pos + o for o in token_offsets(page_text))
+            pos += len(page_text) + 1
+        buffer = "\n".join(pages)
+        offsets = token_chunk_offsets(buffer, token_starts, max_tokens, overlap_tokens)
+        if not offsets:
+            return 0
+
+        slot = len(self._buffers)
+        self._buffers.append(buffer)
+        self._buffer_pages.append((first_page, array("q", page_starts)))
+        per_page: Dict[int, int] = {}
+        for start, end in offsets:
+            page_no = first_page + bisect_right(page_starts, start) - 1
+            last_page = first_page + bisect_right(page_starts, end - 1) - 1
+            per_page[page_no] = per_page.get(page_no, 0) + 1
+            self._append(slot, start, end, page_no, last_page, per_page[page_no])
+        return len(offsets)
+
+    def text(self, i: int) -> str:
+        return self._buffers[self._slot[i]][self._start[i]:self._end[i]]
+
+    @property
+    def texts(self) -> _Texts:
+        return _Texts(self)
+
+    @property
+    def buffers(self) -> Tuple[str, ...]:
+        return tuple(self._buffers)
+
+    def page_texts(self) -> Dict[int, str]:
+        """{page: text}; a document buffer is cut back into its pages at the recorded page starts."""
+        pages: Dict[int, str] = {}
+        for buffer, (first_page, starts) in zip(self._buffers, self._buffer_pages):
+            # Pages are joined by one newline, so each page ends just before the next start
+            ends = [s - 1 for s in starts[1:]] + [len(buffer)]
+            for k, (start, end) in enumerate(zip(starts, ends)):
+                pages[first_page + k] = buffer[start:end]
+        return pages
+
+    def __len__(self) -> int:
+        return len(self._slot)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [ChunkView(self, j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("chunk index out of range")
+        return ChunkView(self, i)
+
+    def __iter__(self) -> Iterator[ChunkView]:
+        for i in range(len(self)):
+            yield ChunkView(self, i)
+
+    def to_dicts(self) -> List[Dict]:
+        """Plain chunk dicts (materialises every chunk text)."""
+        return [dict(c) for c in self]
+
+    def nbytes(self) -> int:
+        """Approximate payload size: text buffers plus offset arrays."""
+        arrays = (self._slot, self._start, self._end, self._page_no, self._last_page, self._chunk_index)
+        return sum(len(b) for b in self._buffers) + sum(a.itemsize * len(a) for a in arrays)
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def __repr__(self) -> str:
+        return f"ChunkStore({len(self)} chunks, {len(self._buffers)} buffers, source={self.source!r})"
+
+
+def chunk_texts(chunks: Iterable) -> Iterable[str]:
+    """Chunk texts of a ChunkStore (lazy) or of any iterable of chunk dicts."""
+    if isinstance(chunks, ChunkStore):
+        return chunks.texts
+    return (c["chunk"] for c in chunks)
@@ -1,5 +1,7 @@
 # config.py
 
+import os
+
 # Root folder containing all company term sheets
 MAIN_FOLDER = "Main_term_sheet"
 
@@ -17,3 +19,157 @@ PROMPTS_FILE = "Prompts/prompts_term_sheet.json"
 
 #Excel FIle
 EXCEL_FILE = "TermSheet Output.xlsx"
+
+# Pipeline / concurrency
+# Default LLM provider used by main.py ("gemini" or "groq")
+PROVIDER = "gemini"
+# Extraction runs in a process pool; leave one core for the LLM/writer threads
+EXTRACT_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+# Concurrent in-flight LLM calls, sized per provider
+LLM_WORKERS = {"gemini": 4, "groq": 2}
+# Max documents buffered between pipeline stages
+PIPELINE_QUEUE_SIZE = 8
+
+# Rows buffered by writer.ExcelWriterSession between saves of an existing workbook
+EXCEL_FLUSH_EVERY = 50
+
+# On-disk cache of LLM responses (see cache.py); TTL in seconds, None = never expire
+LLM_CACHE_ENABLED = True
+LLM_CACHE_PATH = ".cache/llm_cache.sqlite"
+LLM_CACHE_MAX_ENTRIES = 10000
+LLM_CACHE_TTL = None
+
+# On-disk cache of extracted page texts, keyed by PDF content hash (see cache.py)
+PAGE_CACHE_ENABLED = True
+PAGE_CACHE_PATH = ".cache/page_cache.sqlite"
+PAGE_CACHE_MAX_DOCS = 5000
+# Longer documents are not cached, so streaming them does not keep every page in memory
+PAGE_CACHE_MAX_PAGES = 500
+
+# Page text backend: "pdfplumber" (layout fidelity) or "pypdf" (speed; pages
+# that come back empty are retried with pdfplumber)
+EXTRACT_BACKEND = "pdfplumber"
+# Processes used to extract the pages of a single PDF (1 = serial)
+EXTRACT_PAGE_WORKERS = 1
+# Only shard PDFs with at least this many pages across EXTRACT_PAGE_WORKERS
+EXTRACT_SHARD_MIN_PAGES = 50
+
+# Optional corpus-wide TF-IDF index over all term sheets (see corpus_index.py);
+# when enabled, retrieval uses corpus IDF weights instead of per-document ones
+CORPUS_INDEX_ENABLED = False
+CORPUS_INDEX_DIR = ".cache/corpus_index"
+# Segments are merged into one once there are more than this many
+CORPUS_INDEX_MAX_SEGMENTS = 64
+
+# Token-budgeted context assembly (see parser.assemble_context_budgeted):
+# overlapping neighbours are merged and chunks are packed by score until the
+# model's budget is reached
+CONTEXT_BUDGET_ENABLED = False
+CONTEXT_TOKEN_BUDGETS = {
+    "gemini-2.5-flash": 24000,
+    "llama-3.3-70b-versatile": 12000,
+}
+CONTEXT_TOKEN_BUDGET_DEFAULT = 12000
+# tiktoken encoding used to count tokens
+TOKENIZER_ENCODING = "cl100k_base"
+
+# Multi-prompt batching (see parser.batch_prompt_requests): prompts of the same
+# run_for whose retrieved chunks overlap by at least PROMPT_BATCH_MIN_OVERLAP
+# (Jaccard) share one LLM request, up to PROMPT_BATCH_MAX_SIZE prompts each
+PROMPT_BATCHING_ENABLED = False
+PROMPT_BATCH_MIN_OVERLAP = 0.5
+PROMPT_BATCH_MAX_SIZE = 4
+
+# Provider gateway (see gateway.py): per-provider rate limits and retry policy
+PROVIDER_LIMITS = {
+    "gemini": {"requests_per_minute": 1000, "tokens_per_minute": 1000000},
+    "groq": {"requests_per_minute": 30, "tokens_per_minute": 12000},
+}
+LLM_MAX_RETRIES = 5
+# Exponential backoff (seconds) when the provider gives no Retry-After
+LLM_BACKOFF_BASE = 1.0
+LLM_BACKOFF_MAX = 60.0
+
+# Processing journal used by main.py to resume interrupted runs (see journal.py)
+JOURNAL_PATH = ".cache/journal.sqlite"
+
+# Streamlit app: uploads processed concurrently, and number of memoised
+# extraction/parse results kept across reruns
+APP_WORKERS = 4
+APP_MEMO_MAX = 256
+
+# Output sinks (see sinks.py): main.py --sink chooses one; default file per sink
+SINK = "excel"
+SINK_PATHS = {
+    "excel": EXCEL_FILE,
+    "jsonl": "TermSheet Output.jsonl",
+    "csv": "TermSheet Output.csv",
+    # Parquet output is a folder of part files, one per run
+    "parquet": "TermSheet Output.parquet",
+}
+# Rows buffered before a jsonl/csv/parquet sink writes them out
+SINK_FLUSH_EVERY = 50
+
+# Run instrumentation (see metrics.py): stage timings, token usage and
+# retries; main.py writes the run report and a Prometheus textfile at the end
+METRICS_ENABLED = True
+METRICS_REPORT_PATH = "reports/run_report.json"
+METRICS_PROM_PATH = "reports/termsheet.prom"
+
+# Chunker (see chunk_store.py):
+#   "chars"  - CHUNK_SIZE-character windows with OVERLAP, cut per page
+#   "tokens" - up to CHUNK_TOKENS tokens, cut at line/sentence boundaries and
+#              flowing across page breaks (chunks keep their page span)
+CHUNKER = "chars"
+CHUNK_TOKENS = 1200
+# Kept well under OVERLAP characters, so budgeted contexts can still merge
+# neighbouring chunks (parser.assemble_context_budgeted)
+CHUNK_OVERLAP_TOKENS = 64
+
+# Rule-based fast path (see rules.py): fields with rigid formats (ISIN,
+# currency, dates, ratings, coupon) are read with regexes before the LLM call;
+# the LLM is asked only for the rest, and not at all when nothing is left.
+# RULES_SHRINK_CONTEXT also cuts top_k in proportion to the fields left.
+RULES_ENABLED = True
+RULES_SHRINK_CONTEXT = True
+
+# Lazy extraction (see extractor.LazyTermsheet, main.py --lazy): pages are read
+# EXTRACT_LAZY_BATCH at a time until EXTRACT_LAZY_COVERAGE of the prompts'
+# fields are labelled in the pages read, or (once some are) until
+# EXTRACT_LAZY_PATIENCE batches in a row label no new field. More pages are
+# read only for fields the LLM leaves empty.
+EXTRACT_LAZY = False
+EXTRACT_LAZY_BATCH = 4
+EXTRACT_LAZY_COVERAGE = 0.8
+EXTRACT_LAZY_PATIENCE = 2
+
+# Duplicate detection (see dedup.py): signatures of each parsed document's
+# extracted text are kept in DEDUP_PATH across runs. A document with the same
+# text as an earlier one reuses its results; one at least DEDUP_NEAR_THRESHOLD
+# similar (estimated Jaccard of word shingles) is a near duplicate, and with
+# DEDUP_NEAR_DIFF_PAGES only its changed pages are sent to the LLM, fields not
+# found there being taken from the earlier document. Results are only reused
+# under the same prompts, model, chunking, rules, context and JSON settings.
+DEDUP_ENABLED = True
+DEDUP_PATH = ".cache/dedup.sqlite"
+DEDUP_NEAR_THRESHOLD = 0.9
+DEDUP_NEAR_DIFF_PAGES = False
+
+# LLM output (see json_stream.py):
+#   LLM_JSON_MODE - use the providers' JSON output modes (Groq response_format,
+#                   Gemini response_mime_type with a schema built from the prompt)
+#   LLM_STREAMING - stream responses into an incremental JSON parser; the stream
+#                   is closed once the object is complete, and output that cannot
+#                   match the prompt's json_schema (syntax error, unknown key, no
+#                   JSON within LLM_STREAM_MAX_PREAMBLE characters) is retried
+#                   right away
+LLM_JSON_MODE = True
+LLM_STREAMING = False
+LLM_STREAM_MAX_PREAMBLE = 200
+
+# Watch mode (main.py --watch, see watcher.py): after the initial run, MAIN_FOLDER
+# is watched recursively (inotify on Linux, else rescanned every
+# WATCH_POLL_INTERVAL seconds) and new or modified PDFs are processed once
+# their size and mtime have been stable for WATCH_DEBOUNCE seconds
+WATCH_DEBOUNCE = 2.0
+WATCH_POLL_INTERVAL = 5.0
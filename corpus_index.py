@@ -0,0 +1,337 @@
+"""
+corpus_index.py
+- CorpusIndex: persistent TF-IDF index over the chunks of all term sheets
+  seen so far (e.g. everything in MAIN_FOLDER), stored on disk:
+    index.sqlite        vocabulary (term -> id), document -> row ranges,
+                        segment list and row/segment counters
+    df.bin              per-term document frequency, int64 by term id
+                        (IDF is derived from it)
+    seg_XXXXX.*.npy     raw term counts as CSR arrays, one segment per add
+  df and the count matrices are memory-mapped. The vocabulary is never
+  loaded as a whole: only the terms of the texts at hand are looked up.
+- add_document(doc_key, chunks): incremental add, nothing is refitted; new
+  terms get the next ids, df.bin grows by appending and is updated in
+  place, so an add costs O(the document's terms), not O(vocabulary).
+  IDF is recomputed from df at query time.
+- document_index(doc_key): index dict for one document's rows, usable
+  wherever parser.build_tfidf_index output is accepted.
+- get_corpus_index(): process-wide instance (None when disabled in config.py)
+An index in the earlier meta.json/df.npy layout is converted when opened.
+"""
+
+import os
+import json
+import hashlib
+import threading
+import numpy as np
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from cache import open_sqlite
+from chunk_store import chunk_texts
+from config import CORPUS_INDEX_ENABLED, CORPUS_INDEX_DIR, CORPUS_INDEX_MAX_SEGMENTS
+
+_DB = "index.sqlite"
+_DF = "df.bin"
+_PARTS = ("data", "indices", "indptr")
+_LOOKUP_BATCH = 500  # terms per "IN (...)" lookup, below SQLite's variable limit
+
+
+def _save_npy(path: str, arr: np.ndarray) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, arr)
+    os.replace(tmp_path, path)
+
+
+class _QueryVectorizer:
+    """transform(queries) -> L2-normalised TF-IDF rows in the corpus vocabulary."""
+
+    def __init__(self, corpus: "CorpusIndex", idf: np.ndarray):
+        self.corpus = corpus
+        self.idf = idf
+
+    def transform(self, queries: List[str]) -> sparse.csr_matrix:
+        # Terms added to the corpus after this snapshot are ignored
+        counts = self.corpus._counts(queries, n_terms=len(self.idf))
+        return self.corpus._weight(counts, self.idf)
+
+
+class CorpusIndex:
+    """Append-only, segment-based TF-IDF index with per-document row ranges."""
+
+    def __init__(self, folder: str, max_segments: int = 64):
+        self.folder = folder
+        self.max_segments = max_segments
+        self._lock = threading.RLock()
+        # Same tokenisation as parser.build_tfidf_index
+        self._analyze = TfidfVectorizer(stop_words="english").build_analyzer()
+        os.makedirs(folder, exist_ok=True)
+
+        self._conn = open_sqlite(os.path.join(folder, _DB))
+        self._conn.execute("CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, id INTEGER NOT NULL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS docs ("
+            " doc_key TEXT PRIMARY KEY,"
+            " segment TEXT NOT NULL,"
+            " row_start INTEGER NOT NULL,"
+            " row_end INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS segments (name TEXT PRIMARY KEY)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._conn.commit()
+        self._import_json()
+
+        self._df: Optional[np.ndarray] = None
+        self._segments: Dict[str, tuple] = {}
+        (self._n_terms,) = self._conn.execute("SELECT COUNT(*) FROM terms").fetchone()
+        # Counts past the committed vocabulary are left over from an interrupted add
+        df_path = os.path.join(folder, _DF)
+        if os.path.exists(df_path) and os.path.getsize(df_path) > self._n_terms * 8:
+            with open(df_path, "r+b") as f:
+                f.truncate(self._n_terms * 8)
+        self._map_df(self._n_terms)
+        self._remove_stale_segments()
+
+    @staticmethod
+    def doc_key(chunks: List[Dict]) -> str:
+        """Content key for a document's chunk list (changes with chunk settings)."""
+        h = hashlib.sha256()
+        for text in chunk_texts(chunks):
+            h.update(text.encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def __contains__(self, doc_key: str) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM docs WHERE doc_key = ?", (doc_key,)).fetchone() is not None
+
+    # ---------------- Storage ---------------- #
+
+    def _counter(self, name: str) -> int:
+        row = self._conn.execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    def _set_counter(self, name: str, value: int) -> None:
+        self._conn.execute("INSERT OR REPLACE INTO counters (name, value) VALUES (?, ?)", (name, value))
+
+    def _segment_names(self) -> List[str]:
+        return [r[0] for r in self._conn.execute("SELECT name FROM segments ORDER BY name")]
+
+    def _map_df(self, n_terms: int) -> None:
+        """Memory-map df.bin with room for n_terms terms, appending zeros if it is shorter."""
+        if self._df is not None and len(self._df) >= n_terms:
+            return
+        path = os.path.join(self.folder, _DF)
+        # Unmap before resizing; a mapped file cannot be resized on Windows
+        self._df = None
+        with open(path, "r+b" if os.path.exists(path) else "w+b") as f:
+            if os.path.getsize(path) < n_terms * 8:
+                f.truncate(n_terms * 8)
+        if n_terms:
+            self._df = np.memmap(path, dtype=np.int64, mode="r+", shape=(n_terms,))
+        else:
+            self._df = np.zeros(0, dtype=np.int64)
+
+    def _import_json(self) -> None:
+        """Convert an index in the earlier layout (vocabulary and documents in meta.json, df.npy)."""
+        meta_path = os.path.join(self.folder, "meta.json")
+        if not os.path.exists(meta_path):
+            return
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        df = np.load(os.path.join(self.folder, "df.npy")).astype(np.int64)
+        df.tofile(os.path.join(self.folder, _DF))
+        self._conn.executemany("INSERT OR REPLACE INTO terms (term, id) VALUES (?, ?)", meta["vocab"].items())
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO docs (doc_key, segment, row_start, row_end) VALUES (?, ?, ?, ?)",
+            [(k, d["segment"], d["start"], d["end"]) for k, d in meta["docs"].items()]
+        )
+        self._conn.executemany("INSERT OR REPLACE INTO segments (name) VALUES (?)", [(s,) for s in meta["segments"]])
+        self._set_counter("n_rows", meta["n_rows"])
+        self._set_counter("next_segment", meta["next_segment"])
+        self._conn.commit()
+        os.remove(meta_path)
+        os.remove(os.path.join(self.folder, "df.npy"))
+
+    def _remove_stale_segments(self) -> None:
+        """Delete segment files no longer listed (merged away, or left by an interrupted add)."""
+        live = set(self._segment_names())
+        for name in os.listdir(self.folder):
+            if name.startswith("seg_") and name.split(".")[0] not in live:
+                try:
+                    os.remove(os.path.join(self.folder, name))
+                except OSError:
+                    pass  # still open elsewhere; retried on the next compaction or open
+
+    # ---------------- Building ---------------- #
+
+    def _term_ids(self, terms: Iterable[str], grow: bool = False) -> Dict[str, int]:
+        """Ids of the given terms; unknown terms get new ids if grow=True (uncommitted)."""
+        terms = list(terms)
+        ids: Dict[str, int] = {}
+        with self._lock:
+            for start in range(0, len(terms), _LOOKUP_BATCH):
+                batch = terms[start:start + _LOOKUP_BATCH]
+                ids.update(self._conn.execute(
+                    f"SELECT term, id FROM terms WHERE term IN ({','.join('?' * len(batch))})", batch))
+            if grow:
+                new = [t for t in terms if t not in ids]
+                for tid, term in enumerate(new, start=self._n_terms):
+                    ids[term] = tid
+                self._conn.executemany("INSERT INTO terms (term, id) VALUES (?, ?)",
+                                       [(term, ids[term]) for term in new])
+        return ids
+
+    def _counts(self, texts: List[str], grow: bool = False, n_terms: Optional[int] = None) -> sparse.csr_matrix:
+        """Raw term counts; unknown terms (and ids >= n_terms) are dropped unless grow=True."""
+        tokenized = [self._analyze(text) for text in texts]
+        # First-appearance order, so new terms get ids in the order they occur
+        ids = self._term_ids(dict.fromkeys(term for tokens in tokenized for term in tokens), grow=grow)
+        if grow:
+            n_terms = max(ids.values(), default=-1) + 1
+            n_terms = max(n_terms, self._n_terms)
+        elif n_terms is None:
+            n_terms = self._n_terms
+        data, indices, indptr = [], [], [0]
+        for tokens in tokenized:
+            counts = Counter(ids[t] for t in tokens if t in ids and ids[t] < n_terms)
+            for tid in sorted(counts):
+                indices.append(tid)
+                data.append(counts[tid])
+            indptr.append(len(indices))
+        return sparse.csr_matrix((np.asarray(data, dtype=np.float32),
+                                  np.asarray(indices, dtype=np.int32),
+                                  np.asarray(indptr, dtype=np.int64)),
+                                 shape=(len(texts), n_terms))
+
+    def add_document(self, doc_key: str, chunks: List[Dict]) -> bool:
+        """Add one document's chunks as a new segment; False if already present."""
+        with self._lock:
+            if doc_key in self:
+                return False
+            try:
+                counts = self._counts(list(chunk_texts(chunks)), grow=True)
+                name = f"seg_{self._counter('next_segment'):05d}"
+                self._write_segment(name, counts)
+
+                # df is written before the commit: an interrupted add can only
+                # over-count terms that were already known
+                self._map_df(counts.shape[1])
+                np.add.at(self._df, counts.indices, 1)
+                self._df.flush()
+
+                self._conn.execute("INSERT INTO segments (name) VALUES (?)", (name,))
+                self._conn.execute("INSERT INTO docs (doc_key, segment, row_start, row_end) VALUES (?, ?, 0, ?)",
+                                   (doc_key, name, counts.shape[0]))
+                self._set_counter("next_segment", self._counter("next_segment") + 1)
+                self._set_counter("n_rows", self._counter("n_rows") + counts.shape[0])
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+            self._n_terms = counts.shape[1]
+
+            if len(self._segment_names()) > self.max_segments:
+                self._compact()
+            return True
+
+    def _write_segment(self, name: str, counts: sparse.csr_matrix) -> None:
+        for part in _PARTS:
+            _save_npy(os.path.join(self.folder, f"{name}.{part}.npy"), getattr(counts, part))
+
+    def _load_segment(self, name: str) -> tuple:
+        seg = self._segments.get(name)
+        if seg is None:
+            seg = tuple(np.load(os.path.join(self.folder, f"{name}.{part}.npy"), mmap_mode="r") for part in _PARTS)
+            self._segments[name] = seg
+        return seg
+
+    def _merged(self, names: List[str]) -> Tuple[sparse.csr_matrix, Dict[str, int]]:
+        """All segments stacked into one matrix, and each segment's first row in it."""
+        offsets, blocks, row = {}, [], 0
+        for name in names:
+            data, indices, indptr = self._load_segment(name)
+            block = sparse.csr_matrix((data, indices, indptr), shape=(len(indptr) - 1, self._n_terms))
+            offsets[name] = row
+            row += block.shape[0]
+            blocks.append(block)
+        return sparse.vstack(blocks, format="csr"), offsets
+
+    def _compact(self) -> None:
+        """Merge all segments into one so the number of files stays bounded."""
+        names = self._segment_names()
+        merged, offsets = self._merged(names)
+        new_name = f"seg_{self._counter('next_segment'):05d}"
+        self._write_segment(new_name, merged)
+        for name in names:
+            self._conn.execute("UPDATE docs SET segment = ?, row_start = row_start + ?, row_end = row_end + ?"
+                               " WHERE segment = ?", (new_name, offsets[name], offsets[name], name))
+        self._conn.execute("DELETE FROM segments")
+        self._conn.execute("INSERT INTO segments (name) VALUES (?)", (new_name,))
+        self._set_counter("next_segment", self._counter("next_segment") + 1)
+        self._conn.commit()
+
+        # Drop the memory maps before deleting their files (open files cannot be deleted on Windows)
+        del merged
+        self._segments = {}
+        self._remove_stale_segments()
+
+    # ---------------- Querying ---------------- #
+
+    def _idf(self) -> np.ndarray:
+        # Same smoothing as sklearn's TfidfVectorizer(smooth_idf=True)
+        n = self._counter("n_rows")
+        df = np.asarray(self._df[:self._n_terms], dtype=np.float64)
+        return (np.log((1.0 + n) / (1.0 + df)) + 1.0).astype(np.float32)
+
+    @staticmethod
+    def _weight(counts: sparse.csr_matrix, idf: np.ndarray) -> sparse.csr_matrix:
+        m = counts.multiply(idf[:counts.shape[1]].reshape(1, -1)).tocsr()
+        norms = np.sqrt(np.asarray(m.multiply(m).sum(axis=1)).ravel())
+        norms[norms == 0] = 1.0
+        return sparse.csr_matrix(sparse.diags(1.0 / norms) @ m)
+
+    def document_index(self, doc_key: str) -> Optional[Dict]:
+        """
+        Return {"vectorizer", "matrix", "texts"} for one document, with corpus
+        IDF weights; matrix rows follow the chunk order passed to add_document.
+        None if the document is not in the index.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT segment, row_start, row_end FROM docs WHERE doc_key = ?",
+                                     (doc_key,)).fetchone()
+            if row is None:
+                return None
+            segment, start, end = row
+            data, indices, indptr = self._load_segment(segment)
+            lo, hi = int(indptr[start]), int(indptr[end])
+            counts = sparse.csr_matrix(
+                (np.array(data[lo:hi]), np.array(indices[lo:hi]), np.array(indptr[start:end + 1]) - lo),
+                shape=(end - start, self._n_terms)
+            )
+            idf = self._idf()
+        return {"vectorizer": _QueryVectorizer(self, idf), "matrix": self._weight(counts, idf), "texts": None}
+
+    def stats(self) -> Dict:
+        with self._lock:
+            (docs,) = self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()
+            return {"documents": docs, "rows": self._counter("n_rows"),
+                    "terms": self._n_terms, "segments": len(self._segment_names())}
+
+
+_corpus_index: Optional[CorpusIndex] = None
+_corpus_index_lock = threading.Lock()
+
+
+def get_corpus_index() -> Optional[CorpusIndex]:
+    """Return the shared corpus index, or None if it is disabled."""
+    global _corpus_index
+    if not CORPUS_INDEX_ENABLED:
+        return None
+    with _corpus_index_lock:
+        if _corpus_index is None:
+            _corpus_index = CorpusIndex(CORPUS_INDEX_DIR, max_segments=CORPUS_INDEX_MAX_SEGMENTS)
+        return _corpus_index
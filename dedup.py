@@ -0,0 +1,225 @@
+"""
+dedup.py
+- Near-duplicate detection for Term Sheets, persisted across runs
+  - signature(chunks): per-page text hashes, a whole-text hash and a MinHash
+    of word shingles, computed from a document's extracted chunks
+  - DedupIndex: SQLite store of signatures and parsed results; find() looks
+    up a document by whole-text hash (exact duplicate: same text, other
+    bytes or file name) or through MinHash LSH bands (near duplicate:
+    estimated Jaccard similarity >= threshold), and reports the pages that
+    are not in the earlier document
+- Results are only reused under the same reuse key (prompts, provider and
+  model; see main.py), so changing any of them reparses
+- get_dedup_index(): process-wide instance (None when DEDUP_ENABLED is off)
+numpy is imported when the first signature is computed.
+"""
+
+import re
+import json
+import time
+import hashlib
+import threading
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from cache import open_sqlite
+from chunk_store import ChunkStore
+from config import DEDUP_ENABLED, DEDUP_PATH, DEDUP_NEAR_THRESHOLD
+
+NUM_PERM = 128
+BANDS = 32            # LSH: 32 bands of 4 rows, candidates from ~0.4 Jaccard up
+SHINGLE = 5           # words per shingle
+_MERSENNE = (1 << 61) - 1
+_WORD_RE = re.compile(r"\w+")
+
+
+class Signature(NamedTuple):
+    text_hash: str
+    page_hashes: Dict[int, str]   # page number -> hash of its normalised text
+    minhash: bytes                # NUM_PERM uint64 values
+
+
+class Match(NamedTuple):
+    doc_hash: str
+    path: Optional[str]
+    similarity: float             # 1.0 for exact duplicates
+    exact: bool
+    changed_pages: List[int]      # pages of the new document not found in the earlier one
+    results: List[Dict]
+
+
+# ---------------- Signatures ---------------- #
+
+def document_pages(chunks: Iterable) -> Dict[int, str]:
+    """{page: text}: a ChunkStore's page buffers, else the chunk texts joined per page."""
+    if isinstance(chunks, ChunkStore):
+        return chunks.page_texts()
+    pages: Dict[int, List[str]] = {}
+    for c in chunks:
+        pages.setdefault(c.get("page", 1), []).append(c["chunk"])
+    return {p: "\n".join(texts) for p, texts in pages.items()}
+
+
+def _normalise(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def _permutations():
+    import numpy as np
+
+    # Fixed seed: signatures must stay comparable across runs
+    rng = np.random.RandomState(20240531)
+    a = rng.randint(1, 1 << 29, size=NUM_PERM, dtype=np.uint64)
+    b = rng.randint(0, 1 << 29, size=NUM_PERM, dtype=np.uint64)
+    return a, b
+
+
+def minhash(text: str) -> bytes:
+    """MinHash of the word SHINGLE-grams of text (NUM_PERM uint64 values)."""
+    import numpy as np
+
+    words = _WORD_RE.findall(text.lower())
+    shingles = {" ".join(words[i:i + SHINGLE]) for i in range(max(1, len(words) - SHINGLE + 1))}
+    hv = np.fromiter((int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little")
+                      for s in shingles), dtype=np.uint64, count=len(shingles))
+    a, b = _permutations()
+    out = np.full(NUM_PERM, _MERSENNE, dtype=np.uint64)
+    # In blocks, to bound memory on long documents; 32-bit hashes times
+    # < 2**29 multipliers stay below 2**61, so nothing overflows
+    for start in range(0, len(hv), 4096):
+        values = (np.outer(hv[start:start + 4096], a) + b) % _MERSENNE
+        np.minimum(out, values.min(axis=0), out=out)
+    return out.tobytes()
+
+
+def similarity(a: bytes, b: bytes) -> float:
+    """Estimated Jaccard similarity of two MinHash signatures."""
+    import numpy as np
+
+    return float(np.mean(np.frombuffer(a, dtype=np.uint64) == np.frombuffer(b, dtype=np.uint64)))
+
+
+def signature(chunks: Iterable) -> Signature:
+    pages = document_pages(chunks)
+    normalised = {p: _normalise(t) for p, t in sorted(pages.items())}
+    text_hash = hashlib.sha256("\f".join(normalised.values()).encode("utf-8")).hexdigest()
+    page_hashes = {p: hashlib.sha1(t.encode("utf-8")).hexdigest() for p, t in normalised.items()}
+    return Signature(text_hash, page_hashes, minhash(" ".join(normalised.values())))
+
+
+def _bands(minhash_bytes: bytes) -> List[str]:
+    rows = NUM_PERM // BANDS
+    return [hashlib.sha1(minhash_bytes[i * rows * 8:(i + 1) * rows * 8]).hexdigest()[:16] for i in range(BANDS)]
+
+
+# ---------------- Index ---------------- #
+
+class DedupIndex:
+
+    def __init__(self, path: str, threshold: float = DEDUP_NEAR_THRESHOLD):
+        self.path = path
+        self.threshold = threshold
+        self.exact = 0
+        self.near = 0
+        self._lock = threading.Lock()
+        self._conn = open_sqlite(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS dedup_docs ("
+            " doc_hash TEXT NOT NULL,"
+            " reuse_key TEXT NOT NULL,"
+            " path TEXT,"
+            " text_hash TEXT NOT NULL,"
+            " pages TEXT NOT NULL,"
+            " minhash BLOB NOT NULL,"
+            " results TEXT NOT NULL,"
+            " updated REAL NOT NULL,"
+            " PRIMARY KEY (doc_hash, reuse_key))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS dedup_text ON dedup_docs (text_hash, reuse_key)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS dedup_bands ("
+            " band INTEGER NOT NULL,"
+            " bucket TEXT NOT NULL,"
+            " doc_hash TEXT NOT NULL,"
+            " reuse_key TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS dedup_bucket ON dedup_bands (band, bucket, reuse_key)")
+        self._conn.commit()
+
+    def add(self, doc_hash: str, reuse_key: str, sig: Signature, results: List[Dict],
+            path: Optional[str] = None) -> None:
+        """Store a parsed document's signature and results."""
+        with self._lock:
+            self._conn.execute("DELETE FROM dedup_bands WHERE doc_hash = ? AND reuse_key = ?", (doc_hash, reuse_key))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO dedup_docs (doc_hash, reuse_key, path, text_hash, pages, minhash, results,"
+                " updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (doc_hash, reuse_key, path, sig.text_hash, json.dumps(sig.page_hashes), sig.minhash,
+                 json.dumps(results, ensure_ascii=False), time.time())
+            )
+            self._conn.executemany(
+                "INSERT INTO dedup_bands (band, bucket, doc_hash, reuse_key) VALUES (?, ?, ?, ?)",
+                [(i, bucket, doc_hash, reuse_key) for i, bucket in enumerate(_bands(sig.minhash))]
+            )
+            self._conn.commit()
+
+    def find(self, sig: Signature, reuse_key: str, exclude: Optional[str] = None) -> Optional[Match]:
+        """Best earlier document with the same text, else the most similar one above the threshold."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT doc_hash, path, results FROM dedup_docs WHERE text_hash = ? AND reuse_key = ?"
+                " AND doc_hash != ? ORDER BY updated DESC LIMIT 1",
+                (sig.text_hash, reuse_key, exclude or "")
+            ).fetchone()
+            if row is not None:
+                self.exact += 1
+                return Match(row[0], row[1], 1.0, True, [], json.loads(row[2]))
+
+            candidates = set()
+            for i, bucket in enumerate(_bands(sig.minhash)):
+                candidates.update(r[0] for r in self._conn.execute(
+                    "SELECT doc_hash FROM dedup_bands WHERE band = ? AND bucket = ? AND reuse_key = ?",
+                    (i, bucket, reuse_key)))
+            candidates.discard(exclude)
+            best = None
+            for doc_hash in candidates:
+                row = self._conn.execute(
+                    "SELECT path, pages, minhash, results FROM dedup_docs WHERE doc_hash = ? AND reuse_key = ?",
+                    (doc_hash, reuse_key)
+                ).fetchone()
+                if row is None:
+                    continue
+                sim = similarity(sig.minhash, row[2])
+                if sim >= self.threshold and (best is None or sim > best[0]):
+                    best = (sim, doc_hash, row)
+            if best is None:
+                return None
+            sim, doc_hash, (path, pages, _, results) = best
+            known = set(json.loads(pages).values())
+            changed = sorted(p for p, h in sig.page_hashes.items() if h not in known)
+            self.near += 1
+            return Match(doc_hash, path, sim, False, changed, json.loads(results))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            (docs,) = self._conn.execute("SELECT COUNT(*) FROM dedup_docs").fetchone()
+        return {"exact": self.exact, "near": self.near, "documents": docs}
+
+
+def reuse_key(*parts) -> str:
+    """Key under which results may be reused: anything that changes what a parse returns."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:32]
+
+
+_dedup_index: Optional[DedupIndex] = None
+_dedup_index_lock = threading.Lock()
+
+
+def get_dedup_index() -> Optional[DedupIndex]:
+    """Return the shared dedup index, or None if it is disabled."""
+    global _dedup_index
+    if not DEDUP_ENABLED:
+        return None
+    with _dedup_index_lock:
+        if _dedup_index is None:
+            _dedup_index = DedupIndex(DEDUP_PATH)
+        return _dedup_index
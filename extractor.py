@@ -1,53 +1,342 @@
 """
 extractor.py
-- extract_text_from_pdf(pdf_path): returns list of pages' text
+- extract_text_from_pdf(pdf_path, backend, workers): returns list of pages' text
+  (served from the page text cache in cache.py when the PDF was seen before;
+  long PDFs are split into page ranges across a process pool)
+- iter_page_texts(pdf_path, ...): generator variant, one page at a time
+- PDFs can be given as a path, raw bytes or a binary file-like object
 - extract_chunks_from_termsheet(termsheet_pdf, chunk_size=2000, overlap=200)
-  returns list of dicts: { "chunk": str, "source": "termsheet", "page": int, "folder": folder_name }
+  returns a chunk_store.ChunkStore; it reads like a list of dicts:
+  { "chunk": str, "source": "termsheet", "page": int, "folder": folder_name }
+  chunker="chars" cuts character windows per page; chunker="tokens" cuts
+  token-sized chunks at line/sentence boundaries across pages (CHUNKER)
+- iter_chunks_from_termsheet(...): generator variant, yields chunks page by page
+  (the token chunker needs the whole document first; documents up to
+  PAGE_CACHE_MAX_PAGES pages are also held for the page cache)
+- LazyTermsheet(termsheet_pdf, fields, ...): incremental variant; reads pages
+  in small batches and stops once the prompts' fields look covered, so long
+  offering documents are not read to the end; extend(missing) reads on
+  (extraction and chunking time are recorded as metrics.py spans)
 """
 
-import pdfplumber
-from typing import List, Dict
+import io
+import math
+import time
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, BinaryIO, Iterator, Optional, Union
 
-def extract_text_from_pdf(path: str) -> List[str]:
-    """Return list of page texts (index 0 == page 1). Uses pdfplumber."""
-    pages = []
-    with pdfplumber.open(path) as pdf:
+from cache import PageCache, get_page_cache
+from chunk_store import ChunkStore, chunk_offsets
+from metrics import record_span, span
+from rules import labelled
+from config import EXTRACT_BACKEND, EXTRACT_PAGE_WORKERS, EXTRACT_SHARD_MIN_PAGES, PAGE_CACHE_MAX_PAGES
+from config import CHUNKER, CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS
+from config import EXTRACT_LAZY_BATCH, EXTRACT_LAZY_COVERAGE, EXTRACT_LAZY_PATIENCE
+
+# Bump whenever extraction output changes, so cached page texts are invalidated
+EXTRACTOR_VERSION = "1"
+
+BACKENDS = ("pdfplumber", "pypdf")
+
+# A PDF given as a file path, its raw bytes, or a binary file-like object
+# (e.g. a Streamlit UploadedFile)
+PdfSource = Union[str, bytes, BinaryIO]
+
+
+def file_sha256(path: str) -> str:
+    """Hex SHA-256 of a file's bytes."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _read_source(source: PdfSource) -> Union[str, bytes]:
+    """Paths are kept as-is; file-like objects are read into bytes."""
+    if isinstance(source, (str, bytes)):
+        return source
+    if hasattr(source, "getvalue"):
+        return source.getvalue()
+    source.seek(0)
+    return source.read()
+
+
+def content_sha256(source: Union[str, bytes]) -> str:
+    """Hex SHA-256 of a PDF given as a path or as bytes."""
+    if isinstance(source, bytes):
+        return hashlib.sha256(source).hexdigest()
+    return file_sha256(source)
+
+
+def _as_file(source: Union[str, bytes]):
+    return io.BytesIO(source) if isinstance(source, bytes) else source
+
+
+# pdfplumber and pypdf are imported where pages are read, so importing this
+# module (e.g. in main.py or a freshly spawned worker) stays cheap
+
+def _page_count(path: Union[str, bytes]) -> int:
+    from pypdf import PdfReader
+    return len(PdfReader(_as_file(path)).pages)
+
+
+def _iter_range(path: Union[str, bytes], start: int, end: Optional[int], backend: str) -> Iterator[str]:
+    """
+    Yield texts of pages [start, end) (0-based; end=None means to the last page).
+    Each page's parsed objects are released once its text has been taken.
+    The pypdf backend falls back to pdfplumber for pages it returns empty.
+    """
+    if backend == "pypdf":
+        from pypdf import PdfReader
+
+        reader = PdfReader(_as_file(path))
+        end = len(reader.pages) if end is None else end
+        for i in range(start, end):
+            text = reader.pages[i].extract_text() or ""
+            if not text.strip():
+                import pdfplumber
+                with pdfplumber.open(_as_file(path), pages=[i + 1]) as pdf:
+                    text = pdf.pages[0].extract_text() or ""
+            yield text
+        return
+
+    import pdfplumber
+
+    page_numbers = None if start == 0 and end is None else list(range(start + 1, end + 1))
+    with pdfplumber.open(_as_file(path), pages=page_numbers) as pdf:
         for p in pdf.pages:
             text = p.extract_text() or ""
-            pages.append(text)
-    return pages
+            p.close()
+            yield text
+
+
+def _extract_range(path: Union[str, bytes], start: int, end: Optional[int], backend: str) -> List[str]:
+    return list(_iter_range(path, start, end, backend))
+
+
+def iter_page_texts(path: PdfSource, use_cache: bool = True, backend: str = EXTRACT_BACKEND,
+                    workers: int = EXTRACT_PAGE_WORKERS) -> Iterator[str]:
+    """
+    Yield page texts in page order (first item == page 1).
+    path: file path, PDF bytes or a binary file-like object
+    backend: "pdfplumber" or "pypdf"
+    workers: processes used to shard PDFs of EXTRACT_SHARD_MIN_PAGES pages or more
+    The page cache is filled once the last page has been yielded; pages are
+    kept for it only up to PAGE_CACHE_MAX_PAGES, longer documents are not cached.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown extraction backend: {backend!r} (expected one of {BACKENDS})")
+
+    path = _read_source(path)
+    cache = get_page_cache() if use_cache else None
+    if cache is not None:
+        key = PageCache.make_key(content_sha256(path), EXTRACTOR_VERSION, {"engine": backend})
+        cached = cache.get(key)
+        if cached is not None:
+            yield from cached
+            return
+
+    pages = [] if cache is not None else None
+    n_pages = _page_count(path) if workers > 1 else 0
+    if n_pages >= max(2, EXTRACT_SHARD_MIN_PAGES):
+        # Several small ranges per worker keeps the pool busy when pages differ in cost
+        if n_pages > PAGE_CACHE_MAX_PAGES:
+            pages = None
+        size = max(1, math.ceil(n_pages / (workers * 4)))
+        starts = list(range(0, n_pages, size))
+        ends = [min(s + size, n_pages) for s in starts]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            shards = pool.map(_extract_range, [path] * len(starts), starts, ends, [backend] * len(starts))
+            for shard in shards:
+                for text in shard:
+                    if pages is not None:
+                        pages.append(text)
+                    yield text
+    else:
+        for text in _iter_range(path, 0, None, backend):
+            if pages is not None:
+                pages.append(text)
+                if len(pages) > PAGE_CACHE_MAX_PAGES:
+                    pages = None
+            yield text
+
+    if cache is not None and pages is not None:
+        cache.put(key, pages)
+
+
+def extract_text_from_pdf(path: PdfSource, use_cache: bool = True, backend: str = EXTRACT_BACKEND,
+                          workers: int = EXTRACT_PAGE_WORKERS) -> List[str]:
+    """Return list of page texts (index 0 == page 1). See iter_page_texts."""
+    return list(iter_page_texts(path, use_cache=use_cache, backend=backend, workers=workers))
 
 def chunk_text(text: str, chunk_size: int = 2000, overlap: int = 200) -> List[str]:
-    """Naive chunking by characters with overlap."""
-    if not text:
-        return []
-    chunks = []
-    step = chunk_size - overlap
-    i = 0
-    while i < len(text):
-        chunk = text[i:i+chunk_size]
-        chunks.append(chunk.strip())
-        i += step
-    return chunks
-
-def extract_chunks_from_termsheet(termsheet_pdf: str,chunk_size: int = 500, overlap: int = 200,folder_name: str = None) -> List[Dict]:
-    """
-    Extracts text from a single Term Sheet PDF, chunks per page,
-    and returns list of chunk dicts.
-    Each dict: {chunk, source="termsheet", page, chunk_index, folder}
-    """
-    all_chunks = []
-
-    pages = extract_text_from_pdf(termsheet_pdf)
-    for idx, page_text in enumerate(pages, start=1):
-        page_chunks = chunk_text(page_text, chunk_size=chunk_size, overlap=overlap)
-        for c_idx, chunk in enumerate(page_chunks, start=1):
-            all_chunks.append({
-                "chunk": chunk,
-                "source": "termsheet",
-                "page": idx,
-                "chunk_index": c_idx,
-                "folder": folder_name
-            })
-
-    return all_chunks
+    """Naive chunking by characters with overlap (see chunk_store.chunk_offsets)."""
+    return [text[start:end] for start, end in chunk_offsets(text, chunk_size=chunk_size, overlap=overlap)]
+
+def _timed_pages(termsheet_pdf: PdfSource) -> Iterator[str]:
+    """iter_page_texts, recording the time spent on each page as an "extract" span."""
+    pages = iter_page_texts(termsheet_pdf)
+    while True:
+        start = time.perf_counter()
+        page_text = next(pages, None)
+        record_span("extract", time.perf_counter() - start)
+        if page_text is None:
+            return
+        yield page_text
+
+def iter_chunks_from_termsheet(termsheet_pdf: PdfSource, chunk_size: int = 500, overlap: int = 200,
+                               folder_name: str = None, chunker: str = CHUNKER) -> Iterator[Dict]:
+    """
+    Streaming variant of extract_chunks_from_termsheet: yields chunks page by
+    page, so only the current page is chunked at a time. Pages are still kept
+    for the page cache up to PAGE_CACHE_MAX_PAGES (see iter_page_texts), and
+    chunker="tokens" reads the whole document before the first chunk.
+    """
+    if chunker == "tokens":
+        yield from extract_chunks_from_termsheet(termsheet_pdf, folder_name=folder_name, chunker=chunker)
+        return
+    for idx, page_text in enumerate(_timed_pages(termsheet_pdf), start=1):
+        page = ChunkStore(source="termsheet", folder=folder_name)
+        with span("chunk"):
+            page.add_page(idx, page_text, chunk_size=chunk_size, overlap=overlap)
+        yield from page
+
+def extract_chunks_from_termsheet(termsheet_pdf: PdfSource,chunk_size: int = 500, overlap: int = 200,folder_name: str = None,
+                                  chunker: str = CHUNKER, max_tokens: int = CHUNK_TOKENS,
+                                  overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> ChunkStore:
+    """
+    Extracts text from a single Term Sheet PDF (path, bytes or file-like),
+    chunks it, and returns the chunks as a ChunkStore.
+    Each chunk reads like a dict: {chunk, source="termsheet", page, chunk_index, folder, page_span}
+    (store.to_dicts() gives plain dicts)
+    chunker="chars": chunk_size/overlap characters per page;
+    chunker="tokens": max_tokens/overlap_tokens, across pages
+    """
+    if chunker not in ("chars", "tokens"):
+        raise ValueError(f"Unknown chunker: {chunker!r} (expected 'chars' or 'tokens')")
+    store = ChunkStore(source="termsheet", folder=folder_name)
+    if chunker == "tokens":
+        pages = list(_timed_pages(termsheet_pdf))
+        with span("chunk"):
+            store.add_document(pages, max_tokens=max_tokens, overlap_tokens=overlap_tokens)
+        return store
+    for idx, page_text in enumerate(_timed_pages(termsheet_pdf), start=1):
+        with span("chunk"):
+            store.add_page(idx, page_text, chunk_size=chunk_size, overlap=overlap)
+    return store
+
+
+class LazyTermsheet:
+    """
+    Incremental extraction of one Term Sheet.
+    Pages are read batch_pages at a time and chunked into .chunks with the
+    same chunker as extract_chunks_from_termsheet: per page for "chars";
+    for "tokens" the pages read so far are rechunked as one document after
+    each batch, so chunks cross page breaks as in a full run. A field counts as covered
+    once a page has a line labelled with it (rules.labelled). extend() stops
+    when `coverage` of the wanted fields are covered, when `patience`
+    batches in a row cover nothing new (only counted once something is
+    covered: the key terms have been passed), or at the last page.
+    Picklable, so extraction workers can return it and the LLM stage can
+    resume it; the pickle holds the chunks read so far, not the page cache
+    entry, which is fetched again when more pages are read.
+    """
+
+    def __init__(self, termsheet_pdf: PdfSource, fields: List[str], chunk_size: int = 500, overlap: int = 200,
+                 folder_name: str = None, batch_pages: int = EXTRACT_LAZY_BATCH,
+                 coverage: float = EXTRACT_LAZY_COVERAGE, patience: int = EXTRACT_LAZY_PATIENCE,
+                 backend: str = EXTRACT_BACKEND, use_cache: bool = True, chunker: str = CHUNKER,
+                 max_tokens: int = CHUNK_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown extraction backend: {backend!r} (expected one of {BACKENDS})")
+        if chunker not in ("chars", "tokens"):
+            raise ValueError(f"Unknown chunker: {chunker!r} (expected 'chars' or 'tokens')")
+        self.source = _read_source(termsheet_pdf)
+        self.fields = list(fields)
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.chunker = chunker
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.batch_pages = max(1, batch_pages)
+        self.coverage = coverage
+        self.patience = max(1, patience)
+        self.backend = backend
+        self.use_cache = use_cache
+        self.chunks = ChunkStore(source="termsheet", folder=folder_name)
+        self.covered = set()
+        self.pages_read = 0  # the page texts themselves are only held by .chunks
+
+        self._cached = None
+        cache = get_page_cache() if use_cache else None
+        if cache is not None:
+            self._cached = cache.get(self._cache_key())
+        self._in_cache = self._cached is not None
+        self.n_pages = len(self._cached) if self._in_cache else _page_count(self.source)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_cached"] = None
+        return state
+
+    def _cache_key(self) -> str:
+        return PageCache.make_key(content_sha256(self.source), EXTRACTOR_VERSION, {"engine": self.backend})
+
+    @property
+    def done(self) -> bool:
+        return self.pages_read >= self.n_pages
+
+    def _read_batch(self) -> List[str]:
+        start = self.pages_read
+        end = min(start + self.batch_pages, self.n_pages)
+        t = time.perf_counter()
+        if self._in_cache and self._cached is None:
+            # Dropped when pickled; None again if it has been evicted since
+            cache = get_page_cache() if self.use_cache else None
+            self._cached = cache.get(self._cache_key()) if cache is not None else None
+        if self._cached is not None:
+            texts = self._cached[start:end]
+        else:
+            texts = _extract_range(self.source, start, end, self.backend)
+        record_span("extract", time.perf_counter() - t)
+        with span("chunk"):
+            if self.chunker == "tokens":
+                # Pages without text have no chunk buffer
+                page_texts = self.chunks.page_texts()
+                pages = [page_texts.get(p, "") for p in range(1, start + 1)] + list(texts)
+                self.chunks = ChunkStore(source=self.chunks.source, folder=self.chunks.folder)
+                self.chunks.add_document(pages, max_tokens=self.max_tokens, overlap_tokens=self.overlap_tokens)
+            else:
+                for page_no, text in enumerate(texts, start=start + 1):
+                    self.chunks.add_page(page_no, text, chunk_size=self.chunk_size, overlap=self.overlap)
+        self.pages_read = end
+
+        # Read to the end after all: same as a full extraction, so fill the page cache
+        cache = get_page_cache() if self.use_cache else None
+        if self.done and not self._in_cache and cache is not None and self.n_pages <= PAGE_CACHE_MAX_PAGES:
+            # Pages without text have no chunk buffer
+            page_texts = self.chunks.page_texts()
+            cache.put(self._cache_key(), [page_texts.get(p, "") for p in range(1, self.n_pages + 1)])
+        return texts
+
+    def extend(self, wanted: Optional[List[str]] = None) -> List[str]:
+        """
+        Read more pages for the wanted fields (default: all fields).
+        Returns the wanted fields covered by the pages read in this call.
+        """
+        wanted = self.fields if wanted is None else list(wanted)
+        newly: List[str] = []
+        stale = 0
+        while not self.done:
+            if wanted and sum(f in self.covered for f in wanted) / len(wanted) >= self.coverage:
+                break
+            if self.covered and stale >= self.patience:
+                break
+            texts = self._read_batch()
+            found = [f for f in wanted if f not in self.covered and any(labelled(f, t) for t in texts)]
+            self.covered.update(found)
+            newly.extend(found)
+            stale = 0 if found else stale + 1
+        return newly
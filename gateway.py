@@ -0,0 +1,335 @@
+"""
+gateway.py
+- ProviderGateway: one entry point for all LLM provider calls
+  - long-lived clients pooled per (provider, api key), so HTTP connections
+    and TLS sessions are reused across calls and threads
+  - per-provider request and token rate limits (token buckets, see
+    PROVIDER_LIMITS in config.py); the rate backs off on 429s and creeps
+    back up to the configured limit on success
+  - retries honour Retry-After and otherwise use jittered exponential
+    backoff; non-retryable client errors (400/401/403/404) raise at once
+  - every call's prompt/completion tokens and retries go to metrics.py
+  - call(..., consume=f) reads a streamed response inside the retry loop:
+    f(stream) returns the assembled response, and a MalformedJSON it raises
+    (see json_stream.py) is retried at once, without backoff; the tokens of
+    such a discarded attempt (the exception's .usage, if set) are settled
+    with the rate limiter and counted in the call's metrics
+- PROVIDERS: provider registry (API key variable, client factory, response
+  and stream readers); SDKs are imported only when a provider's first client is made
+- api_key(provider): key from the environment (.env loaded on first use)
+- get_gateway(): process-wide instance
+"""
+
+import os
+import re
+import time
+import random
+import threading
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple
+
+from json_stream import MalformedJSON
+from metrics import record_llm_call
+from config import PROVIDER_LIMITS, LLM_MAX_RETRIES, LLM_BACKOFF_BASE, LLM_BACKOFF_MAX
+
+
+# ---------------- Rate limiting ---------------- #
+
+class TokenBucket:
+    """Thread-safe token bucket refilled at `rate_per_minute`."""
+
+    def __init__(self, rate_per_minute: float):
+        self.max_rate = float(rate_per_minute)
+        self.rate = float(rate_per_minute)
+        self.capacity = float(rate_per_minute)
+        self.tokens = self.capacity
+        self.paused_until = 0.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate / 60.0)
+        self._updated = now
+
+    def acquire(self, amount: float = 1.0) -> float:
+        """Block until `amount` is available (capped at capacity); returns seconds waited."""
+        amount = min(float(amount), self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.paused_until and self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                delay = max(self.paused_until - now, (amount - self.tokens) * 60.0 / self.rate)
+            delay = min(max(delay, 0.01), 5.0)
+            time.sleep(delay)
+            waited += delay
+
+    def debit(self, amount: float) -> None:
+        """Account for usage discovered after the call (may go negative)."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens -= amount
+
+    def refund(self, amount: float) -> None:
+        """Give back what acquire(amount) took, for a request that used nothing."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.capacity, self.tokens + min(float(amount), self.capacity))
+
+    def throttled(self, pause: float) -> None:
+        """Provider said 429: pause everyone and lower the rate."""
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + pause)
+            self.rate = max(self.max_rate * 0.1, self.rate * 0.7)
+
+    def succeeded(self) -> None:
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.02)
+
+
+# ---------------- Errors ---------------- #
+
+def _status_code(exc: Exception) -> Optional[int]:
+    for attr in ("status_code", "code"):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(exc, "response", None)
+    value = getattr(response, "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    """Seconds the provider asked us to wait, if it said so."""
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass
+    # Gemini puts it in the error details: 'retryDelay': '13s'
+    m = re.search(r"retryDelay['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)s", str(exc))
+    return float(m.group(1)) if m else None
+
+
+def _is_retryable(status: Optional[int]) -> bool:
+    # No status: network error or timeout
+    return status is None or status == 408 or status == 409 or status == 429 or status >= 500
+
+
+# ---------------- Providers ---------------- #
+
+def _make_groq_client(api_key: str):
+    from groq import Groq
+    return Groq(api_key=api_key)
+
+
+def _make_gemini_client(api_key: str):
+    from google import genai
+    return genai.Client(api_key=api_key)
+
+
+def _groq_usage(resp: Any) -> int:
+    return getattr(getattr(resp, "usage", None), "total_tokens", 0) or 0
+
+
+def _gemini_usage(resp: Any) -> int:
+    return getattr(getattr(resp, "usage_metadata", None), "total_token_count", 0) or 0
+
+
+def _groq_usage_split(resp: Any) -> Tuple[int, int]:
+    usage = getattr(resp, "usage", None)
+    return (getattr(usage, "prompt_tokens", 0) or 0, getattr(usage, "completion_tokens", 0) or 0)
+
+
+def _gemini_usage_split(resp: Any) -> Tuple[int, int]:
+    prompt = getattr(getattr(resp, "usage_metadata", None), "prompt_token_count", 0) or 0
+    # Completion includes thinking tokens, which are billed as output
+    return prompt, max(0, _gemini_usage(resp) - prompt)
+
+
+def _groq_text(resp: Any) -> str:
+    return resp.choices[0].message.content
+
+
+def _gemini_text(resp: Any) -> str:
+    return resp.text
+
+
+# Streams: text deltas per chunk, and a response assembled from the text read
+# and the last chunk seen (with usage estimated if the stream was cut short)
+
+def _groq_delta(chunk: Any) -> str:
+    choices = getattr(chunk, "choices", None)
+    return (choices[0].delta.content or "") if choices else ""
+
+
+def _gemini_delta(chunk: Any) -> str:
+    return getattr(chunk, "text", None) or ""
+
+
+def _groq_assemble(text: str, last: Any, prompt_tokens: int, completion_tokens: int) -> Any:
+    # Groq reports usage on the final chunk, under x_groq
+    usage = getattr(getattr(last, "x_groq", None), "usage", None) or getattr(last, "usage", None)
+    if usage is None:
+        usage = SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                                total_tokens=prompt_tokens + completion_tokens)
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))], usage=usage)
+
+
+def _gemini_assemble(text: str, last: Any, prompt_tokens: int, completion_tokens: int) -> Any:
+    usage = getattr(last, "usage_metadata", None)
+    if not getattr(usage, "total_token_count", None):
+        usage = SimpleNamespace(prompt_token_count=prompt_tokens, total_token_count=prompt_tokens + completion_tokens)
+    return SimpleNamespace(text=text, usage_metadata=usage)
+
+
+class Provider(NamedTuple):
+    env_key: str                                      # environment variable holding the API key
+    make_client: Callable[[str], Any]                 # api_key -> SDK client (imports the SDK)
+    usage: Callable[[Any], int]                       # response -> total tokens
+    usage_split: Callable[[Any], Tuple[int, int]]     # response -> (prompt, completion) tokens
+    text: Callable[[Any], str]                        # response -> output text
+    delta: Callable[[Any], str]                       # stream chunk -> output text delta
+    assemble: Callable[[str, Any, int, int], Any]     # (text, last chunk, prompt, completion tokens) -> response
+
+
+PROVIDERS: Dict[str, Provider] = {
+    "groq": Provider("GROQ_API_KEY", _make_groq_client, _groq_usage, _groq_usage_split, _groq_text,
+                     _groq_delta, _groq_assemble),
+    "gemini": Provider("GEMINI_API_KEY", _make_gemini_client, _gemini_usage, _gemini_usage_split, _gemini_text,
+                       _gemini_delta, _gemini_assemble),
+}
+
+
+def get_provider(name: str) -> Provider:
+    try:
+        return PROVIDERS[name]
+    except KeyError:
+        raise ValueError(f"Unknown provider: {name!r} (expected one of {sorted(PROVIDERS)})") from None
+
+
+_env_loaded = False
+
+
+def api_key(provider: str) -> Optional[str]:
+    """The provider's API key; .env is read on the first lookup, not at import."""
+    global _env_loaded
+    if not _env_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _env_loaded = True
+    return os.getenv(get_provider(provider).env_key)
+
+
+# ---------------- Gateway ---------------- #
+
+class ProviderGateway:
+
+    def __init__(self, limits: Dict[str, Dict] = PROVIDER_LIMITS, max_retries: int = LLM_MAX_RETRIES,
+                 backoff_base: float = LLM_BACKOFF_BASE, backoff_max: float = LLM_BACKOFF_MAX):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._clients: Dict[tuple, Any] = {}
+        self._lock = threading.Lock()
+        self._request_buckets = {p: TokenBucket(l["requests_per_minute"]) for p, l in limits.items()
+                                 if l.get("requests_per_minute")}
+        self._token_buckets = {p: TokenBucket(l["tokens_per_minute"]) for p, l in limits.items()
+                               if l.get("tokens_per_minute")}
+
+    def client(self, provider: str, api_key: str) -> Any:
+        """Return the pooled client for (provider, api_key), creating it once."""
+        key = (provider, api_key)
+        with self._lock:
+            c = self._clients.get(key)
+            if c is None:
+                c = self._clients[key] = get_provider(provider).make_client(api_key)
+            return c
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter: uniform in [0, min(max, base * 2^attempt)]
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def call(self, provider: str, api_key: str, request: Callable[[Any], Any],
+             est_tokens: int = 0, max_retries: Optional[int] = None,
+             consume: Optional[Callable[[Any], Any]] = None) -> Any:
+        """
+        Run request(client) under the provider's rate limits, with retries.
+        est_tokens: expected tokens for the call, debited before it is sent;
+        the difference to the reported usage is settled afterwards.
+        consume: for streamed requests, turns the stream into the response;
+        errors while reading the stream are retried like request errors.
+        """
+        # max_retries counts attempts: anything below 1 still sends the request once
+        max_retries = max(1, self.max_retries if max_retries is None else max_retries)
+        requests = self._request_buckets.get(provider)
+        tokens = self._token_buckets.get(provider)
+        client = self.client(provider, api_key)
+        # Tokens spent on attempts whose output was thrown away
+        discarded_prompt, discarded_completion = 0, 0
+
+        for attempt in range(1, max_retries + 1):
+            if requests:
+                requests.acquire(1)
+            if tokens and est_tokens:
+                tokens.acquire(est_tokens)
+            try:
+                resp = request(client)
+                if consume is not None:
+                    resp = consume(resp)
+            except Exception as e:
+                usage = getattr(e, "usage", None)
+                if usage:
+                    discarded_prompt += usage[0]
+                    discarded_completion += usage[1]
+                    if tokens:
+                        tokens.debit(sum(usage) - est_tokens)
+                elif tokens and est_tokens:
+                    # A failed request (timeout, 5xx, 429) has no usage to settle: return the estimate
+                    tokens.refund(est_tokens)
+                status = _status_code(e)
+                if attempt == max_retries or not _is_retryable(status):
+                    record_llm_call(provider, discarded_prompt, discarded_completion, retries=attempt - 1)
+                    raise
+                if isinstance(e, MalformedJSON):
+                    # The model produced bad output, not the provider: ask again now
+                    continue
+                wait = _retry_after(e)
+                if status == 429:
+                    pause = wait if wait is not None else self._backoff(attempt)
+                    for bucket in (requests, tokens):
+                        if bucket:
+                            bucket.throttled(pause)
+                time.sleep(wait if wait is not None else self._backoff(attempt))
+                continue
+
+            for bucket in (requests, tokens):
+                if bucket:
+                    bucket.succeeded()
+            spec = get_provider(provider)
+            if tokens:
+                used = spec.usage(resp)
+                if used:
+                    tokens.debit(used - est_tokens)
+            prompt_tokens, completion_tokens = spec.usage_split(resp)
+            record_llm_call(provider, prompt_tokens + discarded_prompt, completion_tokens + discarded_completion,
+                            retries=attempt - 1)
+            return resp
+
+
+_gateway: Optional[ProviderGateway] = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway() -> ProviderGateway:
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            _gateway = ProviderGateway()
+        return _gateway
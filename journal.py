@@ -0,0 +1,86 @@
+"""
+journal.py
+- Journal: durable SQLite record of batch progress, keyed by PDF content hash.
+  Each document moves through STAGES (extracted -> retrieved -> parsed ->
+  written); parsed results are stored so a rerun can write them without
+  calling the LLM again, and written documents are skipped entirely.
+"""
+
+import json
+import time
+import threading
+from typing import Dict, List, Optional
+
+from cache import open_sqlite
+
+STAGES = ("extracted", "retrieved", "parsed", "written")
+
+
+class Journal:
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = open_sqlite(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            " hash TEXT PRIMARY KEY,"
+            " path TEXT,"
+            " extracted REAL,"
+            " retrieved REAL,"
+            " parsed REAL,"
+            " written REAL,"
+            " results TEXT,"
+            " updated REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def mark(self, doc_hash: str, stage: str, path: Optional[str] = None,
+             results: Optional[List[Dict]] = None) -> None:
+        """Record that `stage` finished for a document (results only for "parsed")."""
+        if stage not in STAGES:
+            raise ValueError(f"Unknown journal stage: {stage!r} (expected one of {STAGES})")
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO documents (hash, path, updated) VALUES (?, ?, ?)"
+                " ON CONFLICT(hash) DO UPDATE SET path = COALESCE(excluded.path, path), updated = excluded.updated",
+                (doc_hash, path, now)
+            )
+            self._conn.execute(f"UPDATE documents SET {stage} = ? WHERE hash = ?", (now, doc_hash))
+            if results is not None:
+                self._conn.execute("UPDATE documents SET results = ? WHERE hash = ?",
+                                   (json.dumps(results, ensure_ascii=False), doc_hash))
+            self._conn.commit()
+
+    def mark_many(self, doc_hashes: List[str], stage: str) -> None:
+        for doc_hash in doc_hashes:
+            self.mark(doc_hash, stage)
+
+    def status(self, doc_hash: str) -> Optional[Dict]:
+        """Return {stage: timestamp or None, "path": ...} or None if never seen."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT path, extracted, retrieved, parsed, written FROM documents WHERE hash = ?", (doc_hash,)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("path",) + STAGES, row))
+
+    def is_written(self, doc_hash: str) -> bool:
+        st = self.status(doc_hash)
+        return bool(st and st["written"])
+
+    def parsed_results(self, doc_hash: str) -> Optional[List[Dict]]:
+        """Stored results of a parsed but not yet written document."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT results FROM documents WHERE hash = ? AND parsed IS NOT NULL", (doc_hash,)
+            ).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def reset(self, doc_hash: str) -> None:
+        """Forget a document so it is processed from scratch."""
+        with self._lock:
+            self._conn.execute("DELETE FROM documents WHERE hash = ?", (doc_hash,))
+            self._conn.commit()
@@ -0,0 +1,219 @@
+"""
+json_stream.py
+- JSONStreamParser(schema): incremental JSON parser for model output
+  - feed(text) takes output as it streams in and returns True once the
+    top-level object/array is closed (the rest of the stream can be dropped)
+  - raises MalformedJSON as soon as the output cannot become valid JSON:
+    a syntax error, an object key that is not in the prompt's json_schema
+    (checked at every nesting level the schema describes), an array where
+    the schema expects an object, or more than max_preamble characters of
+    text before the JSON starts
+  - control characters inside strings are accepted (json.loads strict=False),
+    as models often put raw newlines in values
+- parse_json_text(text, schema): the first JSON value in a complete text,
+  in linear time (replaces a greedy regex over the whole output)
+"""
+
+import re
+import json
+from typing import Any, List, Optional
+
+_NUMBER_RE = re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?")
+_NUMBER_PREFIX_RE = re.compile(r"-?(?:0|[1-9]\d*)?(?:\.\d*)?(?:[eE][+-]?\d*)?")
+_LITERALS = ("true", "false", "null")
+_LITERAL_CHARS = frozenset("-+0123456789.eEtrufalsn")
+_ESCAPES = frozenset('"\\/bfnrtu')
+_HEX = frozenset("0123456789abcdefABCDEF")
+
+
+class MalformedJSON(ValueError):
+    """Model output that cannot become the expected JSON."""
+
+
+class JSONStreamParser:
+
+    def __init__(self, schema: Any = None, max_preamble: Optional[int] = 200):
+        self.schema = schema
+        self.max_preamble = max_preamble
+        self.done = False
+        self.keys: List[str] = []          # top-level keys, in order
+        self._chars: List[str] = []
+        self._preamble = 0
+        self._stack: List[list] = []       # [opener, schema, current key]
+        self._state = "start"
+        self._string: Optional[List[str]] = None
+        self._string_is_key = False
+        self._escape = False
+        self._hex_left = 0
+        self._literal: List[str] = []
+
+    @property
+    def started(self) -> bool:
+        return self._state != "start"
+
+    @property
+    def text(self) -> str:
+        """The JSON text consumed so far (from its first bracket)."""
+        return "".join(self._chars)
+
+    def value(self) -> Any:
+        if not self.done:
+            raise MalformedJSON("JSON is not complete")
+        return json.loads(self.text, strict=False)
+
+    def _fail(self, reason: str) -> None:
+        raise MalformedJSON(f"{reason} (at offset {len(self._chars)})")
+
+    # ---------------- Feeding ---------------- #
+
+    def feed(self, text: str) -> bool:
+        """Consume more output; True once the top-level value is closed."""
+        for ch in text:
+            if self.done:
+                break
+            if self._state == "start":
+                self._before_start(ch)
+            elif self._string is not None:
+                self._chars.append(ch)
+                self._in_string(ch)
+            else:
+                self._chars.append(ch)
+                self._structural(ch)
+        return self.done
+
+    def _before_start(self, ch: str) -> None:
+        if ch in "{[":
+            if ch == "[" and isinstance(self.schema, dict):
+                self._fail("expected a JSON object, got an array")
+            self._chars.append(ch)
+            self._open(ch)
+            return
+        if not ch.isspace():
+            self._preamble += 1
+            if self.max_preamble is not None and self._preamble > self.max_preamble:
+                self._fail(f"no JSON in the first {self.max_preamble} characters")
+
+    def _in_string(self, ch: str) -> None:
+        if self._hex_left:
+            if ch not in _HEX:
+                self._fail("bad \\u escape")
+            self._hex_left -= 1
+        elif self._escape:
+            if ch not in _ESCAPES:
+                self._fail(f"bad escape \\{ch}")
+            self._escape = False
+            if ch == "u":
+                self._hex_left = 4
+        elif ch == "\\":
+            self._escape = True
+        elif ch == '"':
+            self._end_string()
+            return
+        self._string.append(ch)
+
+    def _end_string(self) -> None:
+        value = "".join(self._string)
+        self._string = None
+        if not self._string_is_key:
+            self._after_value()
+            return
+        try:
+            key = json.loads('"' + value + '"', strict=False)
+        except ValueError:
+            key = value
+        top = self._stack[-1]
+        if isinstance(top[1], dict) and key not in top[1]:
+            self._fail(f"unexpected key {key!r}")
+        top[2] = key
+        if len(self._stack) == 1:
+            self.keys.append(key)
+        self._state = "colon"
+
+    def _structural(self, ch: str) -> None:
+        if self._literal:
+            if ch in _LITERAL_CHARS:
+                self._literal.append(ch)
+                self._check_literal(final=False)
+                return
+            self._check_literal(final=True)
+            self._literal = []
+            self._after_value()
+        if ch.isspace():
+            return
+
+        state = self._state
+        top = self._stack[-1][0] if self._stack else None
+        if state in ("value", "value_or_end") and ch in "{[":
+            self._open(ch)
+        elif state in ("value", "value_or_end") and ch == '"':
+            self._string, self._string_is_key = [], False
+        elif state in ("key", "key_or_end") and ch == '"':
+            self._string, self._string_is_key = [], True
+        elif state in ("value", "value_or_end") and ch in _LITERAL_CHARS:
+            self._literal = [ch]
+            self._check_literal(final=False)
+        elif state == "colon" and ch == ":":
+            self._state = "value"
+        elif state == "comma_or_end" and ch == ",":
+            self._state = "key" if top == "{" else "value"
+        elif ch == "}" and top == "{" and state in ("key_or_end", "comma_or_end"):
+            self._close()
+        elif ch == "]" and top == "[" and state in ("value_or_end", "comma_or_end"):
+            self._close()
+        else:
+            self._fail(f"unexpected {ch!r}")
+
+    def _check_literal(self, final: bool) -> None:
+        lit = "".join(self._literal)
+        if final:
+            ok = lit in _LITERALS or _NUMBER_RE.fullmatch(lit)
+        else:
+            ok = any(word.startswith(lit) for word in _LITERALS) or _NUMBER_PREFIX_RE.fullmatch(lit)
+        if not ok:
+            self._fail(f"bad literal {lit!r}")
+
+    def _open(self, ch: str) -> None:
+        schema = None
+        if not self._stack:
+            schema = self.schema
+        else:
+            parent = self._stack[-1]
+            if parent[0] == "{" and isinstance(parent[1], dict):
+                schema = parent[1].get(parent[2])
+        if ch == "[" and isinstance(schema, dict) and self._stack:
+            self._fail(f"expected an object for {self._stack[-1][2]!r}, got an array")
+        self._stack.append([ch, schema if ch == "{" and isinstance(schema, dict) else None, None])
+        self._state = "key_or_end" if ch == "{" else "value_or_end"
+
+    def _close(self) -> None:
+        self._stack.pop()
+        self._after_value()
+
+    def _after_value(self) -> None:
+        if not self._stack:
+            self.done = True
+        self._state = "comma_or_end"
+
+
+def parse_json_text(text: str, schema: Any = None, attempts: int = 3) -> Any:
+    """
+    The first JSON object or array in text (text around it is ignored).
+    If the JSON starting at the first bracket is broken, the next `attempts`-1
+    brackets are tried; raises MalformedJSON if none parses.
+    """
+    error = MalformedJSON("no JSON object or array found")
+    start = 0
+    for _ in range(attempts):
+        starts = [i for i in (text.find("{", start), text.find("[", start)) if i >= 0]
+        if not starts:
+            break
+        start = min(starts)
+        parser = JSONStreamParser(schema, max_preamble=None)
+        try:
+            if parser.feed(text[start:]):
+                return parser.value()
+            error = MalformedJSON("JSON is not complete")
+        except ValueError as e:
+            error = e if isinstance(e, MalformedJSON) else MalformedJSON(str(e))
+        start += 1
+    raise error
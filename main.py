@@ -1,55 +1,381 @@
-
 """
 Main pipeline for Term Sheet extraction
-- Walk MAIN_FOLDER, find all PDFs
-- Extract chunks -> parse -> write to Excel
+- Walk MAIN_FOLDER (recursively), find all PDFs
+- Extract chunks -> parse -> write to the output sink (Excel by default;
+  --sink jsonl/csv/parquet for large runs, see sinks.py)
 - Each PDF corresponds to one row in EXPORT sheet
+- --to-excel SRC converts a jsonl/csv/parquet output to Excel and exits
+- Stages run concurrently (see pipeline.py); rows are still written in
+  sorted file order
+- Progress is journaled by PDF content hash (see journal.py): reruns skip
+  written documents and write parsed-but-unwritten ones without new LLM
+  calls; --force reprocesses selected files
+- Documents whose extracted text matches an earlier one (this run or a
+  previous one) reuse its results; near duplicates can send only their
+  changed pages to the LLM (see dedup.py, DEDUP_* in config.py)
+- --lazy reads long PDFs only as far as the prompts' fields need (see
+  extractor.LazyTermsheet); more pages are read for fields the LLM left empty
+- --watch keeps running after the initial pass: new or modified PDFs under
+  MAIN_FOLDER are processed as they arrive (see watcher.py) and their rows
+  are written right away; arrival-to-row latency and the queue depth go to
+  the run report, which is rewritten after every batch
+- Stage timings, token usage and retries (metrics.py) are written at the end
+  as a JSON run report and a Prometheus textfile (METRICS_* in config.py)
 """
 
 import os
-from extractor import extract_chunks_from_termsheet
+import time
+import argparse
+import fnmatch
+from functools import partial
+from extractor import LazyTermsheet, file_sha256
 from parser import parse_with_llm_gemini
 from parser import parse_with_llm
-from writer import write_to_excel  
+from parser import load_prompts, merge_results, missing_fields
+from pipeline import run_pipeline
+from cache import get_llm_cache
+from dedup import get_dedup_index, reuse_key, signature
+from journal import Journal
+from metrics import document, get_metrics, record_latency, set_gauge, span
+from sinks import SINKS, make_sink, sink_to_excel
+from watcher import FolderWatcher, find_pdfs
+from writer import columns_from_prompts
 from config import MAIN_FOLDER, GEMINI_MODEL, GROQ_MODEL, TOP_K, CHUNK_SIZE, OVERLAP, PROMPTS_FILE
+from config import PROVIDER, EXTRACT_WORKERS, LLM_WORKERS, PIPELINE_QUEUE_SIZE, JOURNAL_PATH, CORPUS_INDEX_ENABLED
+from config import SINK, SINK_PATHS, EXCEL_FILE, METRICS_REPORT_PATH, METRICS_PROM_PATH, EXTRACT_LAZY
+from config import DEDUP_NEAR_DIFF_PAGES
+from config import CHUNKER, CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS, RULES_ENABLED, RULES_SHRINK_CONTEXT
+from config import CONTEXT_BUDGET_ENABLED, PROMPT_BATCHING_ENABLED, LLM_JSON_MODE
 
 
 
 
 def find_all_pdfs(folder_path: str):
-    """Return full paths of all PDFs in folder (non-recursive)."""
-    return [os.path.join(folder_path, f) for f in os.listdir(folder_path)
-            if f.lower().endswith(".pdf")]
+    """Return full paths of all PDFs in folder and its subfolders."""
+    return find_pdfs(folder_path)
+
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Extract structured data from Term Sheet PDFs.")
+    ap.add_argument("--provider", choices=["gemini", "groq"], default=PROVIDER,
+                    help=f"LLM provider (default: {PROVIDER})")
+    ap.add_argument("--workers", type=int, default=EXTRACT_WORKERS,
+                    help=f"extraction processes (default: {EXTRACT_WORKERS})")
+    ap.add_argument("--llm-workers", type=int, default=None,
+                    help="concurrent LLM calls (default: LLM_WORKERS[provider] in config.py)")
+    ap.add_argument("--queue-size", type=int, default=PIPELINE_QUEUE_SIZE,
+                    help=f"documents buffered between stages (default: {PIPELINE_QUEUE_SIZE})")
+    ap.add_argument("--force", nargs="*", metavar="PATTERN", default=None,
+                    help="reprocess files even if already journaled; optional file name patterns "
+                         "(default: all files)")
+    ap.add_argument("--sink", choices=sorted(SINKS), default=SINK,
+                    help=f"output format (default: {SINK})")
+    ap.add_argument("--output", default=None,
+                    help="output path (default: SINK_PATHS[sink] in config.py)")
+    ap.add_argument("--lazy", action=argparse.BooleanOptionalAction, default=EXTRACT_LAZY,
+                    help="extract pages in batches until the fields are found (default: EXTRACT_LAZY in config.py)")
+    ap.add_argument("--watch", action="store_true",
+                    help=f"keep running and process new or modified PDFs under {MAIN_FOLDER} as they arrive")
+    ap.add_argument("--to-excel", metavar="SRC", default=None,
+                    help=f"convert a jsonl/csv/parquet output to Excel (--output, default: {EXCEL_FILE}) and exit")
+    return ap.parse_args(argv)
+
+
+def is_forced(pdf_path: str, patterns) -> bool:
+    if patterns is None:
+        return False
+    if not patterns:
+        return True
+    name = os.path.basename(pdf_path)
+    return any(fnmatch.fnmatch(name, p) or fnmatch.fnmatch(pdf_path, p) for p in patterns)
+
+
+def corpus_index():
+    """The corpus-wide index, or None; numpy/scipy/sklearn are only imported when it is enabled."""
+    if not CORPUS_INDEX_ENABLED:
+        return None
+    from corpus_index import get_corpus_index
+    return get_corpus_index()
+
+
+def parse_document(parse_fn, journal, hashes, pdf_path, chunks, dedup_key=None, forced=()):
+    """
+    LLM stage; retrieval uses the corpus-wide index when it is enabled.
+    A LazyTermsheet is read further while the LLM leaves fields empty that
+    the next pages cover; only those fields are asked again.
+    With dedup_key, results are reused from (near) duplicates in the dedup
+    index, unless pdf_path is in `forced`.
+    """
+    doc_hash = hashes[pdf_path]
+    journal.mark(doc_hash, "extracted", path=pdf_path)
+
+    # Partially read documents have no comparable signature
+    dedup = get_dedup_index() if dedup_key and not isinstance(chunks, LazyTermsheet) else None
+    if dedup is not None and chunks:
+        sig = signature(chunks)
+        match = None if pdf_path in forced else dedup.find(sig, dedup_key, exclude=doc_hash)
+        results = _parse_or_reuse(parse_fn, journal, doc_hash, pdf_path, chunks, match)
+        dedup.add(doc_hash, dedup_key, sig, results, path=pdf_path)
+        journal.mark(doc_hash, "parsed", results=results)
+        return results
+
+    if isinstance(chunks, LazyTermsheet):
+        lazy = chunks
+        # Partial documents stay out of the corpus index
+        results = parse_fn(lazy.chunks, on_retrieved=lambda _: journal.mark(doc_hash, "retrieved"))
+        prompts = load_prompts(PROMPTS_FILE)
+        while not lazy.done:
+            missing = missing_fields(results, prompts)
+            if not missing:
+                break
+            newly = set(lazy.extend([f for fields in missing.values() for f in fields]))
+            if not newly:
+                break
+            ask = {pid: [f for f in fields if f in newly] for pid, fields in missing.items()}
+            more = parse_fn(lazy.chunks, fields={pid: fields for pid, fields in ask.items() if fields})
+            results = merge_results(results, more)
+        journal.mark(doc_hash, "parsed", results=results)
+        return results
+
+    results = _parse_chunks(parse_fn, journal, doc_hash, chunks)
+    journal.mark(doc_hash, "parsed", results=results)
+    return results
+
+
+def _parse_chunks(parse_fn, journal, doc_hash, chunks):
+    index = None
+    corpus = corpus_index()
+    if corpus is not None and chunks:
+        key = corpus.doc_key(chunks)
+        with span("index"):
+            corpus.add_document(key, chunks)
+            index = corpus.document_index(key)
+    return parse_fn(chunks, index=index, on_retrieved=lambda _: journal.mark(doc_hash, "retrieved"))
+
+
+def _parse_or_reuse(parse_fn, journal, doc_hash, pdf_path, chunks, match):
+    pdf_name = os.path.basename(pdf_path)
+    if match is None:
+        return _parse_chunks(parse_fn, journal, doc_hash, chunks)
+    earlier = os.path.basename(match.path or match.doc_hash)
+    if match.exact or (DEDUP_NEAR_DIFF_PAGES and not match.changed_pages):
+        print(f"Reusing results of {earlier} for {pdf_name} (same text)")
+        return [dict(r, reused_from=match.doc_hash) for r in match.results]
+    if not DEDUP_NEAR_DIFF_PAGES:
+        print(f"{pdf_name} is a near duplicate of {earlier} ({match.similarity:.1%} similar); parsing it in full")
+        return _parse_chunks(parse_fn, journal, doc_hash, chunks)
+
+    # Only the changed pages go to the LLM; fields not found there come from the earlier document
+    print(f"{pdf_name} is a near duplicate of {earlier} ({match.similarity:.1%} similar); "
+          f"parsing changed pages {match.changed_pages}")
+    changed = set(match.changed_pages)
+    # Token chunks can cross page breaks: take every chunk that covers a changed page
+    sub = []
+    for c in chunks:
+        first, last = c.get("page_span") or (c["page"], c["page"])
+        if changed.intersection(range(first, last + 1)):
+            sub.append(dict(c))
+    results = parse_fn(sub, on_retrieved=lambda _: journal.mark(doc_hash, "retrieved"))
+    results = merge_results(results, match.results, tag="reused_fields")
+    return [dict(r, reused_from=match.doc_hash) for r in results]
+
+
+def select_documents(pdf_paths, journal, hashes, force=None):
+    """
+    Split PDFs (hashes filled in) into (todo, resumed): documents to process,
+    and (pdf_path, stored results) of documents parsed but never written.
+    Written documents and repeated content are skipped.
+    """
+    todo, resumed, seen, skipped = [], [], {}, 0
+    for pdf_path in sorted(pdf_paths):
+        doc_hash = hashes[pdf_path]
+        if doc_hash in seen:
+            print(f"Skipping {os.path.basename(pdf_path)}: same content as {os.path.basename(seen[doc_hash])}")
+            continue
+        seen[doc_hash] = pdf_path
+        if is_forced(pdf_path, force):
+            journal.reset(doc_hash)
+        elif journal.is_written(doc_hash):
+            skipped += 1
+            continue
+        stored = journal.parsed_results(doc_hash)
+        if stored is not None:
+            resumed.append((pdf_path, stored))
+        else:
+            todo.append(pdf_path)
+    if skipped:
+        print(f"Skipping {skipped} Term Sheets already written (use --force to reprocess)")
+    return todo, resumed
+
 
+def process_documents(sink, todo, resumed, hashes, parse_fn, args, llm_workers):
+    """Write resumed results, then run the pipeline over todo."""
+    # Parsed in an earlier run but never written: no extraction or LLM call needed
+    for pdf_path, stored in resumed:
+        with document(pdf_path):
+            write_results(sink, hashes, pdf_path, stored, None)
 
-def main():
+    run_pipeline(todo,
+                 parse_fn=parse_fn,
+                 on_result=partial(write_results, sink, hashes),
+                 chunk_size=CHUNK_SIZE,
+                 overlap=OVERLAP,
+                 extract_workers=args.workers,
+                 llm_workers=llm_workers,
+                 queue_size=args.queue_size,
+                 lazy_fields=columns_from_prompts(PROMPTS_FILE) if args.lazy else None)
+
+
+def watch_folder(watcher, new_sink, journal, hashes, process, metrics):
+    """
+    --watch: process PDFs as the watcher reports them, until interrupted.
+    Each batch goes through its own sink, closed (so its rows are saved, also
+    for Excel and Parquet output) before the next batch starts; the batch's
+    arrival-to-row latency is recorded per document.
+    """
+    print(f"Watching {MAIN_FOLDER} for new Term Sheets ({watcher.mode}); press Ctrl+C to stop")
+    depth = None
+    try:
+        while True:
+            ready = watcher.poll(timeout=1.0)
+            arrived = {}
+            for pdf_path, first_seen in ready:
+                try:
+                    hashes[pdf_path] = file_sha256(pdf_path)
+                except OSError as e:
+                    print(f"❌ Cannot read {pdf_path}: {e}")
+                    continue
+                arrived[pdf_path] = first_seen
+            if depth != watcher.pending + len(arrived):
+                depth = watcher.pending + len(arrived)
+                set_gauge("watch_queue_depth", depth)
+                if metrics is not None:
+                    metrics.write_report(METRICS_REPORT_PATH, METRICS_PROM_PATH)
+            if not arrived:
+                continue
+
+            todo, resumed = select_documents(list(arrived), journal, hashes)
+            if not todo and not resumed:
+                continue
+            print(f"Processing {len(todo) + len(resumed)} new Term Sheets")
+            with new_sink() as sink:
+                process(sink, todo, resumed)
+                with span("write"):
+                    sink.close()
+            written = time.time()
+            for pdf_path in todo + [p for p, _ in resumed]:
+                with document(pdf_path):
+                    record_latency(written - arrived[pdf_path])
+            depth = watcher.pending
+            set_gauge("watch_queue_depth", depth)
+            if metrics is not None:
+                metrics.write_report(METRICS_REPORT_PATH, METRICS_PROM_PATH)
+    except KeyboardInterrupt:
+        print("Stopping watch")
+    finally:
+        watcher.close()
+
+
+def write_results(sink, hashes, pdf_path, results, error):
+    """Writer stage: called once per PDF, in sorted order."""
+    pdf_name = os.path.basename(pdf_path)
+    if error is not None:
+        print(f"❌ Failed Term Sheet: {pdf_name}: {error}")
+        return
+    saved = sum((r.get("context_tokens") or {}).get("tokens_saved", 0) for r in results)
+    print(f"Processed Term Sheet: {pdf_name}" + (f" (context tokens saved: {saved})" if saved else ""))
+
+    # Write each parsed result to the sink (one row per PDF); the journal marks
+    # the document written once the sink has saved its rows
+    rows = []
+    for r in results:
+        run_for = r.get("run_for")
+        json_result = r.get("result", {})
+        if run_for and isinstance(json_result, dict):
+            rows.append(json_result)
+    with span("write"):
+        sink.write_many(rows, key=hashes[pdf_path])
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.to_excel:
+        n = sink_to_excel(args.to_excel, args.output or EXCEL_FILE, columns=columns_from_prompts(PROMPTS_FILE))
+        print(f"✅ {n} rows converted from {args.to_excel}")
+        return
+
+    # Created now so the run report's duration covers the whole run
+    metrics = get_metrics()
+
+    # Started before the initial listing, so nothing arriving meanwhile is missed
+    watcher = FolderWatcher(MAIN_FOLDER) if args.watch else None
     pdf_paths = find_all_pdfs(MAIN_FOLDER)
-    if not pdf_paths:
+    if not pdf_paths and watcher is None:
         print(f"No PDFs found in {MAIN_FOLDER}")
         return
 
-    for pdf_path in sorted(pdf_paths):
-        pdf_name = os.path.basename(pdf_path)
-        print(f"Processing Term Sheet: {pdf_name}")
+    if args.provider == "gemini":
+        # Parse chunks with Gemini
+        parse_fn = partial(parse_with_llm_gemini, prompts_path=PROMPTS_FILE, gemini_model=GEMINI_MODEL, top_k=TOP_K)
+    else:
+        # Parse chunks with Groq
+        parse_fn = partial(parse_with_llm, prompts_path=PROMPTS_FILE, groq_model=GROQ_MODEL, top_k=TOP_K)
+    # Results are only reused when the prompts, model and every setting that shapes a parse are the same
+    parse_settings = {
+        "chunker": CHUNKER, "chunk_size": CHUNK_SIZE, "overlap": OVERLAP,
+        "chunk_tokens": CHUNK_TOKENS, "chunk_overlap_tokens": CHUNK_OVERLAP_TOKENS,
+        "rules": RULES_ENABLED, "rules_shrink_context": RULES_SHRINK_CONTEXT,
+        "context_budget": CONTEXT_BUDGET_ENABLED, "prompt_batching": PROMPT_BATCHING_ENABLED,
+        "json_mode": LLM_JSON_MODE, "corpus_index": CORPUS_INDEX_ENABLED,
+    }
+    dedup_key = reuse_key(load_prompts(PROMPTS_FILE), args.provider, parse_fn.keywords, parse_settings)
 
-        # Extract text and create chunks
-        chunks = extract_chunks_from_termsheet(pdf_path,
-                                                chunk_size=CHUNK_SIZE,
-                                                overlap=OVERLAP,
-                                                folder_name=os.path.splitext(pdf_name)[0])
+    journal = Journal(JOURNAL_PATH)
+    hashes = {p: file_sha256(p) for p in pdf_paths}
 
-        # Parse chunks with Gemini
-        results = parse_with_llm_gemini(chunks, PROMPTS_FILE, gemini_model=GEMINI_MODEL, top_k=TOP_K)
-        
-        #Parse chunks with Groq
-        #results = parse_with_llm(chunks, PROMPTS_FILE,groq_model=GROQ_MODEL,top_k=TOP_K)
-
-        # Write each parsed result into Excel (one row per PDF)
-        for r in results:
-            run_for = r.get("run_for")
-            json_result = r.get("result", {})
-            if run_for and isinstance(json_result, dict):
-                write_to_excel(json_result)
+    todo, resumed = select_documents(pdf_paths, journal, hashes, args.force)
+
+    llm_workers = args.llm_workers or LLM_WORKERS.get(args.provider, 1)
+    print(f"Processing {len(todo)} Term Sheets "
+          f"({args.workers} extraction workers, {llm_workers} {args.provider} workers)")
+
+    new_sink = partial(make_sink, args.sink, args.output or SINK_PATHS[args.sink],
+                       columns=columns_from_prompts(PROMPTS_FILE),
+                       on_flush=partial(journal.mark_many, stage="written"))
+    with new_sink() as sink:
+        process_documents(sink, todo, resumed, hashes,
+                          partial(parse_document, parse_fn, journal, hashes, dedup_key=dedup_key,
+                                  forced={p for p in todo if is_forced(p, args.force)}),
+                          args, llm_workers)
+
+        # Final save, timed as a run-level write
+        with span("write"):
+            sink.close()
+
+    if watcher is not None:
+        process = partial(process_documents, hashes=hashes,
+                          parse_fn=partial(parse_document, parse_fn, journal, hashes, dedup_key=dedup_key),
+                          args=args, llm_workers=llm_workers)
+        watch_folder(watcher, new_sink, journal, hashes, process, metrics)
+
+    cache = get_llm_cache()
+    if cache is not None:
+        print(f"LLM cache: {cache.stats()}")
+    corpus = corpus_index()
+    if corpus is not None:
+        print(f"Corpus index: {corpus.stats()}")
+    dedup = get_dedup_index()
+    if dedup is not None:
+        print(f"Dedup index: {dedup.stats()}")
+    if metrics is not None:
+        report = metrics.write_report(METRICS_REPORT_PATH, METRICS_PROM_PATH)
+        totals = report["totals"]
+        stages = ", ".join(f"{s} {v['seconds']:.2f}s" for s, v in totals["spans"].items())
+        print(f"Run report: {METRICS_REPORT_PATH} ({stages}; LLM {totals['llm_total']})")
+        if totals["rule_hit_rate"]:
+            rates = ", ".join(f"{f} {r:.0%}" for f, r in totals["rule_hit_rate"].items())
+            print(f"Rule hit rates: {rates} ({totals['llm_skipped']} LLM calls skipped)")
 
     print("✅ Term Sheet processing completed.")
 
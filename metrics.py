@@ -0,0 +1,314 @@
+"""
+metrics.py
+- Lightweight run instrumentation: stage timings, LLM token usage and retries
+  - span(stage): time a block; stages are STAGES (extract, chunk, index,
+    rules, retrieve, llm, json_parse, write)
+  - record_llm_call(provider, prompt_tokens, completion_tokens, retries)
+  - record_cache_hit(): LLM call answered from cache.py's LLM cache
+  - record_rule_fields(checked, found, llm_skipped): fields looked up by
+    rules.py before the LLM call, and which of them it filled
+  - record_latency(seconds): time from a document's arrival to its row
+    being written (main.py --watch)
+  - set_gauge(name, value): current value of a run-level gauge, e.g. the
+    watch mode's queue depth
+  - document(doc_id): attribute everything recorded in this thread to a
+    document; stats are kept per document and summed per run
+- RunMetrics: the collector; report() (JSON-ready dict), to_prometheus()
+  (node_exporter textfile format) and write_report(json_path, prom_path)
+- get_metrics(): process-wide collector, or None when METRICS_ENABLED is off
+Extraction runs in worker processes: pipeline.py hands each document's
+stats back with its chunks (pop_document / merge_document).
+"""
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, Optional
+
+from config import METRICS_ENABLED
+
+STAGES = ("extract", "chunk", "index", "rules", "retrieve", "llm", "json_parse", "write")
+# Help text of the gauges set with set_gauge()
+GAUGES = {
+    "watch_queue_depth": "PDFs seen by the folder watcher and not yet written.",
+}
+
+
+# ---------------- Stats ---------------- #
+
+def new_stats() -> Dict:
+    return {"spans": {}, "llm": {}, "rules": {}, "llm_skipped": 0,
+            "latency": {"count": 0, "seconds": 0.0, "max": 0.0}}
+
+
+def _add_llm(llm: Dict, provider: str, values: Dict) -> None:
+    entry = llm.setdefault(provider, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                                      "retries": 0, "cache_hits": 0})
+    for k, v in values.items():
+        entry[k] += v
+
+
+def merge_stats(into: Dict, stats: Dict) -> Dict:
+    """Add `stats` into `into` (both new_stats() shaped); returns `into`."""
+    for stage, s in stats.get("spans", {}).items():
+        entry = into["spans"].setdefault(stage, {"count": 0, "seconds": 0.0})
+        entry["count"] += s["count"]
+        entry["seconds"] += s["seconds"]
+    for provider, values in stats.get("llm", {}).items():
+        _add_llm(into["llm"], provider, values)
+    for field, r in stats.get("rules", {}).items():
+        entry = into["rules"].setdefault(field, {"checked": 0, "hits": 0})
+        entry["checked"] += r["checked"]
+        entry["hits"] += r["hits"]
+    into["llm_skipped"] += stats.get("llm_skipped", 0)
+    latency = stats.get("latency")
+    if latency:
+        into["latency"]["count"] += latency["count"]
+        into["latency"]["seconds"] += latency["seconds"]
+        into["latency"]["max"] = max(into["latency"]["max"], latency["max"])
+    return into
+
+
+def summarize(stats: Iterable[Dict]) -> Dict:
+    """Sum several stats dicts and add token/call totals and rule hit rates."""
+    total = new_stats()
+    for s in stats:
+        merge_stats(total, s)
+    for entry in total["spans"].values():
+        entry["seconds"] = round(entry["seconds"], 6)
+    latency = total["latency"]
+    latency["seconds"] = round(latency["seconds"], 6)
+    latency["mean"] = round(latency["seconds"] / latency["count"], 6) if latency["count"] else None
+    llm_total = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "retries": 0, "cache_hits": 0}
+    for values in total["llm"].values():
+        for k in llm_total:
+            llm_total[k] += values[k]
+    total["llm_total"] = llm_total
+    total["rule_hit_rate"] = {f: round(r["hits"] / r["checked"], 4) for f, r in total["rules"].items() if r["checked"]}
+    return total
+
+
+# ---------------- Collector ---------------- #
+
+class RunMetrics:
+
+    def __init__(self):
+        self.started = time.time()
+        self._docs: Dict[str, Dict] = {}
+        self._run = new_stats()  # recorded outside any document
+        self._gauges: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _stats(self, doc_id: Optional[str]) -> Dict:
+        if doc_id is None:
+            return self._run
+        s = self._docs.get(doc_id)
+        if s is None:
+            s = self._docs[doc_id] = new_stats()
+        return s
+
+    def add_span(self, stage: str, seconds: float, doc_id: Optional[str] = None) -> None:
+        with self._lock:
+            merge_stats(self._stats(doc_id), {"spans": {stage: {"count": 1, "seconds": seconds}}})
+
+    def add_llm(self, provider: str, doc_id: Optional[str] = None, **values) -> None:
+        with self._lock:
+            _add_llm(self._stats(doc_id)["llm"], provider, values)
+
+    def add_rules(self, checked: Iterable[str], found: Iterable[str], llm_skipped: bool,
+                  doc_id: Optional[str] = None) -> None:
+        found = set(found)
+        with self._lock:
+            stats = self._stats(doc_id)
+            for field in checked:
+                entry = stats["rules"].setdefault(field, {"checked": 0, "hits": 0})
+                entry["checked"] += 1
+                entry["hits"] += field in found
+            stats["llm_skipped"] += bool(llm_skipped)
+
+    def add_latency(self, seconds: float, doc_id: Optional[str] = None) -> None:
+        with self._lock:
+            merge_stats(self._stats(doc_id), {"latency": {"count": 1, "seconds": seconds, "max": seconds}})
+
+    def set_gauge(self, name: str, value: float) -> None:
+        with self._lock:
+            self._gauges[name] = value
+
+    def pop_document(self, doc_id: str) -> Optional[Dict]:
+        with self._lock:
+            return self._docs.pop(doc_id, None)
+
+    def merge_document(self, doc_id: str, stats: Optional[Dict]) -> None:
+        if stats:
+            with self._lock:
+                merge_stats(self._stats(doc_id), stats)
+
+    def document_stats(self, doc_id: str) -> Optional[Dict]:
+        with self._lock:
+            s = self._docs.get(doc_id)
+            return summarize([s]) if s else None
+
+    def report(self) -> Dict:
+        with self._lock:
+            docs = {d: summarize([s]) for d, s in self._docs.items()}
+            totals = summarize(list(self._docs.values()) + [self._run])
+            gauges = dict(self._gauges)
+        return {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "duration_seconds": round(time.time() - self.started, 3),
+            "documents": len(docs),
+            "totals": totals,
+            "gauges": gauges,
+            "per_document": docs,
+        }
+
+    def to_prometheus(self, report: Optional[Dict] = None, prefix: str = "termsheet") -> str:
+        """Run totals in Prometheus text exposition format (no per-document labels)."""
+        report = report or self.report()
+        totals = report["totals"]
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            for labels, value in samples:
+                label_str = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"{prefix}_{name}{{{label_str}}} {value}" if label_str else f"{prefix}_{name} {value}")
+
+        spans = totals["spans"]
+        metric("stage_seconds_total", "counter", "Time spent per pipeline stage.",
+               [({"stage": s}, spans[s]["seconds"]) for s in STAGES if s in spans])
+        metric("stage_calls_total", "counter", "Timed operations per pipeline stage.",
+               [({"stage": s}, spans[s]["count"]) for s in STAGES if s in spans])
+        llm = totals["llm"]
+        metric("llm_calls_total", "counter", "LLM requests sent.",
+               [({"provider": p}, v["calls"]) for p, v in llm.items()])
+        metric("llm_tokens_total", "counter", "LLM tokens used.",
+               [({"provider": p, "kind": kind}, v[f"{kind}_tokens"]) for p, v in llm.items()
+                for kind in ("prompt", "completion")])
+        metric("llm_retries_total", "counter", "LLM request retries.",
+               [({"provider": p}, v["retries"]) for p, v in llm.items()])
+        metric("llm_cache_hits_total", "counter", "LLM calls answered from the cache.",
+               [({"provider": p}, v["cache_hits"]) for p, v in llm.items()])
+        rules = totals["rules"]
+        metric("rule_field_checks_total", "counter", "Fields looked up by the rule extractor.",
+               [({"field": f}, r["checked"]) for f, r in rules.items()])
+        metric("rule_field_hits_total", "counter", "Fields filled by the rule extractor.",
+               [({"field": f}, r["hits"]) for f, r in rules.items()])
+        metric("llm_skipped_total", "counter", "Prompts answered by the rule extractor alone.",
+               [({}, totals["llm_skipped"])])
+        latency = totals["latency"]
+        if latency["count"]:
+            metric("document_latency_seconds_total", "counter", "Time from document arrival to written row.",
+                   [({}, latency["seconds"])])
+            metric("document_latency_count", "counter", "Documents with a measured arrival-to-row latency.",
+                   [({}, latency["count"])])
+            metric("document_latency_max_seconds", "gauge", "Longest arrival-to-row latency.",
+                   [({}, latency["max"])])
+        for name, value in sorted(report.get("gauges", {}).items()):
+            metric(name, "gauge", GAUGES.get(name, name), [({}, value)])
+        metric("documents_total", "gauge", "Documents processed in the run.", [({}, report["documents"])])
+        metric("run_duration_seconds", "gauge", "Wall time of the run.", [({}, report["duration_seconds"])])
+        metric("run_timestamp_seconds", "gauge", "Start time of the run.", [({}, round(self.started, 3))])
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, json_path: Optional[str], prom_path: Optional[str] = None) -> Dict:
+        report = self.report()
+        for path, text in ((json_path, lambda: json.dumps(report, indent=2)),
+                           (prom_path, lambda: self.to_prometheus(report))):
+            if not path:
+                continue
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Swap in complete files only; the textfile collector may read at any time
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(text())
+            os.replace(tmp_path, path)
+        return report
+
+
+_metrics: Optional[RunMetrics] = None
+_metrics_lock = threading.Lock()
+_local = threading.local()
+
+
+def get_metrics() -> Optional[RunMetrics]:
+    """Return the shared collector, or None if instrumentation is disabled."""
+    global _metrics
+    if not METRICS_ENABLED:
+        return None
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = RunMetrics()
+        return _metrics
+
+
+# ---------------- Recording helpers ---------------- #
+
+def current_document() -> Optional[str]:
+    return getattr(_local, "doc_id", None)
+
+
+@contextmanager
+def document(doc_id: str) -> Iterator[None]:
+    """Attribute spans and LLM calls recorded by this thread to doc_id."""
+    previous = current_document()
+    _local.doc_id = doc_id
+    try:
+        yield
+    finally:
+        _local.doc_id = previous
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    m = get_metrics()
+    if m is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        m.add_span(stage, time.perf_counter() - start, current_document())
+
+
+def record_span(stage: str, seconds: float) -> None:
+    """Record a duration measured by the caller (e.g. time spent inside a generator)."""
+    m = get_metrics()
+    if m is not None:
+        m.add_span(stage, seconds, current_document())
+
+
+def record_llm_call(provider: str, prompt_tokens: int = 0, completion_tokens: int = 0, retries: int = 0) -> None:
+    m = get_metrics()
+    if m is not None:
+        m.add_llm(provider, current_document(), calls=1, prompt_tokens=prompt_tokens,
+                  completion_tokens=completion_tokens, retries=retries)
+
+
+def record_latency(seconds: float) -> None:
+    m = get_metrics()
+    if m is not None:
+        m.add_latency(seconds, current_document())
+
+
+def set_gauge(name: str, value: float) -> None:
+    m = get_metrics()
+    if m is not None:
+        m.set_gauge(name, value)
+
+
+def record_cache_hit(provider: str) -> None:
+    m = get_metrics()
+    if m is not None:
+        m.add_llm(provider, current_document(), cache_hits=1)
+
+
+def record_rule_fields(checked: Iterable[str], found: Iterable[str], llm_skipped: bool = False) -> None:
+    m = get_metrics()
+    if m is not None:
+        m.add_rules(checked, found, llm_skipped, current_document())
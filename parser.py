@@ -1,52 +1,117 @@
 """
 parser.py
 - Loads prompts from Prompts/prompts_spo_framework.json
-- Builds a TF-IDF index over extracted chunks
-- For each prompt, filter chunks by "run_for" (framework/spo/both),
-  retrieve top_k chunks, create system/user message,
-  and call Groq LLM to produce the output JSON.
+- Builds one TF-IDF index over extracted chunks per "run_for" filter
+  (framework/spo/both) and retrieves top_k chunks for all prompts in a batch
+- For each prompt, create system/user message
+  and call Groq or Gemini LLM to produce the output JSON.
 - Exports a list of parsed JSONs (one per prompt).
+- Fields rules.py can read deterministically are filled before the LLM call
+  (apply_rules); the LLM is asked only for the remaining fields
+- missing_fields / merge_results: ask again for fields a parse left empty
+  (main.py does so after reading more pages of a lazily extracted document)
+- Model output is parsed with json_stream.py (first JSON value, linear time).
+  With LLM_STREAMING, responses are streamed into an incremental parser that
+  checks keys against the prompt's json_schema: the stream is closed once the
+  object is complete and malformed output is retried straight away.
+  LLM_JSON_MODE turns on the providers' JSON output modes.
+- Index build, rules, retrieval, LLM calls and JSON parsing are timed as metrics.py spans
+- numpy, scikit-learn and the provider SDKs are imported on first use, so
+  importing this module (and spawning workers that do) stays cheap
 """
 
-import os
 import json
-import numpy as np
-from typing import List, Dict, Any
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from groq import Groq
+import math
+from typing import List, Dict, Any, Callable, Iterable, Optional, Tuple
 import time
-import re
 
-from google import genai
-from google.genai import types
-
-from dotenv import load_dotenv
-load_dotenv()
+from cache import LLMCache, get_llm_cache
+from chunk_store import ChunkStore
+from gateway import api_key as provider_api_key, get_gateway, get_provider
+from json_stream import JSONStreamParser, MalformedJSON, parse_json_text
+from metrics import record_cache_hit, record_rule_fields, span
+from rules import RULES, extract_fields
+from tokens import count_tokens, truncate_to_tokens
+from config import OVERLAP, CONTEXT_BUDGET_ENABLED, CONTEXT_TOKEN_BUDGETS, CONTEXT_TOKEN_BUDGET_DEFAULT
+from config import PROMPT_BATCHING_ENABLED, PROMPT_BATCH_MIN_OVERLAP, PROMPT_BATCH_MAX_SIZE
+from config import RULES_ENABLED, RULES_SHRINK_CONTEXT
+from config import LLM_JSON_MODE, LLM_STREAMING, LLM_STREAM_MAX_PREAMBLE
 
 
 
 # ---------------- TF-IDF Retrieval ---------------- #
 
-def build_tfidf_index(chunks: List[Dict]) -> Dict:
-    """Return vectorizer and matrix for search, plus the chunk texts."""
-    texts = [c["chunk"] for c in chunks]
-    vectorizer = TfidfVectorizer(stop_words="english", max_features=20000)
-    if texts:
-        matrix = vectorizer.fit_transform(texts)
+def build_tfidf_index(chunks: Iterable[Dict]) -> Dict:
+    """
+    Return vectorizer and matrix for search, plus the chunk texts.
+    chunks may be a ChunkStore, a list or a stream (e.g. extractor.iter_chunks_from_termsheet);
+    the consumed chunks are kept under index["chunks"].
+    """
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    if isinstance(chunks, ChunkStore):
+        # Texts are sliced from the store while fitting; nothing is copied up front
+        chunk_list, texts = chunks, chunks.texts
     else:
-        matrix = None
-    return {"vectorizer": vectorizer, "matrix": matrix, "texts": texts}
+        chunk_list = []
+        texts = []
+        for c in chunks:
+            chunk_list.append(c)
+            texts.append(c["chunk"])
+    vectorizer = TfidfVectorizer(stop_words="english", max_features=20000)
+    with span("index"):
+        if texts:
+            matrix = vectorizer.fit_transform(texts)
+        else:
+            matrix = None
+    return {"vectorizer": vectorizer, "matrix": matrix, "texts": texts, "chunks": chunk_list}
 
 
 def retrieve_top_k(query: str, index: Dict, k: int = 5) -> List[int]:
     """Return top-k indices (into index['texts']) most similar to query."""
-    if index["matrix"] is None:
-        return []
-    qv = index["vectorizer"].transform([query])
-    sims = cosine_similarity(qv, index["matrix"]).flatten()
-    topk_idx = np.argsort(-sims)[:k]
-    return [int(i) for i in topk_idx if sims[i] > 0]
+    return retrieve_top_k_batch([query], index, k=k)[0]
+
+
+def retrieve_top_k_batch(queries: List[str], index: Dict, k: int = 5) -> List[List[int]]:
+    """
+    retrieve_top_k for several queries at once: one sparse matrix multiply
+    for all queries, then argpartition for the top-k of each row.
+    """
+    if index["matrix"] is None or not queries:
+        return [[] for _ in queries]
+    import numpy as np
+
+    with span("retrieve"):
+        # TF-IDF rows are L2-normalised, so the dot product is the cosine similarity
+        qm = index["vectorizer"].transform(queries)
+        sims = (qm @ index["matrix"].T).toarray()
+        k = min(k, sims.shape[1])
+        results = []
+        for row in sims:
+            if k <= 0:
+                results.append([])
+                continue
+            top = np.argpartition(-row, k - 1)[:k]
+            top = top[np.argsort(-row[top], kind="stable")]
+            results.append([int(i) for i in top if row[i] > 0])
+    return results
+
+
+def _page_label(c) -> str:
+    """Page of a chunk; "first-last" for token chunks that cross a page break."""
+    first, last = c.get("page_span") or (None, None)
+    if first is not None and last != first:
+        return f"{first}-{last}"
+    return str(c.get("page", "?"))
+
+
+def _run_page_label(run: List[Dict]) -> str:
+    """Pages covered by a run of merged chunks, from the first chunk's start to the last chunk's end."""
+    first = (run[0].get("page_span") or (run[0].get("page"),))[0]
+    last = (run[-1].get("page_span") or (run[-1].get("page"),))[-1]
+    if first is None:
+        return "?"
+    return str(first) if last in (None, first) else f"{first}-{last}"
 
 
 def assemble_context(chunks: List[Dict], top_indices: List[int]) -> str:
@@ -54,254 +119,705 @@ def assemble_context(chunks: List[Dict], top_indices: List[int]) -> str:
     parts = []
     for i in top_indices:
         c = chunks[i]
-        header = f"[source: {c.get('source','?')}] [page: {c.get('page','?')}] [chunk_idx: {c.get('chunk_index','?')}]"
+        header = f"[source: {c.get('source','?')}] [page: {_page_label(c)}] [chunk_idx: {c.get('chunk_index','?')}]"
         parts.append(header + "\n" + c["chunk"])
     return "\n\n---\n\n".join(parts)
 
 
-# ---------------- Groq API ---------------- #
+def context_token_budget(model: str) -> int:
+    return CONTEXT_TOKEN_BUDGETS.get(model, CONTEXT_TOKEN_BUDGET_DEFAULT)
 
-def call_groq(model: str, messages: List[Dict], temperature: float = 0.0, max_retries: int = 3) -> Dict:
-    api_key = os.getenv("GROQ_API_KEY")
-    if not api_key:
-        raise EnvironmentError("GROQ_API_KEY not set in environment.")
 
-    # some versions use Groq(api_key=...), others just Groq()
-    client = Groq(api_key=api_key) if hasattr(Groq, "__call__") else Groq()
+def _join_overlapping(a: str, b: str, max_overlap: int) -> str:
+    """Append b to a, dropping the start of b that repeats the end of a."""
+    for k in range(min(len(a), len(b), max_overlap), 0, -1):
+        if a.endswith(b[:k]):
+            return a + b[k:]
+    return a + "\n" + b
+
 
-    for attempt in range(1, max_retries + 1):
+def assemble_context_budgeted(chunks: List[Dict], top_indices: List[int], budget_tokens: int,
+                              max_overlap: int = OVERLAP) -> Tuple[str, Dict]:
+    """
+    Token-budgeted variant of assemble_context.
+    Chunks are packed in score order (the order of top_indices) until
+    budget_tokens is reached; neighbouring chunks of the same page are merged
+    so their overlap appears once.
+    Returns (context, {"tokens_full", "tokens_used", "tokens_saved"}), where
+    tokens_full is the size assemble_context would have produced.
+    """
+    sep_tokens = count_tokens("\n\n---\n\n")
+    page_key = lambda c: (c.get("source"), c.get("page"))
+
+    tokens_full = 0
+    selected: Dict[tuple, Dict[int, int]] = {}  # (source, page) -> {chunk_index: rank}
+    unmergeable: List[int] = []
+    used = 0
+    for rank, i in enumerate(top_indices):
+        c = chunks[i]
+        header = f"[source: {c.get('source','?')}] [page: {_page_label(c)}] [chunk_idx: {c.get('chunk_index','?')}]"
+        chunk_tokens = count_tokens(c["chunk"])
+        header_tokens = count_tokens(header) + sep_tokens
+        tokens_full += chunk_tokens + header_tokens
+
+        c_idx = c.get("chunk_index")
+        on_page = selected.get(page_key(c), {})
+        if isinstance(c_idx, int) and (c_idx - 1 in on_page or c_idx + 1 in on_page):
+            # Joins an existing block: no new header, and the shared overlap is not repeated
+            neighbours = (c_idx - 1 in on_page) + (c_idx + 1 in on_page)
+            overlap_share = min(1.0, neighbours * max_overlap / max(1, len(c["chunk"])))
+            cost = int(chunk_tokens * (1.0 - overlap_share))
+        else:
+            cost = chunk_tokens + header_tokens
+
+        if used + cost > budget_tokens:
+            continue
+        used += cost
+        if isinstance(c_idx, int):
+            selected.setdefault(page_key(c), {})[c_idx] = rank
+        else:
+            unmergeable.append(rank)
+
+    # Build blocks of consecutive chunk indices per page, ordered by their best score
+    blocks = []
+    for (source, page), by_index in selected.items():
+        run: List[int] = []
+        for c_idx in sorted(by_index):
+            if run and c_idx != run[-1] + 1:
+                blocks.append((min(by_index[j] for j in run), source, page, run))
+                run = []
+            run.append(c_idx)
+        if run:
+            blocks.append((min(by_index[j] for j in run), source, page, run))
+    blocks.extend((rank, None, None, None) for rank in unmergeable)
+    blocks.sort(key=lambda b: b[0])
+
+    by_key = {(c.get("source"), c.get("page"), c.get("chunk_index")): c for c in (chunks[i] for i in top_indices)}
+    parts = []
+    for rank, source, page, run in blocks:
+        if run is None:
+            c = chunks[top_indices[rank]]
+            parts.append(f"[source: {c.get('source','?')}] [page: {_page_label(c)}] [chunk_idx: ?]\n" + c["chunk"])
+            continue
+        run_chunks = [by_key[(source, page, c_idx)] for c_idx in run]
+        text = run_chunks[0]["chunk"]
+        for c in run_chunks[1:]:
+            text = _join_overlapping(text, c["chunk"], max_overlap)
+        span = str(run[0]) if len(run) == 1 else f"{run[0]}-{run[-1]}"
+        parts.append(f"[source: {source or '?'}] [page: {_run_page_label(run_chunks)}] [chunk_idx: {span}]\n" + text)
+
+    if not parts and top_indices:
+        # Not even the best chunk fits: send as much of it as the budget allows
+        c = chunks[top_indices[0]]
+        header = f"[source: {c.get('source','?')}] [page: {_page_label(c)}] [chunk_idx: {c.get('chunk_index','?')}]"
+        parts.append(header + "\n" + truncate_to_tokens(c["chunk"], max(0, budget_tokens - count_tokens(header) - 1)))
+
+    context = "\n\n---\n\n".join(parts)
+    tokens_used = count_tokens(context)
+    return context, {"tokens_full": tokens_full, "tokens_used": tokens_used,
+                     "tokens_saved": max(0, tokens_full - tokens_used)}
+
+
+# ---------------- Streaming ---------------- #
+
+def stream_consumer(provider: str, json_schema: Optional[Dict], prompt_tokens: int) -> Callable[[Any], Any]:
+    """
+    Gateway `consume` hook: read a response stream through a JSONStreamParser,
+    close it as soon as the JSON is complete, and raise MalformedJSON (retried
+    by the gateway) as soon as the output cannot match json_schema. The
+    exception carries .usage = (prompt tokens, completion tokens received), so
+    the gateway can account for the discarded attempt.
+    """
+    spec = get_provider(provider)
+
+    def consume(stream):
+        json_parser = JSONStreamParser(json_schema, max_preamble=LLM_STREAM_MAX_PREAMBLE)
+        last = None
+        received: List[str] = []
         try:
-            response = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                temperature=temperature
-            )
-            return response
-        except Exception as e:
-            if attempt == max_retries:
-                raise
-            time.sleep(1.0 * attempt)
+            for chunk in stream:
+                last = chunk
+                delta = spec.delta(chunk)
+                if not delta:
+                    continue
+                received.append(delta)
+                if json_parser.feed(delta):
+                    break
+            if not json_parser.done:
+                raise MalformedJSON("response ended before the JSON was complete")
+        except MalformedJSON as e:
+            e.usage = (prompt_tokens, count_tokens("".join(received)))
+            raise
+        finally:
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+        # Just the JSON: text around it (code fences, the unread rest of the last chunk) is dropped
+        text = json_parser.text
+        return spec.assemble(text, last, prompt_tokens, count_tokens(text))
+
+    return consume
 
 
-# ---------------- Core Parsing Logic ---------------- #
+# ---------------- Groq API ---------------- #
 
-def parse_with_llm(chunks: List[Dict],prompts_path: str,groq_model: str ,top_k: int = 5) -> List[Dict]:
+def call_groq(model: str, messages: List[Dict], temperature: float = 0.0, max_retries: Optional[int] = None,
+              json_schema: Optional[Dict] = None, stream: bool = False, json_mode: bool = LLM_JSON_MODE) -> Dict:
     """
-    chunks: list of dicts from extractor.py
-    prompts_path: path to prompts_spo_frameworks.json
-    groq_model: Groq model name
-    returns: list of dicts { "prompt_id": ..., "result": <parsed json> }
+    Call Groq chat model through the provider gateway (pooled client, rate limits, retries).
+    stream: read the response as a stream checked against json_schema (see stream_consumer)
+    json_mode: ask for a JSON object (response_format); Groq has no schema mode
     """
+    api_key = provider_api_key("groq")
+    if not api_key:
+        raise EnvironmentError("GROQ_API_KEY not set in environment.")
 
-    # load prompts
-    with open(prompts_path, "r", encoding="utf-8") as f:
-        prompts = json.load(f)
+    kwargs = {"response_format": {"type": "json_object"}} if json_mode else {}
+    if stream:
+        kwargs["stream"] = True
 
-    results = []
-
-    for p in prompts:
-        run_for = p.get("run_for", "both").lower()
-
-        # Filter chunks based on run_for
-        if run_for == "termsheet":
-            relevant_chunks = [c for c in chunks if c.get("source") == "termsheet"]
-        else:  # "both" or missing
-            relevant_chunks = chunks
-
-        # build TF-IDF index for the filtered set
-        index = build_tfidf_index(relevant_chunks)
-
-        query = p.get("instruction") or p.get("query") or ""
-        top_idx = retrieve_top_k(query, index, k=top_k)
-        context = assemble_context(relevant_chunks, top_idx)
-
-        system_msg = {
-            "role": "system",
-            "content": (
-                "You are a JSON extraction assistant. Use ONLY the provided CONTEXT to answer. "
-                "Output must be valid JSON and must match the provided schema or example. "
-                "If a field cannot be found in the context, set it to null or an empty string."
-            )
-        }
-
-        user_content = (
-            "CONTEXT:\n\n"
-            f"{context}\n\n"
-            "INSTRUCTION:\n\n"
-            f"{p['instruction']}\n\n"
-            "OUTPUT_SCHEMA / EXAMPLE:\n\n"
-            f"{json.dumps(p['json_schema'], indent=2)}\n\n"
-            "Return ONLY the JSON (no extra commentary)."
+    def request(client):
+        return client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            **kwargs
         )
-        user_msg = {"role": "user", "content": user_content}
 
-        resp = call_groq(model=groq_model, messages=[system_msg, user_msg], temperature=0.0)
+    est_tokens = sum(count_tokens(m["content"]) for m in messages)
+    consume = stream_consumer("groq", json_schema, est_tokens) if stream else None
+    return get_gateway().call("groq", api_key, request, est_tokens=est_tokens, max_retries=max_retries,
+                              consume=consume)
+
 
+# ---------------- Cached Completion ---------------- #
+
+def cached_completion(provider: str, model: str, messages: List[Dict], temperature: float = 0.0,
+                      json_schema: Optional[Dict] = None) -> Tuple[str, bool]:
+    """
+    Return (model output text, cache_hit) for a "groq" or "gemini" call.
+    Cache hits skip call_groq / call_gemini entirely (see cache.py); only
+    output that parses as JSON is cached.
+    json_schema: the expected output, for JSON modes and streamed validation
+    """
+    cache = get_llm_cache()
+    key = None
+    if cache is not None:
+        system = "\n".join(m["content"] for m in messages if m["role"] == "system")
+        user = "\n".join(m["content"] for m in messages if m["role"] == "user")
+        key = LLMCache.make_key(provider, model, temperature, system, user)
+        content = cache.get(key)
+        if content is not None:
+            record_cache_hit(provider)
+            return content, True
+
+    def call(stream: bool):
+        if provider == "groq":
+            return call_groq(model=model, messages=messages, temperature=temperature,
+                             json_schema=json_schema, stream=stream)
+        return call_gemini(model_gemini=model, messages=messages, temperature=temperature,
+                           json_schema=json_schema, stream=stream)
+
+    start = time.time()
+    with span("llm"):
+        # Token usage and retries are recorded by the gateway (see metrics.py)
         try:
-            content = resp.choices[0].message.content
+            resp = call(LLM_STREAMING)
+        except MalformedJSON:
+            if not LLM_STREAMING:
+                raise
+            # Every streamed attempt broke off: ask once more for the full answer,
+            # which parse_json_output keeps as {"_raw": ...} if it still is not JSON
+            resp = call(False)
+        spec = get_provider(provider)
+        try:
+            content = spec.text(resp)
+            cacheable = True
         except Exception:
             content = str(resp)
+            cacheable = False
 
-        # try parsing JSON
-        try:
-            parsed = json.loads(content)
-        except Exception:
-            m = re.search(r'(\{.*\}|\[.*\])', content, flags=re.S)
-            if m:
-                try:
-                    parsed = json.loads(m.group(1))
-                except Exception:
-                    parsed = {"_raw": content}
-            else:
-                parsed = {"_raw": content}
+    # Only answers that parse as JSON are cached; anything else is asked again next time
+    if cache is not None and cacheable and content and _is_json(content):
+        cache.put(key, content, latency=time.time() - start, tokens=spec.usage(resp))
+    return content, False
 
-        results.append({
-            "prompt_id": p.get("id"),
-            "run_for": run_for,
-            "result": parsed,
-            "used_context_indices": top_idx,
-            "raw_model_output": content
-        })
 
-    return results
+def _is_json(content: str) -> bool:
+    try:
+        parse_json_text(content)
+    except MalformedJSON:
+        return False
+    return True
 
-#Gemini Parsing
 
-def parse_with_llm_gemini(chunks: List[Dict],prompts_path: str,gemini_model: str,top_k: int = 5) -> List[Dict]:
-    """
-    chunks: list of dicts from extractor.py
-    prompts_path: path to prompts.json
-    gemini_model: Gemini model name (e.g., "gemini-1.5-flash")
-    returns: list of dicts { "prompt_id": ..., "result": <parsed json> }
-    """
+# ---------------- Prompt Preparation ---------------- #
+
+SYSTEM_PROMPT = (
+    "You are a JSON extraction assistant. Use ONLY the provided CONTEXT to answer. "
+    "Output must be valid JSON and must match the provided schema or example. "
+    "If a field cannot be found in the context, set it to null or an empty string."
+)
 
-    # load prompts
+
+def load_prompts(prompts_path: str) -> List[Dict]:
     with open(prompts_path, "r", encoding="utf-8") as f:
-        prompts = json.load(f)
+        return json.load(f)
+
+
+def filter_chunks(chunks: List[Dict], run_for: str) -> List[Dict]:
+    """Filter chunks based on a prompt's run_for."""
+    if isinstance(chunks, ChunkStore):
+        # All chunks of a store share its source
+        if run_for == "termsheet" and chunks.source != "termsheet":
+            return ChunkStore(source=chunks.source, folder=chunks.folder)
+        return chunks
+    if run_for == "termsheet":
+        return [c for c in chunks if c.get("source") == "termsheet"]
+    return chunks  # "both" or missing
+
+
+def build_messages(prompt: Dict, context: str) -> List[Dict]:
+    """Create the system/user messages for one prompt."""
+    system_msg = {"role": "system", "content": SYSTEM_PROMPT}
+
+    user_content = (
+        "CONTEXT:\n\n"
+        f"{context}\n\n"
+        "INSTRUCTION:\n\n"
+        f"{prompt['instruction']}\n\n"
+        "OUTPUT_SCHEMA / EXAMPLE:\n\n"
+        f"{json.dumps(prompt['json_schema'], indent=2)}\n\n"
+        "Return ONLY the JSON (no extra commentary)."
+    )
+    user_msg = {"role": "user", "content": user_content}
+    return [system_msg, user_msg]
+
+
+def prompt_key(prompt: Dict, pos: int) -> str:
+    """Key of a prompt inside a batched request (its id, or its position)."""
+    return str(prompt.get("id") or f"prompt_{pos}")
+
+
+def prompt_keys(prompts: List[Dict], positions: List[int]) -> List[str]:
+    """prompt_key of each prompt, with the position added where an id repeats, so keys are unique."""
+    keys = [prompt_key(p, pos) for p, pos in zip(prompts, positions)]
+    repeated = {k for k in keys if keys.count(k) > 1}
+    return [f"{k}_{pos}" if k in repeated else k for k, pos in zip(keys, positions)]
+
+
+def build_batched_messages(prompts: List[Dict], keys: List[str], context: str) -> List[Dict]:
+    """Create system/user messages answering several prompts with one namespaced JSON object."""
+    system_msg = {"role": "system", "content": SYSTEM_PROMPT}
+
+    tasks = "\n\n".join(f"[{key}]\n{p['instruction']}" for key, p in zip(keys, prompts))
+    schema = {key: p["json_schema"] for key, p in zip(keys, prompts)}
+    user_content = (
+        "CONTEXT:\n\n"
+        f"{context}\n\n"
+        "INSTRUCTION:\n\n"
+        "Complete each of the following tasks. Put the answer to each task under "
+        "its task id, as shown in the schema.\n\n"
+        f"{tasks}\n\n"
+        "OUTPUT_SCHEMA / EXAMPLE:\n\n"
+        f"{json.dumps(schema, indent=2)}\n\n"
+        "Return ONLY the JSON (no extra commentary)."
+    )
+    user_msg = {"role": "user", "content": user_content}
+    return [system_msg, user_msg]
+
+
+def _build_context(relevant_chunks: List[Dict], top_idx: List[int],
+                   token_budget: Optional[int]) -> Tuple[str, Optional[Dict]]:
+    if token_budget:
+        return assemble_context_budgeted(relevant_chunks, top_idx, token_budget)
+    return assemble_context(relevant_chunks, top_idx), None
+
+
+def _subset_index(index: Dict, rows: List[int]) -> Dict:
+    """Restrict a prebuilt index to the given rows."""
+    if index["matrix"] is None:
+        return index
+    texts = index.get("texts")
+    return {"vectorizer": index["vectorizer"], "matrix": index["matrix"][rows],
+            "texts": [texts[i] for i in rows] if texts else None}
 
-    results = []
 
+def prepare_prompt_requests(chunks: List[Dict], prompts: List[Dict], top_k: int = 5,
+                            index: Optional[Dict] = None, token_budget: Optional[int] = None) -> List[Dict]:
+    """
+    Shared retrieval step for both providers.
+    Builds one TF-IDF index per document and run_for filter, retrieves the
+    context for all prompts of that filter in one batch, and returns one
+    request per prompt (in prompt order):
+        { "pos", "prompt", "run_for", "relevant_chunks", "top_idx", "context", "messages" }
+    A prompt's own "query" and "top_k" (see apply_rules) take precedence over
+    its instruction and the top_k argument.
+    index: optional prebuilt index whose rows match `chunks` (e.g. from
+    corpus_index.CorpusIndex.document_index); it is restricted to each
+    filter's rows instead of fitting a new one.
+    token_budget: if set, contexts are built with assemble_context_budgeted
+    and each request also carries "context_tokens" (tokens saved etc.).
+    """
+    groups: Dict[str, List[int]] = {}
+    for pos, p in enumerate(prompts):
+        groups.setdefault(p.get("run_for", "both").lower(), []).append(pos)
+
+    requests: List[Dict] = [None] * len(prompts)
+    for run_for, positions in groups.items():
+        relevant_chunks = filter_chunks(chunks, run_for)
+        if index is None:
+            group_index = build_tfidf_index(relevant_chunks)
+        elif relevant_chunks is chunks:
+            group_index = index
+        else:
+            keep = {id(c) for c in relevant_chunks}
+            rows = [i for i, c in enumerate(chunks) if id(c) in keep]
+            group_index = _subset_index(index, rows)
+
+        queries = [prompts[pos].get("query") or prompts[pos].get("instruction") or "" for pos in positions]
+        ks = [prompts[pos].get("top_k", top_k) for pos in positions]
+        top_lists = retrieve_top_k_batch(queries, group_index, k=max(ks))
+
+        for pos, k, top_idx in zip(positions, ks, top_lists):
+            top_idx = top_idx[:k]
+            context, context_tokens = _build_context(relevant_chunks, top_idx, token_budget)
+            requests[pos] = {
+                "pos": pos,
+                "prompt": prompts[pos],
+                "run_for": run_for,
+                "relevant_chunks": relevant_chunks,
+                "top_idx": top_idx,
+                "context": context,
+                "context_tokens": context_tokens,
+                "messages": build_messages(prompts[pos], context),
+            }
+    return requests
+
+
+def apply_rules(chunks: List[Dict], prompts: List[Dict], top_k: int) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Fill what rules.py can find before the LLM call.
+    Returns (prompts, found): per prompt, the values found and a copy of the
+    prompt whose json_schema lists only the remaining fields, with a retrieval
+    "query" naming them and (RULES_SHRINK_CONTEXT) a proportionally smaller
+    "top_k". Prompts where nothing was found are returned unchanged.
+    """
+    out_prompts, found_all = [], []
+    with span("rules"):
+        for p in prompts:
+            schema = p.get("json_schema")
+            fields = list(schema) if isinstance(schema, dict) else []
+            found = extract_fields(filter_chunks(chunks, p.get("run_for", "both").lower()), fields)
+            remaining = {k: v for k, v in schema.items() if k not in found} if found else schema
+            record_rule_fields([f for f in fields if f in RULES], found, llm_skipped=bool(found) and not remaining)
+            if found:
+                p = dict(p, json_schema=remaining,
+                         query=" ".join([p.get("query") or p.get("instruction") or ""] + list(remaining)))
+                if RULES_SHRINK_CONTEXT and remaining:
+                    p["top_k"] = max(1, math.ceil(p.get("top_k", top_k) * len(remaining) / len(fields)))
+            out_prompts.append(p)
+            found_all.append(found)
+    return out_prompts, found_all
+
+
+def _with_found(result: Any, found: Dict, schema: Dict) -> Any:
+    """Merge rule values into an LLM result, in schema order."""
+    if not found or not isinstance(result, dict):
+        return result
+    merged = {k: found[k] if k in found else result[k] for k in schema if k in found or k in result}
+    merged.update((k, v) for k, v in result.items() if k not in merged)
+    return merged
+
+
+def _is_empty(value: Any) -> bool:
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def missing_fields(results: List[Dict], prompts: List[Dict]) -> Dict[str, List[str]]:
+    """Per prompt id, the json_schema fields the results leave empty (all of them if unparsed)."""
+    by_id = {r.get("prompt_id"): r.get("result") for r in results}
+    missing = {}
     for p in prompts:
-        run_for = p.get("run_for", "both").lower()
-
-        # Filter chunks based on run_for
-        if run_for == "termsheet":
-            relevant_chunks = [c for c in chunks if c.get("source") == "termsheet"]
-        else: 
-            relevant_chunks = chunks
-
-        # build TF-IDF index for the filtered set
-        index = build_tfidf_index(relevant_chunks)
-
-        query = p.get("instruction") or p.get("query") or ""
-        top_idx = retrieve_top_k(query, index, k=top_k)
-        context = assemble_context(relevant_chunks, top_idx)
-
-        system_msg = {
-            "role": "system",
-            "content": (
-                "You are a JSON extraction assistant. Use ONLY the provided CONTEXT to answer. "
-                "Output must be valid JSON and must match the provided schema or example. "
-                "If a field cannot be found in the context, set it to null or an empty string."
-            )
-        }
-
-        user_content = (
-            "CONTEXT:\n\n"
-            f"{context}\n\n"
-            "INSTRUCTION:\n\n"
-            f"{p['instruction']}\n\n"
-            "OUTPUT_SCHEMA / EXAMPLE:\n\n"
-            f"{json.dumps(p['json_schema'], indent=2)}\n\n"
-            "Return ONLY the JSON (no extra commentary)."
-        )
-        user_msg = {"role": "user", "content": user_content}
+        schema = p.get("json_schema")
+        if not isinstance(schema, dict):
+            continue
+        result = by_id.get(p.get("id"))
+        result = result if isinstance(result, dict) else {}
+        fields = [k for k in schema if _is_empty(result.get(k))]
+        if fields:
+            missing[p.get("id")] = fields
+    return missing
+
+
+def merge_results(results: List[Dict], more: List[Dict], tag: str = "resumed_fields") -> List[Dict]:
+    """
+    Fill empty fields of results from another parse of the same prompts
+    (matched by prompt_id); the filled fields are listed under `tag`.
+    """
+    by_id = {r.get("prompt_id"): r for r in more}
+    merged = []
+    for r in results:
+        extra = by_id.get(r.get("prompt_id"))
+        new = extra.get("result") if extra else None
+        if isinstance(new, dict):
+            result = dict(r["result"]) if isinstance(r.get("result"), dict) else {}
+            filled = [k for k, v in new.items() if not _is_empty(v) and _is_empty(result.get(k))]
+            result.update((k, new[k]) for k in filled)
+            r = dict(r, result=result, **{tag: r.get(tag, []) + filled})
+        merged.append(r)
+    return merged
 
-        resp = call_gemini(model_gemini=gemini_model,
-                           messages=[system_msg, user_msg],
-                           temperature=0.0)
-        
-        # print(resp.usage_metadata)
 
-        try:
-            content = resp.text
-        except Exception:
-            content = str(resp)
+def parse_json_output(content: str) -> Any:
+    """Parse the model output as JSON; falls back to {"_raw": content, "_error": reason}."""
+    with span("json_parse"):
+        return _parse_json_output(content)
 
-        # try parsing JSON
-        try:
-            parsed = json.loads(content)
-        except Exception:
-            m = re.search(r'(\{.*\}|\[.*\])', content, flags=re.S)
-            if m:
-                try:
-                    parsed = json.loads(m.group(1))
-                except Exception:
-                    parsed = {"_raw": content}
-            else:
-                parsed = {"_raw": content}
 
+def _parse_json_output(content: str) -> Any:
+    try:
+        return parse_json_text(content)
+    except MalformedJSON as e:
+        return {"_raw": content, "_error": f"Model output is not valid JSON: {e}"}
+
+
+# ---------------- Core Parsing Logic ---------------- #
+
+def batch_prompt_requests(requests: List[Dict], min_overlap: float = PROMPT_BATCH_MIN_OVERLAP,
+                          max_size: int = PROMPT_BATCH_MAX_SIZE) -> List[List[Dict]]:
+    """
+    Group requests whose retrieved chunks overlap heavily (Jaccard >= min_overlap)
+    so they can share one LLM call. Only requests with the same run_for are grouped.
+    """
+    groups: List[List[Dict]] = []
+    group_sets: List[set] = []
+    for req in requests:
+        ids = set(req["top_idx"])
+        for group, members in zip(groups, group_sets):
+            if len(group) >= max_size or group[0]["run_for"] != req["run_for"]:
+                continue
+            union = members | ids
+            if union and len(members & ids) / len(union) >= min_overlap:
+                group.append(req)
+                members |= ids
+                break
+        else:
+            groups.append([req])
+            group_sets.append(ids)
+    return groups
+
+
+def _run_batched(provider: str, model: str, group: List[Dict], token_budget: Optional[int]) -> List[Dict]:
+    """One LLM call for several prompts; the response is split back per prompt."""
+    # Interleave the prompts' rankings so every prompt's best chunks come first,
+    # keeping as many chunks as a single prompt would get
+    top_k = max(len(r["top_idx"]) for r in group)
+    top_idx: List[int] = []
+    for rank in range(top_k):
+        for r in group:
+            if rank < len(r["top_idx"]) and r["top_idx"][rank] not in top_idx:
+                top_idx.append(r["top_idx"][rank])
+    top_idx = top_idx[:top_k]
+
+    relevant_chunks = group[0]["relevant_chunks"]
+    context, context_tokens = _build_context(relevant_chunks, top_idx, token_budget)
+    keys = prompt_keys([r["prompt"] for r in group], [r["pos"] for r in group])
+    messages = build_batched_messages([r["prompt"] for r in group], keys, context)
+
+    schema = {key: r["prompt"]["json_schema"] for key, r in zip(keys, group)}
+    content, cache_hit = cached_completion(provider, model, messages, temperature=0.0, json_schema=schema)
+    parsed = parse_json_output(content)
+
+    results = []
+    for n, (key, req) in enumerate(zip(keys, group)):
+        if isinstance(parsed, dict) and key in parsed:
+            result = parsed[key]
+        else:
+            error = parsed.get("_error") if isinstance(parsed, dict) else None
+            result = {"_raw": content, "_error": error or f"No {key!r} in the batched answer"}
         results.append({
-            "prompt_id": p.get("id"),
-            "run_for": "termsheet",
-            "result": parsed,
-            "used_context_indices": top_idx,
-            "raw_model_output": content
+            "prompt_id": req["prompt"].get("id"),
+            "run_for": req["run_for"],
+            "result": result,
+            "used_context_indices": [i for i in req["top_idx"] if i in top_idx],
+            "raw_model_output": content,
+            "cache_hit": cache_hit,
+            # The context is shared: its token counts go on the first result only, so sums stay right
+            "context_tokens": context_tokens if n == 0 else None,
+            "batched_with": keys
         })
+    return results
+
+
+def _parse_with_provider(provider: str, model: str, chunks: List[Dict], prompts_path: str, top_k: int,
+                         index: Optional[Dict] = None,
+                         on_retrieved: Optional[Callable[[List[Dict]], None]] = None,
+                         fields: Optional[Dict[str, List[str]]] = None) -> List[Dict]:
+    original = load_prompts(prompts_path)
+    if fields is not None:
+        # Only these prompts, and only these fields of their schema
+        original = [dict(p, json_schema={k: v for k, v in p["json_schema"].items() if k in fields[p.get("id")]})
+                    for p in original if p.get("id") in fields]
+    if RULES_ENABLED:
+        prompts, found = apply_rules(chunks, original, top_k)
+    else:
+        prompts, found = original, [{} for _ in original]
+
+    token_budget = context_token_budget(model) if CONTEXT_BUDGET_ENABLED else None
+
+    results: List[Dict] = [None] * len(prompts)
+    # Prompts the rules answered completely need no retrieval or LLM call
+    llm_pos = []
+    for pos, p in enumerate(prompts):
+        if found[pos] and not p["json_schema"]:
+            results[pos] = {
+                "prompt_id": p.get("id"),
+                "run_for": p.get("run_for", "both").lower(),
+                "result": _with_found({}, found[pos], original[pos]["json_schema"]),
+                "used_context_indices": [],
+                "raw_model_output": "",
+                "cache_hit": False,
+                "context_tokens": None,
+                "rule_fields": list(found[pos]),
+            }
+        else:
+            llm_pos.append(pos)
+
+    requests = prepare_prompt_requests(chunks, [prompts[pos] for pos in llm_pos], top_k=top_k, index=index,
+                                       token_budget=token_budget)
+    for req in requests:
+        req["pos"] = llm_pos[req["pos"]]
+    if on_retrieved is not None:
+        on_retrieved(requests)
+    if PROMPT_BATCHING_ENABLED:
+        groups = batch_prompt_requests(requests)
+    else:
+        groups = [[req] for req in requests]
+
+    for group in groups:
+        if len(group) > 1:
+            for req, result in zip(group, _run_batched(provider, model, group, token_budget)):
+                results[req["pos"]] = result
+        else:
+            req = group[0]
+            content, cache_hit = cached_completion(provider, model, req["messages"], temperature=0.0,
+                                                   json_schema=req["prompt"]["json_schema"])
+            results[req["pos"]] = {
+                "prompt_id": req["prompt"].get("id"),
+                "run_for": req["run_for"],
+                "result": parse_json_output(content),
+                "used_context_indices": req["top_idx"],
+                "raw_model_output": content,
+                "cache_hit": cache_hit,
+                "context_tokens": req["context_tokens"]
+            }
+
+    for req in requests:
+        pos = req["pos"]
+        if found[pos]:
+            results[pos]["result"] = _with_found(results[pos]["result"], found[pos], original[pos]["json_schema"])
+            results[pos]["rule_fields"] = list(found[pos])
 
     return results
 
+
+def parse_with_llm(chunks: List[Dict],prompts_path: str,groq_model: str ,top_k: int = 5,
+                   index: Optional[Dict] = None,
+                   on_retrieved: Optional[Callable[[List[Dict]], None]] = None,
+                   fields: Optional[Dict[str, List[str]]] = None) -> List[Dict]:
+    """
+    chunks: list of dicts from extractor.py
+    prompts_path: path to prompts_spo_frameworks.json
+    groq_model: Groq model name
+    index: optional prebuilt retrieval index over chunks (see prepare_prompt_requests)
+    on_retrieved: optional callback with the prepared requests, before any LLM call
+    fields: optional {prompt_id: [field, ...]}; only those prompts and fields are asked
+    returns: list of dicts { "prompt_id": ..., "result": <parsed json> }
+    """
+    return _parse_with_provider("groq", groq_model, chunks, prompts_path, top_k, index=index,
+                                on_retrieved=on_retrieved, fields=fields)
+
+#Gemini Parsing
+
+def parse_with_llm_gemini(chunks: List[Dict],prompts_path: str,gemini_model: str,top_k: int = 5,
+                          index: Optional[Dict] = None,
+                          on_retrieved: Optional[Callable[[List[Dict]], None]] = None,
+                          fields: Optional[Dict[str, List[str]]] = None) -> List[Dict]:
+    """
+    chunks: list of dicts from extractor.py
+    prompts_path: path to prompts.json
+    gemini_model: Gemini model name (e.g., "gemini-1.5-flash")
+    index: optional prebuilt retrieval index over chunks (see prepare_prompt_requests)
+    on_retrieved: optional callback with the prepared requests, before any LLM call
+    fields: optional {prompt_id: [field, ...]}; only those prompts and fields are asked
+    returns: list of dicts { "prompt_id": ..., "result": <parsed json> }
+    """
+    return _parse_with_provider("gemini", gemini_model, chunks, prompts_path, top_k, index=index,
+                                on_retrieved=on_retrieved, fields=fields)
+
 #Call Gemini
 
+def gemini_response_schema(json_schema: Any) -> Dict:
+    """A prompt's json_schema (an example object) as a Gemini response schema."""
+    if isinstance(json_schema, dict):
+        return {"type": "OBJECT",
+                "properties": {k: gemini_response_schema(v) for k, v in json_schema.items()},
+                "property_ordering": list(json_schema)}
+    if isinstance(json_schema, list):
+        return {"type": "ARRAY", "items": gemini_response_schema(json_schema[0] if json_schema else "")}
+    if isinstance(json_schema, bool):
+        return {"type": "BOOLEAN", "nullable": True}
+    if isinstance(json_schema, (int, float)):
+        return {"type": "NUMBER", "nullable": True}
+    return {"type": "STRING", "nullable": True}
+
+
 def call_gemini(model_gemini: str,
                 messages: List[Dict],
                 temperature: float = 0.0,
-                max_retries: int = 3) -> Dict:
+                max_retries: Optional[int] = None,
+                json_schema: Optional[Dict] = None,
+                stream: bool = False,
+                json_mode: bool = LLM_JSON_MODE) -> Dict:
     """
-    Call Gemini chat model with retries.
+    Call Gemini chat model through the provider gateway (pooled client, rate limits, retries).
     messages: list of {"role": "system"|"user"|"assistant", "content": str}
+    stream: read the response as a stream checked against json_schema (see stream_consumer)
+    json_mode: ask for application/json, constrained to json_schema when given
     """
-    api_key = os.getenv("GEMINI_API_KEY")
+    api_key = provider_api_key("gemini")
     if not api_key:
         raise EnvironmentError("GEMINI_API_KEY not set in environment.")
 
-    client = genai.Client(api_key=api_key)
-
-    for attempt in range(1, max_retries + 1):
-        try:
-            # Gemini doesn’t use role-based messages directly like OpenAI.
-            # We'll stitch them together into a prompt string.
-            prompt = ""
-            for m in messages:
-                role = m["role"].upper()
-                prompt += f"{role}: {m['content']}\n\n"
-
-            # model_client = genai.GenerativeModel(model)
-            # response = model_client.generate_content(
-            #     prompt,
-            #     generation_config={"temperature": temperature}
-            # )
-            # return response
-
-            user_messages = [m["content"] for m in messages if m["role"] == "user"]
-            system_messages = [m["content"] for m in messages if m["role"] == "system"]
-
-
-            response = client.models.generate_content(
-                model = model_gemini,
-                contents = user_messages,
-
-                config = types.GenerateContentConfig(
-                    system_instruction = system_messages,
-                    temperature = temperature,
-
-                )
-
+    # Gemini doesn’t use role-based messages directly like OpenAI:
+    # system messages go in system_instruction, user messages are the contents.
+    user_messages = [m["content"] for m in messages if m["role"] == "user"]
+    system_messages = [m["content"] for m in messages if m["role"] == "system"]
+
+    json_config = {}
+    if json_mode:
+        json_config["response_mime_type"] = "application/json"
+        if json_schema:
+            json_config["response_schema"] = gemini_response_schema(json_schema)
+
+    def request(client):
+        from google.genai import types
+
+        generate = client.models.generate_content_stream if stream else client.models.generate_content
+        return generate(
+            model = model_gemini,
+            contents = user_messages,
+
+            config = types.GenerateContentConfig(
+                system_instruction = system_messages,
+                temperature = temperature,
+                **json_config
             )
 
-            return response
-        except Exception:
-            if attempt == max_retries:
-                raise
-            time.sleep(1.0 * attempt)
+        )
 
+    est_tokens = sum(count_tokens(m["content"]) for m in messages)
+    consume = stream_consumer("gemini", json_schema, est_tokens) if stream else None
+    return get_gateway().call("gemini", api_key, request, est_tokens=est_tokens, max_retries=max_retries,
+                              consume=consume)
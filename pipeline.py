@@ -0,0 +1,130 @@
+"""
+pipeline.py
+- run_pipeline(pdf_paths, parse_fn, on_result, ...): staged batch runner
+    extraction (process pool) -> LLM parsing (thread pool) -> single writer
+- Stages are connected by bounded queues, so at most `queue_size` documents
+  are buffered between them.
+- on_result(pdf_path, results, error) is called from the caller's thread,
+  in the same order as pdf_paths, regardless of completion order.
+- With lazy_fields, documents are extracted incrementally
+  (extractor.LazyTermsheet) and parse_fn receives the LazyTermsheet
+- Metrics (metrics.py) are attributed to the document's pdf_path; extraction
+  metrics recorded in the worker process are returned with its chunks.
+"""
+
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from extractor import LazyTermsheet, extract_chunks_from_termsheet
+from metrics import document, get_metrics
+
+_DONE = object()
+
+
+# ---------------- Stage functions ---------------- #
+
+def extract_document(pdf_path: str, chunk_size: int, overlap: int,
+                     lazy_fields: Optional[List[str]] = None) -> Tuple[List[Dict], Optional[Dict]]:
+    """
+    Extraction stage (runs in a worker process); returns (chunks, the document's metrics).
+    With lazy_fields, chunks is a LazyTermsheet read until those fields look covered.
+    """
+    pdf_name = os.path.basename(pdf_path)
+    with document(pdf_path):
+        if lazy_fields is not None:
+            chunks = LazyTermsheet(pdf_path, lazy_fields, chunk_size=chunk_size, overlap=overlap,
+                                   folder_name=os.path.splitext(pdf_name)[0])
+            chunks.extend()
+        else:
+            chunks = extract_chunks_from_termsheet(pdf_path,
+                                                   chunk_size=chunk_size,
+                                                   overlap=overlap,
+                                                   folder_name=os.path.splitext(pdf_name)[0])
+    metrics = get_metrics()
+    return chunks, metrics.pop_document(pdf_path) if metrics is not None else None
+
+
+def _feed(pdf_paths: List[str], pool: ProcessPoolExecutor, extract_q: queue.Queue,
+          chunk_size: int, overlap: int, n_llm_workers: int, lazy_fields: Optional[List[str]] = None) -> None:
+    """Submit extraction jobs in order; blocks while extract_q is full."""
+    for seq, pdf_path in enumerate(pdf_paths):
+        future = pool.submit(extract_document, pdf_path, chunk_size, overlap, lazy_fields)
+        extract_q.put((seq, pdf_path, future))
+    for _ in range(n_llm_workers):
+        extract_q.put(_DONE)
+
+
+def _parse_worker(parse_fn: Callable[[str, List[Dict]], List[Dict]],
+                  extract_q: queue.Queue, result_q: queue.Queue) -> None:
+    """Wait for each extraction to finish, then run the LLM stage on it."""
+    while True:
+        item = extract_q.get()
+        if item is _DONE:
+            return
+        seq, pdf_path, future = item
+        try:
+            chunks, stats = future.result()
+            metrics = get_metrics()
+            if metrics is not None:
+                metrics.merge_document(pdf_path, stats)
+            with document(pdf_path):
+                results = parse_fn(pdf_path, chunks)
+            result_q.put((seq, pdf_path, results, None))
+        except Exception as e:
+            result_q.put((seq, pdf_path, None, e))
+
+
+# ---------------- Runner ---------------- #
+
+def run_pipeline(pdf_paths: List[str],
+                 parse_fn: Callable[[str, List[Dict]], List[Dict]],
+                 on_result: Callable[[str, Optional[List[Dict]], Optional[Exception]], None],
+                 chunk_size: int,
+                 overlap: int,
+                 extract_workers: int = 1,
+                 llm_workers: int = 1,
+                 queue_size: int = 8,
+                 lazy_fields: Optional[List[str]] = None) -> None:
+    """
+    Run extraction and parsing concurrently over pdf_paths.
+    parse_fn: called with (pdf_path, chunk list) of one document, returns parsed results
+    on_result: single writer, called in input order with (pdf_path, results, error)
+    lazy_fields: extract incrementally (parse_fn then gets an extractor.LazyTermsheet)
+    """
+    if not pdf_paths:
+        return
+
+    extract_workers = max(1, extract_workers)
+    llm_workers = max(1, llm_workers)
+    extract_q: queue.Queue = queue.Queue(maxsize=max(1, queue_size))
+    result_q: queue.Queue = queue.Queue(maxsize=max(1, queue_size))
+
+    with ProcessPoolExecutor(max_workers=extract_workers) as pool:
+        feeder = threading.Thread(target=_feed,
+                                  args=(pdf_paths, pool, extract_q, chunk_size, overlap, llm_workers, lazy_fields),
+                                  daemon=True)
+        feeder.start()
+
+        workers = [threading.Thread(target=_parse_worker, args=(parse_fn, extract_q, result_q), daemon=True)
+                   for _ in range(llm_workers)]
+        for w in workers:
+            w.start()
+
+        # Writer stage: re-order completed documents and emit them in sequence
+        pending = {}
+        next_seq = 0
+        while next_seq < len(pdf_paths):
+            seq, pdf_path, results, error = result_q.get()
+            pending[seq] = (pdf_path, results, error)
+            while next_seq in pending:
+                pdf_path, results, error = pending.pop(next_seq)
+                with document(pdf_path):
+                    on_result(pdf_path, results, error)
+                next_seq += 1
+
+        feeder.join()
+        for w in workers:
+            w.join()
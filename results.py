@@ -0,0 +1,118 @@
+"""
+results.py
+- ResultTable: accumulates parsed result dicts as Arrow-compatible columns.
+  Each value is coerced once, when it is added:
+    list/tuple -> comma-joined string (JSON if nested), dict -> JSON string,
+    None/NaN -> missing, other non-scalars -> str
+  Column types are tracked as rows arrive (bool/int/float/string); a column
+  that sees mixed types becomes a string column.
+- to_arrow() returns a pyarrow.Table, to_pandas() a DataFrame, both ready
+  for st.dataframe and the Excel export without further normalization.
+"""
+
+import json
+import math
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence
+
+if TYPE_CHECKING:
+    import pyarrow
+
+
+def to_cell(value: Any) -> Any:
+    """Coerce one parsed value to a scalar Arrow can store (None = missing)."""
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple)):
+        # if elements are simple scalars, join them; else use json.dumps
+        if all(not isinstance(i, (list, tuple, dict)) for i in value):
+            return ", ".join("" if i is None else str(i) for i in value)
+        return json.dumps(value, ensure_ascii=False)
+    if isinstance(value, dict):
+        return json.dumps(value, ensure_ascii=False)
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+def _kind(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, int):
+        return "int"
+    if isinstance(value, float):
+        return "float"
+    return "string"
+
+
+def _merge_kinds(a: Optional[str], b: Optional[str]) -> Optional[str]:
+    if a is None or a == b:
+        return b
+    if b is None:
+        return a
+    # int widens to float; anything else mixed becomes string
+    if {a, b} == {"int", "float"}:
+        return "float"
+    return "string"
+
+
+class ResultTable:
+    """Columnar accumulator for result rows (dicts)."""
+
+    def __init__(self, first_columns: Sequence[str] = ("Source File",)):
+        self.first_columns = list(first_columns)
+        self.columns: Dict[str, List[Any]] = {}
+        self.kinds: Dict[str, Optional[str]] = {}
+        self.normalized_columns: List[str] = []
+        self._sort_keys: List[Any] = []
+        self._n = 0
+
+    def __len__(self) -> int:
+        return self._n
+
+    def add(self, row: Dict, sort_key: Any = None) -> None:
+        """Append one row; rows are ordered by sort_key (then arrival) on output."""
+        for name, value in row.items():
+            col = self.columns.get(name)
+            if col is None:
+                col = self.columns[name] = [None] * self._n
+                self.kinds[name] = None
+            if isinstance(value, (list, tuple, dict)) and name not in self.normalized_columns:
+                self.normalized_columns.append(name)
+            cell = to_cell(value)
+            col.append(cell)
+            self.kinds[name] = _merge_kinds(self.kinds[name], _kind(cell))
+        self._n += 1
+        self._sort_keys.append((sort_key is not None, sort_key if sort_key is not None else 0, self._n))
+        for col in self.columns.values():
+            if len(col) < self._n:
+                col.append(None)
+
+    def column_order(self) -> List[str]:
+        first = [c for c in self.first_columns if c in self.columns]
+        return first + [c for c in self.columns if c not in first]
+
+    def to_arrow(self) -> "pyarrow.Table":
+        # Imported here: sinks.py uses to_cell without needing pyarrow
+        import pyarrow as pa
+
+        arrow_types = {"bool": pa.bool_(), "int": pa.int64(), "float": pa.float64(), "string": pa.string()}
+        order = sorted(range(self._n), key=self._sort_keys.__getitem__)
+        arrays = []
+        names = self.column_order()
+        for name in names:
+            kind = self.kinds[name] or "string"
+            values = self.columns[name]
+            values = [values[i] for i in order]
+            if kind == "string":
+                values = ["" if v is None else v if isinstance(v, str) else str(v) for v in values]
+            elif kind == "float":
+                values = [None if v is None else float(v) for v in values]
+            arrays.append(pa.array(values, type=arrow_types[kind]))
+        return pa.Table.from_arrays(arrays, names=names)
+
+    def to_pandas(self):
+        return self.to_arrow().to_pandas()
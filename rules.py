@@ -0,0 +1,194 @@
+"""
+rules.py
+- Deterministic extractors for the term-sheet fields with rigid formats,
+  run over the extracted text before any LLM call
+  - ISIN (ISO 6166 check digit verified), Currency (ISO 4217 code), Coupon,
+    Issuance Date / Maturity Date, Moody's / S&P / Fitch ratings
+  - a value is only taken when it follows the field's label ("ISIN: ...",
+    "Maturity Date  27 March 2034", "Aa3 (Moody's)"), is the only candidate
+    on that line, and every labelled occurrence in the document agrees;
+    anything else is left to the LLM
+- RULES: field name -> FieldRule (labels, value pattern, optional check)
+- extract_fields(chunks, fields): {field: value} for the fields found
+- labelled(field, text): whether a line of text starts with the field's name
+  or one of its rule labels (used by extractor.LazyTermsheet)
+parser.py asks the LLM only for the remaining fields (see RULES_ENABLED in
+config.py); per-field hit rates are recorded in metrics.py.
+"""
+
+import re
+from functools import lru_cache
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional
+
+from chunk_store import ChunkStore
+
+
+class FieldRule(NamedTuple):
+    labels: str                                  # label alternatives (regex, case-insensitive)
+    value: str                                   # value pattern (regex, case-sensitive)
+    check: Optional[Callable[[str], bool]] = None
+    anchored: bool = False                       # value must come right after the label
+    reject: Optional[str] = None                 # skip labelled lines matching this (case-insensitive)
+    suffix_label: bool = False                   # also accept "<value> (<label>)"
+
+
+# ---------------- Checks ---------------- #
+
+def isin_check_digit_ok(isin: str) -> bool:
+    """Luhn check over the letter-expanded code (ISO 6166)."""
+    digits = "".join(str(int(ch, 36)) for ch in isin[:-1])
+    total = 0
+    for i, d in enumerate(reversed(digits)):
+        n = int(d) * (2 if i % 2 == 0 else 1)
+        total += n // 10 + n % 10
+    return str((10 - total % 10) % 10) == isin[-1]
+
+
+# Active ISO 4217 codes likely in a term sheet (no funds or precious metals)
+CURRENCIES = frozenset("""
+AED ARS AUD BGN BHD BRL CAD CHF CLP CNH CNY COP CZK DKK EGP EUR GBP HKD HUF IDR
+ILS INR ISK JPY KRW KWD KZT MAD MXN MYR NGN NOK NZD OMR PEN PHP PKR PLN QAR RON
+RSD RUB SAR SEK SGD THB TRY TWD UAH USD VND ZAR
+""".split())
+
+_DATE_FORMATS = ("%d %B %Y", "%d %b %Y", "%B %d, %Y", "%b %d, %Y", "%B %d %Y", "%d-%b-%Y", "%d-%B-%Y",
+                 "%d/%m/%Y", "%d.%m.%Y", "%Y-%m-%d")
+
+
+def is_date(text: str) -> bool:
+    text = re.sub(r"(\d)(st|nd|rd|th)\b", r"\1", " ".join(text.split()))
+    for fmt in _DATE_FORMATS:
+        try:
+            datetime.strptime(text, fmt)
+            return True
+        except ValueError:
+            pass
+    return False
+
+
+# ---------------- Rules ---------------- #
+
+_MONTH = r"(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Sept|Oct|Nov|Dec)[a-z]*\.?"
+_RATING_END = r"(?![A-Za-z0-9+-])"
+_DATE = (rf"\d{{1,2}}(?:st|nd|rd|th)?[ -]{_MONTH}[ -]\d{{4}}"
+         rf"|{_MONTH} \d{{1,2}}(?:st|nd|rd|th)?,? \d{{4}}"
+         r"|\d{1,2}[/.]\d{1,2}[/.]\d{4}|\d{4}-\d{2}-\d{2}")
+
+RULES: Dict[str, FieldRule] = {
+    "ISIN": FieldRule(r"ISIN(?:\s+Code)?", r"\b[A-Z]{2}[A-Z0-9]{9}[0-9]\b", isin_check_digit_ok),
+    "Currency": FieldRule(r"(?:Specified\s+|Issue\s+|Settlement\s+)?Currency", r"\b[A-Z]{3}\b",
+                          lambda v: v in CURRENCIES),
+    # Fixed rates only: a floating rate's "+ x%" is a margin, not the coupon
+    "Coupon": FieldRule(r"Coupon(?:\s+Rate)?|Interest\s+Rate|Rate\s+of\s+Interest",
+                        r"\d{1,2}(?:\.\d+)?\s?%(?:\s+(?:per\s+annum|p\.\s?a\.))?",
+                        reject=r"\+|floating|margin|step|reset|\b€?STR\b|EURIBOR|LIBOR|SOFR|SONIA|SARON|TONA"),
+    "Issuance Date": FieldRule(r"Issu(?:e|ance)\s+Date", _DATE, is_date),
+    "Maturity Date": FieldRule(r"Maturity(?:\s+Date)?", _DATE, is_date),
+    "Moody's": FieldRule(r"Moody[’']?s(?:\s+Ratings?)?",
+                         r"(?:\(P\))?(?:Aaa|Aa[123]|A[123]|Baa[123]|Ba[123]|B[123]|Caa[123]|Ca|C)" + _RATING_END,
+                         anchored=True, suffix_label=True),
+    "S&P": FieldRule(r"(?:S\s?&\s?P|Standard\s+(?:&|and)\s+Poor[’']?s)(?:\s+Ratings?)?",
+                     r"(?:AAA|AA[+-]?|A[+-]?|BBB[+-]?|BB[+-]?|B[+-]?|CCC[+-]?|CC|C|D)" + _RATING_END,
+                     anchored=True, suffix_label=True),
+    "Fitch": FieldRule(r"Fitch(?:\s+Ratings?)?",
+                       r"(?:AAA|AA[+-]?|A[+-]?|BBB[+-]?|BB[+-]?|B[+-]?|CCC[+-]?|CC|C|RD|D)" + _RATING_END,
+                       anchored=True, suffix_label=True),
+}
+
+
+class _Compiled(NamedTuple):
+    line: "re.Pattern"
+    value: "re.Pattern"
+    reject: Optional["re.Pattern"]
+    suffix: Optional["re.Pattern"]
+    rule: FieldRule
+
+
+def _compile(rule: FieldRule) -> _Compiled:
+    # Label at the start of a line, then an optional ":" / "-" separator and the rest of the line
+    line = re.compile(rf"^[ \t•*\-]*(?i:{rule.labels})\b[ \t]*[:\-–]?[ \t]*(?P<rest>[^\n]*)", re.M)
+    suffix = None
+    if rule.suffix_label:
+        suffix = re.compile(rf"(?<![A-Za-z])(?P<value>{rule.value})[ \t]*\([ \t]*(?i:{rule.labels})[ \t]*\)")
+    reject = re.compile(rule.reject, re.I) if rule.reject else None
+    return _Compiled(line, re.compile(rule.value), reject, suffix, rule)
+
+
+_COMPILED = {field: _compile(rule) for field, rule in RULES.items()}
+
+
+# ---------------- Extraction ---------------- #
+
+def _candidates(compiled: _Compiled, text: str) -> List[Optional[str]]:
+    """Values found next to the field's labels in text; None marks an ambiguous line."""
+    rule = compiled.rule
+    found: List[Optional[str]] = []
+    for m in compiled.line.finditer(text):
+        rest = m.group("rest")
+        if compiled.reject is not None and compiled.reject.search(rest):
+            continue
+        if rule.anchored:
+            v = compiled.value.match(rest)
+            values = {v.group(0)} if v else set()
+        else:
+            values = {" ".join(v.split()) for v in compiled.value.findall(rest)}
+        if rule.check is not None:
+            values = {v for v in values if rule.check(v)}
+        if len(values) == 1:
+            found.append(values.pop())
+        elif len(values) > 1:
+            found.append(None)  # ambiguous line, e.g. two ISINs (Reg S / 144A)
+    if compiled.suffix is not None:
+        for m in compiled.suffix.finditer(text):
+            value = m.group("value")
+            if rule.check is None or rule.check(value):
+                found.append(value)
+    return found
+
+
+@lru_cache(maxsize=None)
+def _label_re(field: str) -> "re.Pattern":
+    labels = [r"\s+".join(re.escape(w) for w in field.split())]
+    if field in RULES:
+        labels.append(RULES[field].labels)
+    return re.compile(r"^[ \t•*\-]*(?i:" + "|".join(labels) + r")(?![A-Za-z0-9])", re.M)
+
+
+def labelled(field: str, text: str) -> bool:
+    """True if a line of text starts with the field's name (or one of its rule labels)."""
+    if _label_re(field).search(text):
+        return True
+    suffix = _COMPILED[field].suffix if field in _COMPILED else None
+    return bool(suffix and suffix.search(text))
+
+
+def source_texts(chunks: Iterable) -> Iterable[str]:
+    """Texts to scan: the page/document buffers of a ChunkStore, else the chunk texts."""
+    if isinstance(chunks, ChunkStore):
+        return chunks.buffers
+    return (c["chunk"] for c in chunks)
+
+
+def extract_fields(chunks: Iterable, fields: Iterable[str]) -> Dict[str, str]:
+    """
+    Values of the given fields that the rules find with high confidence.
+    Fields without a rule, not found, or with conflicting values are left out.
+    """
+    wanted = [f for f in fields if f in _COMPILED]
+    if not wanted:
+        return {}
+    texts = list(source_texts(chunks))
+    out: Dict[str, str] = {}
+    for field in wanted:
+        found = []
+        for text in texts:
+            found.extend(_candidates(_COMPILED[field], text))
+        if not found or None in found:
+            continue
+        values = set(found)
+        # Drop values cut short at a chunk boundary ("5.810% per" next to "5.810% per annum")
+        values = {v for v in values if not any(o != v and o.startswith(v) for o in values)}
+        if len(values) == 1:
+            out[field] = values.pop()
+    return out
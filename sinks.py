@@ -0,0 +1,289 @@
+"""
+sinks.py
+- Output sinks for parsed Term Sheet rows. All sinks share one interface:
+    open() / write(row, key) / write_many(rows, key) / flush() / close(),
+    usable as a context manager; on_flush(keys) is called once the rows of
+    those document keys are on disk (see main.py's processing journal)
+  - JsonlSink: append-only JSON lines
+  - CsvSink: appends to a CSV file, header written once
+  - ParquetSink: one part file per run in a dataset folder, a row group
+    written per flush
+  - ExcelSink: the EXPORT sheet (writer.ExcelWriterSession), saved at close
+- Columns default to the prompts' json_schema order (writer.columns_from_prompts).
+- make_sink(kind, target, ...): build a sink by name; target is a path or,
+  for jsonl/csv/parquet, a binary file object (e.g. BytesIO)
+- sink_to_excel(src, excel_path): turn a jsonl/csv/parquet output into Excel;
+  the EXPORT sheet is replaced, so converting twice does not duplicate rows
+"""
+
+import io
+import os
+import csv
+import json
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import BinaryIO, Callable, Dict, List, Optional, Union
+
+from results import to_cell
+from writer import ExcelWriterSession, columns_from_prompts
+from config import EXCEL_FILE, SINK_PATHS, SINK_FLUSH_EVERY
+
+Target = Union[str, BinaryIO]
+
+
+class Sink(ABC):
+    """Base class: buffers rows and hands them to _write_rows() every flush_every rows."""
+
+    def __init__(self, target: Target, columns: Optional[List[str]] = None,
+                 flush_every: int = SINK_FLUSH_EVERY,
+                 on_flush: Optional[Callable[[List[str]], None]] = None):
+        self.target = target
+        self.path = target if isinstance(target, str) else None
+        self.columns = columns or columns_from_prompts()
+        self.flush_every = max(1, flush_every)
+        self.on_flush = on_flush
+        self.rows_written = 0
+        self._buffer: List[Dict] = []
+        self._unsaved_keys: List[str] = []
+        self._opened = False
+
+    # Subclasses implement these three
+    @abstractmethod
+    def _open(self) -> None:
+        ...
+
+    @abstractmethod
+    def _write_rows(self, rows: List[Dict]) -> None:
+        ...
+
+    @abstractmethod
+    def _close(self) -> None:
+        ...
+
+    def open(self) -> "Sink":
+        if not self._opened:
+            if self.path and os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._open()
+            self._opened = True
+        return self
+
+    def write(self, row: Dict, key: Optional[str] = None) -> None:
+        self.write_many([row], key=key)
+
+    def write_many(self, rows: List[Dict], key: Optional[str] = None) -> None:
+        """Buffer all rows of one document; they are always flushed together."""
+        if not self._opened:
+            self.open()
+        self._buffer.extend(rows)
+        if key is not None:
+            self._unsaved_keys.append(key)
+        if len(self._buffer) >= self.flush_every:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._buffer:
+            self._write_rows(self._buffer)
+            self.rows_written += len(self._buffer)
+            self._buffer = []
+        keys, self._unsaved_keys = self._unsaved_keys, []
+        if self.on_flush and keys:
+            self.on_flush(keys)
+
+    def close(self) -> None:
+        if not self._opened:
+            return
+        self.flush()
+        self._close()
+        self._opened = False
+        if self.path:
+            print(f"✅ {self.rows_written} rows written to {self.path}")
+
+    def __enter__(self) -> "Sink":
+        return self.open()
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+
+class _TextSink(Sink):
+    """Shared file handling for the line-oriented text formats."""
+
+    def _open(self) -> None:
+        if self.path:
+            self._is_new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+            self._fh = open(self.path, "a", encoding="utf-8", newline="")
+        else:
+            self._is_new = True
+            self._fh = io.TextIOWrapper(self.target, encoding="utf-8", newline="")
+
+    def _sync(self) -> None:
+        self._fh.flush()
+        if self.path:
+            os.fsync(self._fh.fileno())
+
+    def _close(self) -> None:
+        if self.path:
+            self._fh.close()
+        else:
+            # Leave the caller's buffer open
+            self._fh.flush()
+            self._fh.detach()
+
+
+class JsonlSink(_TextSink):
+    """One JSON object per line, keys in column order."""
+
+    def _write_rows(self, rows: List[Dict]) -> None:
+        for row in rows:
+            self._fh.write(json.dumps({c: row.get(c) for c in self.columns}, ensure_ascii=False) + "\n")
+        self._sync()
+
+
+class CsvSink(_TextSink):
+    """CSV with a header row; lists/dicts are flattened like the Streamlit table."""
+
+    def _open(self) -> None:
+        super()._open()
+        self._writer = csv.writer(self._fh)
+        if self._is_new:
+            self._writer.writerow(self.columns)
+
+    def _write_rows(self, rows: List[Dict]) -> None:
+        for row in rows:
+            cells = (to_cell(row.get(c)) for c in self.columns)
+            self._writer.writerow(["" if v is None else v for v in cells])
+        self._sync()
+
+
+class ParquetSink(Sink):
+    """
+    Parquet output, all columns as strings so every row group has the same schema.
+    A path target is a dataset folder: each run adds its own part file, which
+    pyarrow/pandas read back as one table (pd.read_parquet(folder)).
+    """
+
+    def _open(self) -> None:
+        import pyarrow as pa
+
+        self._schema = pa.schema([(c, pa.string()) for c in self.columns])
+        self._writer = None
+        if self.path:
+            part = f"part-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.parquet"
+            self._part_path = os.path.join(self.path, part)
+            # Written under a "_"-prefixed name, which dataset readers skip, so
+            # they never see a part without its footer
+            self._tmp_path = os.path.join(self.path, "_" + part + ".tmp")
+
+    def _write_rows(self, rows: List[Dict]) -> None:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        # Created with the first rows, so a run that writes nothing adds no part file
+        if self._writer is None:
+            if self.path:
+                os.makedirs(self.path, exist_ok=True)
+            self._writer = pq.ParquetWriter(self._tmp_path if self.path else self.target, self._schema)
+
+        columns = {c: [] for c in self.columns}
+        for row in rows:
+            for c in self.columns:
+                v = to_cell(row.get(c))
+                columns[c].append(None if v is None else str(v))
+        self._writer.write_table(pa.Table.from_pydict(columns, schema=self._schema))
+
+    def flush(self) -> None:
+        # A part file is only readable once closed, so rows count as saved at close
+        if self._buffer:
+            self._write_rows(self._buffer)
+            self.rows_written += len(self._buffer)
+            self._buffer = []
+
+    def close(self) -> None:
+        if not self._opened:
+            return
+        self.flush()
+        self._close()
+        self._opened = False
+        keys, self._unsaved_keys = self._unsaved_keys, []
+        if self.on_flush and keys:
+            self.on_flush(keys)
+        if self.path and self.rows_written:
+            print(f"✅ {self.rows_written} rows written to {self._part_path}")
+
+    def _close(self) -> None:
+        if self._writer is None:
+            return
+        self._writer.close()
+        if self.path:
+            os.replace(self._tmp_path, self._part_path)
+
+
+class ExcelSink(ExcelWriterSession):
+    """
+    The existing EXPORT workbook, saved once when the sink is closed.
+    replace=True starts the EXPORT sheet over instead of appending to it
+    (other sheets of the workbook are kept).
+    """
+
+    def __init__(self, target: str = EXCEL_FILE, columns: Optional[List[str]] = None,
+                 flush_every: Optional[int] = None,
+                 on_flush: Optional[Callable[[List[str]], None]] = None,
+                 replace: bool = False):
+        if not isinstance(target, str):
+            raise TypeError("ExcelSink writes to a file path")
+        # Excel is expensive to save, so by default it is only saved at close
+        super().__init__(path=target, flush_every=flush_every or 2 ** 62, on_flush=on_flush, columns=columns)
+        self.replace = replace
+
+    def open(self) -> "ExcelSink":
+        super().open()
+        if self.replace and not self._write_only:
+            # A new file is already a fresh sheet; an existing EXPORT sheet is rebuilt in place
+            index = self._wb.sheetnames.index("EXPORT")
+            self._wb.remove(self._ws)
+            self._ws = self._wb.create_sheet("EXPORT", index)
+            self._ws.append(self.columns)
+        return self
+
+    def write_many(self, rows: List[Dict], key: Optional[str] = None) -> None:
+        # openpyxl rejects list/dict cells; flatten them like the other sinks
+        super().write_many([{k: to_cell(v) for k, v in r.items()} for r in rows], key=key)
+
+
+SINKS = {
+    "excel": ExcelSink,
+    "jsonl": JsonlSink,
+    "csv": CsvSink,
+    "parquet": ParquetSink,
+}
+
+
+def make_sink(kind: str, target: Optional[Target] = None, columns: Optional[List[str]] = None,
+              on_flush: Optional[Callable[[List[str]], None]] = None, **kwargs):
+    """Build a sink by name; target defaults to SINK_PATHS[kind]."""
+    if kind not in SINKS:
+        raise ValueError(f"Unknown sink: {kind!r} (expected one of {sorted(SINKS)})")
+    if target is None:
+        target = SINK_PATHS[kind]
+    return SINKS[kind](target, columns=columns, on_flush=on_flush, **kwargs)
+
+
+def read_rows(path: str) -> List[Dict]:
+    """Read back the rows of a jsonl/csv/parquet output."""
+    if os.path.isdir(path) or path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        return pq.read_table(path).to_pylist()
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if path.endswith(".csv"):
+            return list(csv.DictReader(f))
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def sink_to_excel(src_path: str, excel_path: str = EXCEL_FILE, columns: Optional[List[str]] = None) -> int:
+    """Write the rows of a jsonl/csv/parquet output to Excel's EXPORT sheet (replacing its rows); returns the row count."""
+    rows = read_rows(src_path)
+    with ExcelSink(excel_path, columns=columns, replace=True) as sink:
+        sink.write_many(rows)
+    return len(rows)
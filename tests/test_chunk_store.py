@@ -0,0 +1,88 @@
+import re
+
+import pytest
+
+import tokens
+from chunk_store import ChunkStore, token_chunk_offsets
+
+
+def word_starts(text):
+    return [m.start() for m in re.finditer(r"\S+", text)]
+
+
+@pytest.fixture
+def word_tokens(monkeypatch):
+    """Tokenize by words, so chunk boundaries do not depend on the tokenizer installed."""
+    monkeypatch.setattr(tokens, "token_offsets", word_starts)
+
+
+def sentences(prefix, n):
+    return " ".join(f"{prefix} sentence number {i} has six words." for i in range(n))
+
+
+def test_token_chunks_respect_max_tokens():
+    text = sentences("Alpha", 20)
+    starts = word_starts(text)
+    offsets = token_chunk_offsets(text, starts, max_tokens=20)
+    assert len(offsets) > 1
+    for start, end in offsets:
+        assert sum(start <= s < end for s in starts) <= 20
+
+
+def test_token_chunks_cover_text_and_overlap():
+    text = sentences("Alpha", 20)
+    offsets = token_chunk_offsets(text, word_starts(text), max_tokens=20, overlap_tokens=7)
+    assert offsets[0][0] == 0 and offsets[-1][1] == len(text)
+    for (_, prev_end), (start, _) in zip(offsets, offsets[1:]):
+        # Each chunk repeats the last sentence of the previous one
+        assert start < prev_end
+
+
+def test_long_unit_is_cut_at_token_boundaries():
+    text = " ".join(f"w{i}" for i in range(50))
+    starts = word_starts(text)
+    offsets = token_chunk_offsets(text, starts, max_tokens=10)
+    assert len(offsets) == 5
+    assert all(start in starts for start, _ in offsets)
+
+
+def test_chunk_crosses_page_break():
+    pages = ["Issuer: Example Bank plc.", "Currency: EUR."]
+    store = ChunkStore()
+    assert store.add_document(pages, max_tokens=1000) == 1
+    chunk = store[0]
+    assert chunk["page"] == 1
+    assert chunk["page_span"] == (1, 2)
+    assert chunk["chunk"] == "Issuer: Example Bank plc.\nCurrency: EUR."
+
+
+def test_chunk_pages_and_indices(word_tokens):
+    pages = [sentences("First", 5), sentences("Second", 5), sentences("Third", 5)]
+    store = ChunkStore()
+    store.add_document(pages, max_tokens=20, overlap_tokens=7)
+    buffer = "\n".join(pages)
+    page_of = lambda pos: buffer.count("\n", 0, pos) + 1
+    assert any(c["page_span"][0] != c["page_span"][1] for c in store)
+    for c in store:
+        start = buffer.index(c["chunk"])
+        assert c["page_span"] == (page_of(start), page_of(start + len(c["chunk"]) - 1))
+        assert c["page"] == c["page_span"][0]
+    # chunk_index counts the chunks starting on each page
+    per_page = {}
+    for c in store:
+        per_page.setdefault(c["page"], []).append(c["chunk_index"])
+    assert all(idx == list(range(1, len(idx) + 1)) for idx in per_page.values())
+
+
+def test_page_texts_split_document_buffer():
+    pages = ["Page one text.", "", "Page three\nhas two lines."]
+    store = ChunkStore()
+    store.add_document(pages, max_tokens=5)
+    assert store.page_texts() == {1: pages[0], 2: pages[1], 3: pages[2]}
+
+
+def test_page_texts_of_character_chunks():
+    store = ChunkStore()
+    store.add_page(1, "Page one text.", chunk_size=8, overlap=2)
+    store.add_page(2, "Page two text.", chunk_size=8, overlap=2)
+    assert store.page_texts() == {1: "Page one text.", 2: "Page two text."}
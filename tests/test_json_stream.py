@@ -0,0 +1,102 @@
+import pytest
+
+from json_stream import JSONStreamParser, MalformedJSON, parse_json_text
+
+SCHEMA = {"Issuer": "", "Coupon": {"Rate": "", "Frequency": ""}, "Dates": []}
+ANSWER = '{"Issuer": "Caf\\u00e9 Bank", "Coupon": {"Rate": 4.25e-2, "Frequency": null}, "Dates": ["2024", true]}'
+EXPECTED = {"Issuer": "Café Bank", "Coupon": {"Rate": 0.0425, "Frequency": None}, "Dates": ["2024", True]}
+
+
+def feed_pieces(parser, pieces):
+    done = False
+    for piece in pieces:
+        done = parser.feed(piece)
+    return done
+
+
+@pytest.mark.parametrize("cut", range(1, len(ANSWER)))
+def test_split_anywhere(cut):
+    # Splits fall inside strings, escapes, numbers and literals
+    parser = JSONStreamParser(SCHEMA)
+    assert not parser.feed(ANSWER[:cut])
+    assert parser.feed(ANSWER[cut:])
+    assert parser.value() == EXPECTED
+
+
+def test_one_character_at_a_time():
+    parser = JSONStreamParser(SCHEMA)
+    assert feed_pieces(parser, list(ANSWER))
+    assert parser.value() == EXPECTED
+    assert parser.keys == ["Issuer", "Coupon", "Dates"]
+
+
+def test_split_literal_is_checked_when_complete():
+    parser = JSONStreamParser()
+    parser.feed('{"a": tr')
+    with pytest.raises(MalformedJSON):
+        parser.feed("ie}")
+
+
+def test_unknown_top_level_key():
+    parser = JSONStreamParser(SCHEMA)
+    with pytest.raises(MalformedJSON, match="unexpected key 'Isuer'"):
+        feed_pieces(parser, ['{"Is', 'uer": "X"}'])
+
+
+def test_unknown_nested_key():
+    parser = JSONStreamParser(SCHEMA)
+    with pytest.raises(MalformedJSON, match="unexpected key 'Day'"):
+        parser.feed('{"Coupon": {"Rate": 1, "Day": 2}}')
+
+
+def test_array_where_object_expected():
+    with pytest.raises(MalformedJSON):
+        JSONStreamParser(SCHEMA).feed('[{"Issuer": "X"}]')
+    with pytest.raises(MalformedJSON):
+        JSONStreamParser(SCHEMA).feed('{"Coupon": [1]}')
+
+
+def test_code_fence_is_dropped():
+    parser = JSONStreamParser(SCHEMA)
+    assert feed_pieces(parser, ["```js", 'on\n{"Issuer": "X"}', "\n```"])
+    assert parser.text == '{"Issuer": "X"}'
+    assert parser.value() == {"Issuer": "X"}
+
+
+def test_text_after_the_json_is_not_read():
+    parser = JSONStreamParser()
+    assert parser.feed('{"a": 1}\n``` and some trailing {')
+    assert parser.value() == {"a": 1}
+
+
+def test_preamble_limit():
+    parser = JSONStreamParser(max_preamble=10)
+    with pytest.raises(MalformedJSON):
+        parser.feed("Here is the JSON you asked for: {}")
+
+
+def test_raw_newline_in_string_is_accepted():
+    parser = JSONStreamParser()
+    assert parser.feed('{"a": "line one\nline two"}')
+    assert parser.value() == {"a": "line one\nline two"}
+
+
+def test_incomplete_value():
+    parser = JSONStreamParser()
+    parser.feed('{"a": [1, 2')
+    assert not parser.done
+    with pytest.raises(MalformedJSON):
+        parser.value()
+
+
+def test_parse_json_text_in_code_fence():
+    assert parse_json_text('Sure:\n```json\n{"Issuer": "X"}\n```', SCHEMA) == {"Issuer": "X"}
+
+
+def test_parse_json_text_skips_a_broken_candidate():
+    assert parse_json_text('Use {braces} like this: {"a": 1}') == {"a": 1}
+
+
+def test_parse_json_text_without_json():
+    with pytest.raises(MalformedJSON):
+        parse_json_text("no JSON here")
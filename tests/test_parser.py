@@ -0,0 +1,14 @@
+from parser import prompt_keys
+
+
+def test_prompt_keys_are_ids():
+    assert prompt_keys([{"id": "dates"}, {"id": "coupon"}], [0, 3]) == ["dates", "coupon"]
+
+
+def test_prompt_keys_without_id_use_position():
+    assert prompt_keys([{"id": "dates"}, {}], [0, 3]) == ["dates", "prompt_3"]
+
+
+def test_repeated_ids_get_unique_keys():
+    assert prompt_keys([{"id": "dates"}, {"id": "dates"}, {"id": "coupon"}], [1, 4, 5]) == \
+        ["dates_1", "dates_4", "coupon"]
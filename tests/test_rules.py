@@ -0,0 +1,47 @@
+import pytest
+
+from chunk_store import ChunkStore
+from rules import extract_fields, isin_check_digit_ok
+
+
+def chunks(*pages):
+    return [{"chunk": text, "page": n} for n, text in enumerate(pages, start=1)]
+
+
+@pytest.mark.parametrize("isin", ["US0378331005", "DE000BAY0017", "GB0002634946"])
+def test_isin_check_digit_valid(isin):
+    assert isin_check_digit_ok(isin)
+
+
+@pytest.mark.parametrize("isin", ["US0378331006", "DE000BAY0018", "GB0002634940"])
+def test_isin_check_digit_invalid(isin):
+    assert not isin_check_digit_ok(isin)
+
+
+def test_isin_with_bad_check_digit_is_left_to_the_llm():
+    assert extract_fields(chunks("ISIN: US0378331005"), ["ISIN"]) == {"ISIN": "US0378331005"}
+    assert extract_fields(chunks("ISIN: US0378331006"), ["ISIN"]) == {}
+
+
+def test_two_isins_on_one_line_are_ambiguous():
+    assert extract_fields(chunks("ISIN: US0378331005 / DE000BAY0017"), ["ISIN"]) == {}
+
+
+def test_currency_agreeing_across_pages():
+    found = extract_fields(chunks("Currency: USD", "Specified Currency: USD"), ["Currency"])
+    assert found == {"Currency": "USD"}
+
+
+def test_currency_conflicting_values():
+    assert extract_fields(chunks("Currency: USD", "Specified Currency: EUR"), ["Currency"]) == {}
+
+
+def test_currency_must_be_an_iso_code():
+    assert extract_fields(chunks("Currency: XYZ"), ["Currency"]) == {}
+
+
+def test_conflict_found_in_chunk_store_buffers():
+    store = ChunkStore()
+    store.add_page(1, "Currency: USD", chunk_size=500, overlap=50)
+    store.add_page(2, "Settlement Currency: GBP", chunk_size=500, overlap=50)
+    assert extract_fields(store, ["Currency", "ISIN"]) == {}
@@ -0,0 +1,62 @@
+"""
+tokens.py
+- get_encoding(): shared tiktoken encoding (TOKENIZER_ENCODING in config.py)
+- count_tokens(text): token count, used for context budgets and reports.
+  Falls back to a ~4 characters/token estimate if the encoding cannot be
+  loaded (tiktoken downloads encodings on first use).
+- truncate_to_tokens(text, n): text cut to at most n tokens.
+- token_offsets(text): character offset where each token starts (one
+  encode of the whole text; used by the token chunker in chunk_store.py)
+"""
+
+import threading
+from typing import List, Optional
+
+from config import TOKENIZER_ENCODING
+
+_encoding = None
+_encoding_failed = False
+_encoding_lock = threading.Lock()
+
+
+def get_encoding():
+    """Return the tiktoken encoding, or None if it is unavailable."""
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed:
+        with _encoding_lock:
+            if _encoding is None and not _encoding_failed:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+                except Exception:
+                    _encoding_failed = True
+    return _encoding
+
+
+def count_tokens(text: Optional[str]) -> int:
+    if not text:
+        return 0
+    enc = get_encoding()
+    if enc is None:
+        return max(1, len(text) // 4)
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text down to at most max_tokens tokens."""
+    enc = get_encoding()
+    if enc is None:
+        return text[:max_tokens * 4]
+    ids = enc.encode(text, disallowed_special=())
+    return text if len(ids) <= max_tokens else enc.decode(ids[:max_tokens])
+
+
+def token_offsets(text: str) -> List[int]:
+    """Start offset (in characters) of every token of text."""
+    if not text:
+        return []
+    enc = get_encoding()
+    if enc is None:
+        return list(range(0, len(text), 4))
+    ids = enc.encode(text, disallowed_special=())
+    return enc.decode_with_offsets(ids)[1]
@@ -0,0 +1,252 @@
+"""
+watcher.py
+- find_pdfs(root): all PDFs under root, recursively (hidden folders skipped)
+- FolderWatcher(root): reports new or modified PDFs anywhere under root
+  - inotify on Linux (through ctypes, no extra dependency); otherwise, or if
+    inotify cannot be set up (e.g. the watch limit is reached), the tree is
+    rescanned every poll_interval seconds. mode says which one is in use
+  - PDFs present when the watcher starts are known, not new
+  - debounce: a file is reported only once its size and mtime have not
+    changed for `debounce` seconds and it ends with a PDF trailer (%%EOF),
+    so files still being copied in are not picked up half written; a file
+    that never gets a trailer is reported after 10 * debounce
+  - poll(timeout): wait up to timeout seconds; returns [(path, first seen)]
+    of the files that are ready, first seen as a time.time() timestamp
+  - pending: number of files seen but not ready yet
+main.py --watch feeds the ready files through the pipeline.
+"""
+
+import os
+import sys
+import time
+import select
+import struct
+from typing import Dict, List, Optional, Tuple
+
+from config import WATCH_DEBOUNCE, WATCH_POLL_INTERVAL
+
+# inotify(7) event bits
+_IN_MODIFY = 0x2
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_FROM = 0x40
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_Q_OVERFLOW = 0x4000
+_IN_IGNORED = 0x8000
+_IN_ISDIR = 0x40000000
+_WATCH_MASK = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len; followed by len bytes of name
+
+
+def _is_pdf(path: str) -> bool:
+    return path.lower().endswith(".pdf")
+
+
+def _walk(root: str):
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+        yield dirpath, filenames
+
+
+def find_pdfs(root: str) -> List[str]:
+    """Full paths of all PDFs under root, in sorted order."""
+    return sorted(os.path.join(d, f) for d, files in _walk(root) for f in files if _is_pdf(f))
+
+
+def _stat(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def _has_trailer(path: str) -> bool:
+    """Whether the last KB of the file holds the %%EOF marker of a complete PDF."""
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - 1024))
+            return b"%%EOF" in f.read()
+    except OSError:
+        return False
+
+
+# ---------------- inotify ---------------- #
+
+class _Inotify:
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+
+        self._ctypes = ctypes
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"inotify_init1: {os.strerror(errno)}")
+        self._dirs: Dict[int, str] = {}
+
+    def add(self, directory: str) -> None:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), _WATCH_MASK)
+        if wd < 0:
+            errno = self._ctypes.get_errno()
+            raise OSError(errno, f"inotify_add_watch {directory}: {os.strerror(errno)}")
+        self._dirs[wd] = directory
+
+    def read(self, timeout: float) -> List[Tuple[Optional[str], int]]:
+        """(path, mask) of the events within timeout seconds; path None means the queue overflowed."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        pos = 0
+        while pos + _EVENT.size <= len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, pos)
+            name = data[pos + _EVENT.size:pos + _EVENT.size + length].rstrip(b"\0")
+            pos += _EVENT.size + length
+            if mask & _IN_Q_OVERFLOW:
+                events.append((None, mask))
+                continue
+            if mask & _IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            directory = self._dirs.get(wd)
+            if directory is not None:
+                events.append((os.path.join(directory, os.fsdecode(name)) if name else directory, mask))
+        return events
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+# ---------------- Watcher ---------------- #
+
+class FolderWatcher:
+
+    def __init__(self, root: str, debounce: float = WATCH_DEBOUNCE, poll_interval: float = WATCH_POLL_INTERVAL,
+                 use_inotify: bool = True):
+        self.root = root
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self._pending: Dict[str, list] = {}   # path -> [first seen, last change (monotonic), (size, mtime)]
+        self._inotify: Optional[_Inotify] = None
+        self._unwatched = False                 # some directory could not be watched: rescan too
+        if use_inotify and sys.platform.startswith("linux"):
+            try:
+                self._inotify = _Inotify()
+                for directory, _ in _walk(root):
+                    self._inotify.add(directory)
+            except (OSError, AttributeError) as e:
+                print(f"inotify unavailable ({e}); polling {root} every {poll_interval:g}s")
+                if self._inotify is not None:
+                    self._inotify.close()
+                self._inotify = None
+        # Taken after the watches are in place, so nothing arrives unseen in between
+        self._known = self._scan()
+        self._next_scan = time.monotonic() + poll_interval
+
+    @property
+    def mode(self) -> str:
+        return "inotify" if self._inotify is not None else "polling"
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def _scan(self) -> Dict[str, Tuple[int, int]]:
+        found = {}
+        for path in find_pdfs(self.root):
+            st = _stat(path)
+            if st is not None:
+                found[path] = st
+        return found
+
+    def _touch(self, path: str) -> None:
+        """A PDF may have changed: start or restart its debounce."""
+        st = _stat(path)
+        if st is None:
+            # Deleted or moved away
+            self._pending.pop(path, None)
+            self._known.pop(path, None)
+            return
+        entry = self._pending.get(path)
+        if entry is None:
+            if self._known.get(path) != st:
+                self._pending[path] = [time.time(), time.monotonic(), st]
+        elif entry[2] != st:
+            entry[1], entry[2] = time.monotonic(), st
+
+    def _rescan(self) -> None:
+        current = self._scan()
+        for path in set(current) | set(self._known) | set(self._pending):
+            if current.get(path) != self._known.get(path) or path in self._pending:
+                self._touch(path)
+
+    def _new_directory(self, directory: str) -> None:
+        # Files copied in before the watch was added are found by the walk
+        for d, files in _walk(directory):
+            try:
+                self._inotify.add(d)
+            except OSError as e:
+                print(f"❌ Cannot watch {d} ({e}); rescanning {self.root} every {self.poll_interval:g}s")
+                self._unwatched = True
+            for f in files:
+                if _is_pdf(f):
+                    self._touch(os.path.join(d, f))
+
+    def poll(self, timeout: float = 1.0) -> List[Tuple[str, float]]:
+        """Wait up to timeout seconds for changes; returns [(path, first seen)] of files ready to process."""
+        if self._pending:
+            # Come back in time to see pending files settle
+            timeout = min(timeout, max(0.05, self.debounce / 2))
+        if self._inotify is not None:
+            for path, mask in self._inotify.read(timeout):
+                if path is None:
+                    self._rescan()
+                elif mask & _IN_ISDIR:
+                    if mask & (_IN_CREATE | _IN_MOVED_TO):
+                        self._new_directory(path)
+                elif _is_pdf(path):
+                    self._touch(path)
+            if self._unwatched and time.monotonic() >= self._next_scan:
+                self._rescan()
+                self._next_scan = time.monotonic() + self.poll_interval
+        else:
+            time.sleep(max(0.0, min(timeout, self._next_scan - time.monotonic())))
+            if time.monotonic() >= self._next_scan:
+                self._rescan()
+                self._next_scan = time.monotonic() + self.poll_interval
+        return self._ready()
+
+    def _ready(self) -> List[Tuple[str, float]]:
+        now = time.monotonic()
+        ready = []
+        for path, entry in list(self._pending.items()):
+            first_seen, last_change, st = entry
+            if now - last_change < self.debounce:
+                continue
+            current = _stat(path)
+            if current is None:
+                del self._pending[path]
+                continue
+            if current != st:
+                entry[1], entry[2] = now, current
+                continue
+            if not _has_trailer(path) and now - last_change < self.debounce * 10:
+                continue
+            del self._pending[path]
+            self._known[path] = st
+            ready.append((path, first_seen))
+        return sorted(ready)
+
+    def close(self) -> None:
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
@@ -1,29 +1,47 @@
 import os
-from openpyxl import Workbook, load_workbook
-from typing import Dict
+import json
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
+
+from config import EXCEL_FILE, EXCEL_FLUSH_EVERY, PROMPTS_FILE
+
+if TYPE_CHECKING:
+    from openpyxl import Workbook
+
+
+def columns_from_prompts(prompts_path: str = PROMPTS_FILE) -> List[str]:
+    """Output columns: json_schema keys of all prompts, in order (first occurrence wins)."""
+    with open(prompts_path, "r", encoding="utf-8") as f:
+        prompts = json.load(f)
+    columns = []
+    for p in prompts:
+        for key in (p.get("json_schema") or {}):
+            if key not in columns:
+                columns.append(key)
+    return columns
 
-from config import EXCEL_FILE
 
 # -----------------------------------------------------
 # Initialize Workbook
 # -----------------------------------------------------
-def _init_workbook() -> Workbook:
+def _init_workbook() -> "Workbook":
     """Initialize the workbook with a single sheet 'EXPORT' and required headers."""
+    from openpyxl import Workbook, load_workbook
+
     if os.path.exists(EXCEL_FILE):
         return load_workbook(EXCEL_FILE)
 
     wb = Workbook()
     ws = wb.active
     ws.title = "EXPORT"
-    ws.append([
-        "ISIN", "Bond Type", "Issuer", "Bond Size", "Currency", "Coupon",
-        "Issuance Date", "Maturity Date", "Exchange Listing", "Paying Agent",
-        "Moody's", "S&P", "Fitch", "Status of Notes", "Method of Distribution",
-        "Syndicate", "Source", "Comment", "Date"
-    ])
+    ws.append(columns_from_prompts())
     wb.save(EXCEL_FILE)
     return wb
 
+
+def _row_from_json(json_data: Dict, columns: List[str]) -> List:
+    """Map a parsed Term Sheet dict onto the EXPORT columns."""
+    return [json_data.get(h, "") for h in columns]
+
 # -----------------------------------------------------
 # Main Write Function
 # -----------------------------------------------------
@@ -31,32 +49,111 @@ def write_to_excel(json_data: Dict) -> None:
     """
     Write parsed Term Sheet JSON data into the EXPORT sheet.
     json_data: dictionary output from parser.py
+    Loads and saves the whole workbook per call; use ExcelWriterSession for batches.
     """
     wb = _init_workbook()
     ws = wb["EXPORT"]
 
-    row = [
-        json_data.get("ISIN", ""),
-        json_data.get("Bond Type", ""),
-        json_data.get("Issuer", ""),
-        json_data.get("Bond Size", ""),
-        json_data.get("Currency", ""),
-        json_data.get("Coupon", ""),
-        json_data.get("Issuance Date", ""),
-        json_data.get("Maturity Date", ""),
-        json_data.get("Exchange Listing", ""),
-        json_data.get("Paying Agent", ""),
-        json_data.get("Moody's", ""),
-        json_data.get("S&P", ""),
-        json_data.get("Fitch", ""),
-        json_data.get("Status of Notes", ""),
-        json_data.get("Method of Distribution", ""),
-        json_data.get("Syndicate", ""),
-        json_data.get("Source", ""),
-        json_data.get("Comment", ""),
-        json_data.get("Date", "")
-    ]
-
-    ws.append(row)
+    ws.append(_row_from_json(json_data, columns_from_prompts()))
     wb.save(EXCEL_FILE)
     print(f"✅ Data written successfully for ISIN: {json_data.get('ISIN', '')}")
+
+# -----------------------------------------------------
+# Buffered Writer Session
+# -----------------------------------------------------
+class ExcelWriterSession:
+    """
+    Keeps the workbook open for a whole run and buffers rows.
+    - New file: rows are streamed through openpyxl's write-only mode and the
+      file is saved once, at close.
+    - Existing file: loaded once; rows are appended to EXPORT and the file is
+      saved every `flush_every` rows and at close.
+    Rows can be tagged with a document key; on_flush(keys) is called once
+    those rows are saved to disk (used by main.py's processing journal).
+
+        with ExcelWriterSession() as session:
+            session.write(json_data)
+    """
+
+    def __init__(self, path: str = EXCEL_FILE, flush_every: int = EXCEL_FLUSH_EVERY,
+                 on_flush: Optional[Callable[[List[str]], None]] = None,
+                 columns: Optional[List[str]] = None):
+        self.path = path
+        self.columns = columns or columns_from_prompts()
+        self.flush_every = max(1, flush_every)
+        self.on_flush = on_flush
+        self.rows_written = 0
+        self._buffer: List[List] = []
+        self._unsaved_keys: List[str] = []
+        self._wb = None
+        self._ws = None
+        self._write_only = False
+
+    def open(self) -> "ExcelWriterSession":
+        # openpyxl is only imported once a workbook is actually written
+        from openpyxl import Workbook, load_workbook
+
+        if os.path.exists(self.path):
+            self._wb = load_workbook(self.path)
+            if "EXPORT" in self._wb.sheetnames:
+                self._ws = self._wb["EXPORT"]
+            else:
+                self._ws = self._wb.create_sheet("EXPORT")
+                self._ws.append(self.columns)
+        else:
+            self._write_only = True
+            self._wb = Workbook(write_only=True)
+            self._ws = self._wb.create_sheet("EXPORT")
+            self._ws.append(self.columns)
+        return self
+
+    def write(self, json_data: Dict, key: Optional[str] = None) -> None:
+        """Buffer one parsed Term Sheet row."""
+        self.write_many([json_data], key=key)
+
+    def write_many(self, rows: List[Dict], key: Optional[str] = None) -> None:
+        """Buffer all rows of one document; they are always saved together."""
+        if self._wb is None:
+            self.open()
+        self._buffer.extend(_row_from_json(r, self.columns) for r in rows)
+        if key is not None:
+            self._unsaved_keys.append(key)
+        if len(self._buffer) >= self.flush_every:
+            self.flush()
+
+    def _drain(self) -> None:
+        for row in self._buffer:
+            self._ws.append(row)
+        self.rows_written += len(self._buffer)
+        self._buffer = []
+
+    def flush(self) -> None:
+        """Move buffered rows into the sheet; saves to disk unless write-only."""
+        self._drain()
+        # A write-only workbook can only be saved once, so it is saved in close()
+        if not self._write_only:
+            self._save()
+
+    def close(self) -> None:
+        if self._wb is None:
+            return
+        self._drain()
+        self._save()
+        self._wb = None
+        self._ws = None
+        print(f"✅ {self.rows_written} rows written to {self.path}")
+
+    def _save(self) -> None:
+        # Save next to the target and swap in, so a crash never leaves a truncated file
+        tmp_path = self.path + ".tmp"
+        self._wb.save(tmp_path)
+        os.replace(tmp_path, self.path)
+        keys, self._unsaved_keys = self._unsaved_keys, []
+        if self.on_flush and keys:
+            self.on_flush(keys)
+
+    def __enter__(self) -> "ExcelWriterSession":
+        return self.open()
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()